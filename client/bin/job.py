@@ -485,7 +485,12 @@ class base_client_job(base_job.base_job):
 
     def _runtest(self, url, tag, timeout, args, dargs):
         try:
-            l = lambda : test.runtest(self, url, tag, args, dargs)
+            def l():
+                try:
+                    test.runtest(self, url, tag, args, dargs)
+                finally:
+                    self._state.flush()
+            self._state.flush()
             pid = parallel.fork_start(self.resultdir, l)
 
             self._forkwait(pid, timeout)
@@ -650,6 +655,8 @@ class base_client_job(base_job.base_job):
                         optional_fields=optional_fields)
 
             self._state.set('client', 'unexpected_reboot', (subdir, testname))
+            # The marker has to be on disk if the machine crashes in function.
+            self._state.flush()
             try:
                 result = function(*args, **dargs)
                 self.record('END GOOD', subdir, testname)
@@ -671,6 +678,7 @@ class base_client_job(base_job.base_job):
                 raise
         finally:
             self._state.discard('client', 'unexpected_reboot')
+            self._state.flush()
 
 
     def run_group(self, function, tag=None, **dargs):
@@ -798,6 +806,8 @@ class base_client_job(base_job.base_job):
         mount_info = partition_lib.get_mount_info(partition_list)
         self._state.set('client', 'mount_info', mount_info)
         self._state.set('client', 'cpu_count', utils.count_cpus())
+        # The state has to be on disk before the machine reboots.
+        self._state.flush()
 
 
     def reboot(self):
@@ -835,7 +845,11 @@ class base_client_job(base_job.base_job):
                     '_state', '_record_indent.%d' % os.getpid(),
                     base_record_indent, namespace='client')
                 self.__class__._record_indent = proc_local
-                task[0](*task[1:])
+                try:
+                    task[0](*task[1:])
+                finally:
+                    self._state.flush()
+            self._state.flush()
             forked_pid = parallel.fork_start(self.resultdir, task_func)
             logging.info('Just forked pid %d', forked_pid)
             pids.append(forked_pid)
@@ -883,6 +897,7 @@ class base_client_job(base_job.base_job):
             logging.error("Error writing job HTML report: %s", e)
 
         # We are about to exit 'complete' so clean up the control file.
+        self._state.flush()
         dest = os.path.join(self.resultdir, os.path.basename(self._state_file))
         shutil.move(self._state_file, dest)
 
@@ -897,7 +912,11 @@ class base_client_job(base_job.base_job):
         self._state_file = self.control + '.state'
         if os.path.exists(init_state_file):
             shutil.move(init_state_file, self._state_file)
-        self._state.set_backing_file(self._state_file)
+        self._state.set_backing_file(
+                self._state_file,
+                write_behind=GLOBAL_CONFIG.get_config_value(
+                        'CLIENT', 'job_state_write_behind', type=bool,
+                        default=False))
 
         # initialize the state engine, if necessary
         has_steps = self._state.has('client', 'steps')
@@ -908,6 +927,7 @@ class base_client_job(base_job.base_job):
         if not has_steps:
             logging.debug('Initializing the state engine')
             self._state.set('client', 'steps', [])
+            self._state.flush()
 
 
     def handle_persistent_option(self, options, option_name):
@@ -925,6 +945,7 @@ class base_client_job(base_job.base_job):
         if cmd_line_option:
             option = cmd_line_option
             self._state.set('client', option_name, option)
+            self._state.flush()
         else:
             stored_option = self._state.get('client', option_name, None)
             if stored_option:
@@ -958,6 +979,7 @@ class base_client_job(base_job.base_job):
         steps = self._state.get('client', 'steps')
         steps.append(self.__create_step_tuple(fn, args, dargs))
         self._state.set('client', 'steps', steps)
+        self._state.flush()
 
 
     def next_step(self, fn, *args, **dargs):
@@ -969,6 +991,7 @@ class base_client_job(base_job.base_job):
                      self.__create_step_tuple(fn, args, dargs))
         self._next_step_index += 1
         self._state.set('client', 'steps', steps)
+        self._state.flush()
 
 
     def next_step_prepend(self, fn, *args, **dargs):
@@ -977,6 +1000,7 @@ class base_client_job(base_job.base_job):
         steps.insert(0, self.__create_step_tuple(fn, args, dargs))
         self._next_step_index += 1
         self._state.set('client', 'steps', steps)
+        self._state.flush()
 
 
 
@@ -1092,6 +1116,8 @@ class base_client_job(base_job.base_job):
             steps = self._state.get('client', 'steps')
             (ancestry, fn_name, args, dargs) = steps.pop(0)
             self._state.set('client', 'steps', steps)
+            # Don't run the step again if the machine reboots during it.
+            self._state.flush()
 
             self._next_step_index = 0
             ret = self._create_frame(global_control_vars, ancestry, fn_name)
@@ -1126,6 +1152,7 @@ class base_client_job(base_job.base_job):
     def _save_sysinfo_state(self):
         state = self.sysinfo.serialize()
         self._state.set('client', 'sysinfo', state)
+        self._state.flush()
 
 
 class disk_usage_monitor:
@@ -1218,6 +1245,8 @@ def runjob(control, drop_caches, options):
         myjob.step_engine()
 
     except error.JobContinue:
+        if myjob:
+            myjob._state.flush()
         sys.exit(5)
 
     except error.JobComplete:
@@ -517,6 +517,32 @@ class test_base_job(unittest.TestCase):
         self.god.check_playback()
 
 
+    def test_rungroup_writes_unexpected_reboot_marker(self):
+        self.construct_job(True)
+        _, state_file = tempfile.mkstemp()
+        # os.remove is stubbed until tearDown.
+        self.addCleanup(lambda: os.remove(state_file))
+        self.job._state.set_backing_file(state_file, write_behind=True)
+
+        def read_marker():
+            on_disk_state = job.base_job.job_state()
+            on_disk_state.read_from_file(state_file)
+            return on_disk_state.get('client', 'unexpected_reboot', None)
+
+        # record
+        self.job.record.expect_call('START', None, 'group',
+                                    optional_fields=None)
+        self.job.record.expect_call('END GOOD', None, 'group')
+
+        # playback
+        markers = []
+        self.job._rungroup(None, 'group', lambda: markers.append(read_marker()),
+                           None)
+        self.assertEqual(markers, [(None, 'group')])
+        self.assertEqual(read_marker(), None)
+        self.god.check_playback()
+
+
     def test_parse_args(self):
         test_set = {"a='foo bar baz' b='moo apt'":
                     ["a='foo bar baz'", "b='moo apt'"],
@@ -6,8 +6,15 @@
 prefix, for example, screenshots or dumps in the same folder. The dedupe logic
 does not compare the file content, instead, it sorts the files with the same
 prefix and remove files in the middle part.
+
+With compare_content set, the throttler instead removes files whose content
+is byte-identical to another result file, e.g., repeated crash dumps or
+identical logs across iterations. Nothing is lost: the summary of a removed
+file records the path of the file it duplicates, and the throttlers leave that
+file as it is.
 """
 
+import hashlib
 import os
 import re
 
@@ -32,6 +39,14 @@ NO_DEDUPE_FILE_PATTERNS = [
 # regex pattern to get the prefix of a file.
 PREFIX_PATTERN = '([a-zA-Z_-]*).*'
 
+# Files smaller than this are not worth hashing and referencing in the summary.
+MIN_CONTENT_DEDUPE_SIZE_BYTE = 1024
+# Number of bytes at the start of files hashed to tell apart files of the same
+# size, before hashing them in full.
+PARTIAL_HASH_SIZE_BYTE = 64 * 1024
+# Size of the chunks files are read in when they are hashed.
+HASH_CHUNK_SIZE_BYTE = 1024 * 1024
+
 def _group_by(file_infos, keys):
     """Group the file infos by the given keys.
 
@@ -72,7 +87,106 @@ def _dedupe_files(summary, file_infos, max_result_size_KB):
                 return
 
 
-def throttle(summary, max_result_size_KB):
+def _hash_file(path, max_bytes=None):
+    """Get the sha1 of a file, reading it in chunks.
+
+    @param path: Path to the file.
+    @param max_bytes: If set, only hash the first max_bytes of the file.
+    @return: The hex digest of the file, or None if the file can't be read.
+    """
+    sha1 = hashlib.sha1()
+    remaining = max_bytes
+    try:
+        with open(path, 'rb') as f:
+            while remaining is None or remaining > 0:
+                chunk_size = HASH_CHUNK_SIZE_BYTE
+                if remaining is not None:
+                    chunk_size = min(chunk_size, remaining)
+                    remaining -= chunk_size
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                sha1.update(chunk)
+    except IOError as e:
+        utils_lib.LOG('Failed to hash file %s, Error: %s' % (path, e))
+        return None
+    return sha1.hexdigest()
+
+
+def _group_identical_files(file_infos):
+    """Group files with identical content.
+
+    Files are first grouped by size, then by a hash of their first
+    PARTIAL_HASH_SIZE_BYTE bytes, and only files still colliding are hashed
+    in full. Most files are never read at all.
+
+    @param file_infos: A list of ResultInfo objects.
+    @return: A list of lists of ResultInfo objects with identical content.
+            Each list has at least 2 items.
+    """
+    by_size = {}
+    for info in file_infos:
+        by_size.setdefault(info.trimmed_size, []).append(info)
+
+    identical_groups = []
+    for size, same_size_infos in by_size.iteritems():
+        if len(same_size_infos) < 2:
+            continue
+        candidates = [same_size_infos]
+        hash_sizes = [PARTIAL_HASH_SIZE_BYTE]
+        if size > PARTIAL_HASH_SIZE_BYTE:
+            hash_sizes.append(None)
+        for hash_size in hash_sizes:
+            new_candidates = []
+            for infos in candidates:
+                by_hash = {}
+                for info in infos:
+                    digest = _hash_file(info.path, hash_size)
+                    if digest is not None:
+                        by_hash.setdefault(digest, []).append(info)
+                new_candidates.extend(
+                        group for group in by_hash.values() if len(group) > 1)
+            candidates = new_candidates
+        identical_groups.extend(candidates)
+    return identical_groups
+
+
+def _dedupe_identical_files(summary, max_result_size_KB):
+    """Delete files whose content is identical to another result file.
+
+    For each group of identical files, the file with the smallest path is
+    kept, and the others point to it in the summary.
+
+    @param summary: A ResultInfo object containing result summary.
+    @param max_result_size_KB: Maximum test result size in KB.
+    """
+    file_infos = [
+            info for info in throttler_lib.get_throttleable_files(
+                    throttler_lib.sort_result_files(summary)[0],
+                    NO_DEDUPE_FILE_PATTERNS)
+            # Only files that were not trimmed are identical to the content
+            # on disk.
+            if (info.trimmed_size == info.original_size and
+                info.trimmed_size >= MIN_CONTENT_DEDUPE_SIZE_BYTE)]
+    groups = _group_identical_files(file_infos)
+    # Remove the largest duplicates first.
+    groups.sort(key=lambda infos: -infos[0].trimmed_size)
+    for infos in groups:
+        infos.sort(key=lambda info: info.path)
+        kept_path = os.path.relpath(infos[0].path, summary.path)
+        utils_lib.LOG('De-duplicating %d files identical to %s' %
+                      (len(infos) - 1, kept_path))
+        for file_info in infos[1:]:
+            if throttler_lib.try_delete_file_on_disk(file_info.path):
+                file_info.duplicate_of = kept_path
+                file_info.trimmed_size = 0
+
+                if throttler_lib.check_throttle_limit(summary,
+                                                      max_result_size_KB):
+                    return
+
+
+def throttle(summary, max_result_size_KB, compare_content=False):
     """Throttle the files in summary by de-duplicating files.
 
     Stop throttling until all files are processed or the result size is already
@@ -80,7 +194,13 @@ def throttle(summary, max_result_size_KB):
 
     @param summary: A ResultInfo object containing result summary.
     @param max_result_size_KB: Maximum test result size in KB.
+    @param compare_content: True to only remove files whose content is
+            identical to another file, rather than files sharing a prefix.
     """
+    if compare_content:
+        _dedupe_identical_files(summary, max_result_size_KB)
+        return
+
     _, grouped_files = throttler_lib.sort_result_files(summary)
     for pattern in throttler_lib.RESULT_THROTTLE_PRIORITY:
         throttable_files = list(throttler_lib.get_throttleable_files(
@@ -87,6 +87,62 @@ class DedupeFileThrottleTest(unittest.TestCase):
             self.assertFalse(os.path.exists(f), 'File %s is not deleted!' % f)
 
 
+class DedupeIdenticalFileThrottleTest(unittest.TestCase):
+    """Test class for dedupe_file_throttler.throttle with compare_content."""
+
+    def setUp(self):
+        """Setup directory for test."""
+        self.test_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.test_dir, 'folder1'))
+        size = dedupe_file_throttler.MIN_CONTENT_DEDUPE_SIZE_BYTE * 4
+        # Identical files.
+        self._create_file('crash_a.dmp', 'A' * size)
+        self._create_file('folder1/crash_b.dmp', 'A' * size)
+        self._create_file('folder1/crash_c.dmp', 'A' * size)
+        # Same size and first bytes, different content.
+        self._create_file('log_1', 'A' * (size - 1) + 'B')
+        # Identical, but too small to be deduped.
+        self._create_file('small_1', 'C')
+        self._create_file('small_2', 'C')
+
+    def tearDown(self):
+        """Cleanup the test directory."""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _create_file(self, name, content):
+        """Create a file with the given content under the test directory."""
+        with open(os.path.join(self.test_dir, name), 'w') as f:
+            f.write(content)
+
+    def testTrim(self):
+        """Test throttle method removes files with identical content."""
+        old_partial_size = dedupe_file_throttler.PARTIAL_HASH_SIZE_BYTE
+        # Make sure the full hash is needed to tell log_1 apart.
+        dedupe_file_throttler.PARTIAL_HASH_SIZE_BYTE = 16
+        try:
+            summary = result_info.ResultInfo.build_from_path(self.test_dir)
+            dedupe_file_throttler.throttle(
+                    summary, max_result_size_KB=MAX_RESULT_SIZE_KB,
+                    compare_content=True)
+        finally:
+            dedupe_file_throttler.PARTIAL_HASH_SIZE_BYTE = old_partial_size
+
+        size = dedupe_file_throttler.MIN_CONTENT_DEDUPE_SIZE_BYTE * 4
+        self.assertEqual(2 * size + 2, summary.trimmed_size)
+        for name in ('crash_a.dmp', 'log_1', 'small_1', 'small_2'):
+            self.assertTrue(os.path.exists(os.path.join(self.test_dir, name)),
+                            'File %s should not be deleted!' % name)
+            self.assertIsNone(summary.get_file(name).duplicate_of)
+        for name in ('crash_b.dmp', 'crash_c.dmp'):
+            self.assertFalse(
+                    os.path.exists(os.path.join(self.test_dir, 'folder1',
+                                                name)),
+                    'File %s is not deleted!' % name)
+            info = summary.get_file('folder1').get_file(name)
+            self.assertEqual('crash_a.dmp', info.duplicate_of)
+            self.assertEqual(0, info.trimmed_size)
+
+
 # this is so the test can be run in standalone mode
 if __name__ == '__main__':
     """Main"""
@@ -8,10 +8,21 @@
 import contextlib
 import json
 import os
+import stat
 
 import result_info_lib
 import utils_lib
 
+try:
+    from os import scandir as _scandir
+except ImportError:
+    # Python 2 only has scandir as a separate package, which may not be
+    # installed on the DUT.
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
 
 class ResultInfoError(Exception):
     """Exception to raise when error occurs in ResultInfo collection."""
@@ -109,12 +120,26 @@ class ResultInfo(dict):
                 restored from a json string.
         """
         super(ResultInfo, self).__init__()
+        self._init_state(parent_result_info)
 
         if name is not None and original_info is not None:
             raise ResultInfoError(
                     'Only one of parameter `name` and `original_info` can be '
                     'set.')
 
+        if original_info is None:
+            self._init_from_file(parent_dir, name)
+        else:
+            self._init_with_original_info(parent_dir, original_info)
+
+        self._initialized = True
+
+    def _init_state(self, parent_result_info):
+        """Initialize the attributes shared by all ways of construction.
+
+        @param parent_result_info: A ResultInfo object for the parent directory.
+        """
+
         # _initialized is a flag to indicating the object is in constructor.
         # It can be used to block any size update to make restoring from json
         # string faster. For example, if file_details has sub-directories,
@@ -122,15 +147,27 @@ class ResultInfo(dict):
         # the size updates can reduce unnecessary calculations.
         self._initialized = False
         self._parent_result_info = parent_result_info
-
-        if original_info is None:
-            self._init_from_file(parent_dir, name)
-        else:
-            self._init_with_original_info(parent_dir, original_info)
-
         # Size of bytes collected in an overwritten or removed directory.
         self._previous_collected_size = 0
-        self._initialized = True
+
+    @staticmethod
+    def _from_scan(parent_dir, name, parent_result_info, is_dir, size):
+        """Create a ResultInfo from information already read by a dir scan.
+
+        Unlike the constructor, this does not touch the file system.
+
+        @param parent_dir: Path to the parent directory.
+        @param name: Name of the result file or directory.
+        @param parent_result_info: A ResultInfo object for the parent directory.
+        @param is_dir: True if the result is a directory.
+        @param size: Size in bytes of the file, ignored for directories.
+        @return: A ResultInfo instance.
+        """
+        info = ResultInfo.__new__(ResultInfo)
+        info._init_state(parent_result_info)
+        info._init_node(parent_dir, name, is_dir, size)
+        info._initialized = True
+        return info
 
     def _init_from_file(self, parent_dir, name):
         """Initialize with the physical file.
@@ -139,6 +176,20 @@ class ResultInfo(dict):
         @param name: Name of the result file or directory.
         """
         assert name != None
+        # rstrip is to remove / when name is ROOT_DIR ('').
+        path = os.path.join(parent_dir, name).rstrip(os.sep)
+        is_dir = os.path.isdir(path)
+        size = 0 if is_dir else result_info_lib.get_file_size(path)
+        self._init_node(parent_dir, name, is_dir, size)
+
+    def _init_node(self, parent_dir, name, is_dir, size):
+        """Initialize the details of a physical file or directory.
+
+        @param parent_dir: Path to the parent directory.
+        @param name: Name of the result file or directory.
+        @param is_dir: True if the result is a directory.
+        @param size: Size in bytes of the file, ignored for directories.
+        """
         self._name = name
 
         # Dictionary to store details of the given path is set to a keyval of
@@ -149,7 +200,7 @@ class ResultInfo(dict):
 
         # rstrip is to remove / when name is ROOT_DIR ('').
         self._path = os.path.join(parent_dir, self.name).rstrip(os.sep)
-        self._is_dir = os.path.isdir(self._path)
+        self._is_dir = is_dir
 
         if self.is_dir:
             # The value of key utils_lib.DIRS is a list of ResultInfo objects.
@@ -162,7 +213,7 @@ class ResultInfo(dict):
             # sub-directories are added.
             self.original_size = 0
         else:
-            self.original_size = self.size
+            self.original_size = size
 
     def _init_with_original_info(self, parent_dir, original_info):
         """Initialize with pre-collected information.
@@ -203,6 +254,9 @@ class ResultInfo(dict):
         if utils_lib.TRIMMED_SIZE_BYTES in original_info[self.name]:
             self.trimmed_size = original_info[self.name][
                     utils_lib.TRIMMED_SIZE_BYTES]
+        if utils_lib.DUPLICATE_OF in original_info[self.name]:
+            self.duplicate_of = original_info[self.name][
+                    utils_lib.DUPLICATE_OF]
         if self.is_dir:
             dirs = original_info[self.name][utils_lib.DIRS]
             # TODO: Remove this conversion after R62 is in stable channel.
@@ -254,7 +308,6 @@ class ResultInfo(dict):
 
         @return: A ResultInfo instance containing the directory summary.
         """
-        is_top_level = top_dir is None
         top_dir = top_dir or parent_dir
         all_dirs = all_dirs or set()
 
@@ -271,34 +324,47 @@ class ResultInfo(dict):
         dir_info = ResultInfo(parent_dir=parent_dir,
                               name=name,
                               parent_result_info=parent_result_info)
+        if dir_info.is_dir:
+            dir_info._scan_dir(top_dir, all_dirs)
+        return dir_info
 
-        path = os.path.join(parent_dir, name)
-        if os.path.isdir(path):
-            real_path = os.path.realpath(path)
-            # The assumption here is that results are copied back to drone by
-            # copying the symlink, not the content, which is true with currently
-            # used rsync in cros_host.get_file call.
-            # Skip scanning the child folders if any of following condition is
-            # true:
-            # 1. The directory is a symlink and link to a folder under `top_dir`
-            # 2. The directory was scanned already.
-            if ((os.path.islink(path) and real_path.startswith(top_dir)) or
-                real_path in all_dirs):
-                return dir_info
-            all_dirs.add(real_path)
-            for f in sorted(os.listdir(path)):
-                dir_info.files.append(ResultInfo.build_from_path(
-                        parent_dir=path,
-                        name=f,
-                        parent_result_info=dir_info,
-                        top_dir=top_dir,
-                        all_dirs=all_dirs))
-
-        # Update all directory's original size at the end of the tree building.
-        if is_top_level:
-            dir_info.update_dir_original_size()
+    def _scan_dir(self, top_dir, all_dirs):
+        """Add all files under this directory, recursively.
 
-        return dir_info
+        This is a single pass over the tree: every entry is stat-ed at most
+        once, and the original size of each directory is computed from its
+        children right after they are scanned, without walking up to the
+        parents.
+
+        @param top_dir: The top directory to collect ResultInfo.
+        @param all_dirs: A set of real paths that have been collected.
+        @return: The original size in bytes of the directory.
+        """
+        # The assumption here is that results are copied back to drone by
+        # copying the symlink, not the content, which is true with currently
+        # used rsync in cros_host.get_file call.
+        # Skip scanning the child folders if any of following condition is
+        # true:
+        # 1. The directory is a symlink and link to a folder under `top_dir`
+        # 2. The directory was scanned already.
+        real_path = os.path.realpath(self._path)
+        if ((os.path.islink(self._path) and real_path.startswith(top_dir)) or
+            real_path in all_dirs):
+            return 0
+        all_dirs.add(real_path)
+
+        total_size = 0
+        files = self.files
+        for name, is_dir, size in _list_dir(self._path):
+            info = ResultInfo._from_scan(self._path, name, self, is_dir, size)
+            if is_dir:
+                size = info._scan_dir(top_dir, all_dirs)
+            files.append(info)
+            total_size += size
+        # Set the size directly, the original_size setter would update all
+        # the parents, which are not done scanning yet.
+        self.details[utils_lib.ORIGINAL_SIZE_BYTES] = total_size
+        return total_size
 
     @property
     def details(self):
@@ -412,6 +478,23 @@ class ResultInfo(dict):
         if self._initialized and self._parent_result_info is not None:
             self._parent_result_info.update_collected_size()
 
+    @property
+    def duplicate_of(self):
+        """Path of a file with the same content, relative to the result root.
+
+        It's only set for files removed as a duplicate of another file,
+        otherwise it's None.
+        """
+        return self.details.get(utils_lib.DUPLICATE_OF)
+
+    @duplicate_of.setter
+    def duplicate_of(self, value):
+        """Set the path of a file with the same content.
+
+        @param value: Path of the file, relative to the result root.
+        """
+        self.details[utils_lib.DUPLICATE_OF] = value
+
     @property
     def is_collected_size_recorded(self):
         """Flag to indicate if the result has collected size set.
@@ -511,7 +594,7 @@ class ResultInfo(dict):
                     f.original_size for f in self.files])
         elif self.original_size is None:
             # Only set original_size if it's not initialized yet.
-            self.orginal_size = self.size
+            self.original_size = self.size
 
         # Update the size of parent result infos.
         if not skip_parent_update and self._parent_result_info is not None:
@@ -718,6 +801,40 @@ class ResultInfo(dict):
             self.update_sizes()
 
 
+def _list_dir(path):
+    """List the entries of a directory with their type and size.
+
+    Uses scandir when available, which gets the type of most entries from
+    the directory listing itself. Otherwise every entry is stat-ed once.
+    Like os.path.isdir and os.stat, symlinks are followed. Entries that
+    disappear or can't be stat-ed are listed as empty files.
+
+    @param path: Path to the directory.
+    @return: A list of (name, is_dir, size) tuples, sorted by name. size is
+            0 for directories.
+    """
+    entries = []
+    if _scandir is not None:
+        for entry in _scandir(path):
+            try:
+                is_dir = entry.is_dir()
+                size = 0 if is_dir else entry.stat().st_size
+            except OSError:
+                is_dir, size = False, 0
+            entries.append((entry.name, is_dir, size))
+    else:
+        for name in os.listdir(path):
+            try:
+                st = os.stat(os.path.join(path, name))
+            except OSError:
+                entries.append((name, False, 0))
+                continue
+            is_dir = stat.S_ISDIR(st.st_mode)
+            entries.append((name, is_dir, 0 if is_dir else st.st_size))
+    entries.sort()
+    return entries
+
+
 # An empty directory, used to compare with a ResultInfo.
 EMPTY = ResultInfo(parent_dir='',
                    original_info={'': {utils_lib.ORIGINAL_SIZE_BYTES: 0,
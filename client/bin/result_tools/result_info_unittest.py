@@ -140,6 +140,39 @@ class ResultInfoUnittest(unittest.TestCase):
         summary = result_info.ResultInfo.build_from_path(file1)
         self.assertEqual(_EXPECTED_SINGLE_FILE_SUMMARY, summary)
 
+    def testBuildFromPath_Tree(self):
+        """Test method build_from_path computes sizes of nested directories.
+        """
+        unittest_lib.create_file(os.path.join(self.test_dir, 'file1'), _SIZE)
+        os.makedirs(os.path.join(self.test_dir, 'folder1', 'folder2'))
+        unittest_lib.create_file(
+                os.path.join(self.test_dir, 'folder1', 'folder2', 'file2'),
+                2 * _SIZE)
+        os.symlink(os.path.join(self.test_dir, 'missing'),
+                   os.path.join(self.test_dir, 'folder1', 'broken_link'))
+        summary = result_info.ResultInfo.build_from_path(self.test_dir)
+
+        expected = {
+            '': {utils_lib.ORIGINAL_SIZE_BYTES: 3 * _SIZE,
+                 utils_lib.DIRS: [
+                     {'file1': {utils_lib.ORIGINAL_SIZE_BYTES: _SIZE}},
+                     {'folder1': {
+                         utils_lib.ORIGINAL_SIZE_BYTES: 2 * _SIZE,
+                         utils_lib.DIRS: [
+                             {'broken_link': {
+                                 utils_lib.ORIGINAL_SIZE_BYTES: 0}},
+                             {'folder2': {
+                                 utils_lib.ORIGINAL_SIZE_BYTES: 2 * _SIZE,
+                                 utils_lib.DIRS: [
+                                     {'file2': {utils_lib.ORIGINAL_SIZE_BYTES:
+                                                2 * _SIZE}}]}}]}}]}}
+        self.assertEqual(expected, summary)
+        # Size updates still propagate to the parents after the scan.
+        file2 = summary.get_file('folder1').get_file('folder2').get_file(
+                'file2')
+        file2.trimmed_size = _SIZE
+        self.assertEqual(summary.trimmed_size, 2 * _SIZE)
+
 
 # this is so the test can be run in standalone mode
 if __name__ == '__main__':
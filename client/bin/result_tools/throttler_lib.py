@@ -73,9 +73,21 @@ def _list_files(files, all_files=None):
     return all_files
 
 
+def _get_dedupe_targets(all_files):
+    """Get the files that other files were de-duplicated to.
+
+    @param all_files: A list of ResultInfo objects of all the files in summary.
+    @return: A set of paths of the files, relative to the result root.
+    """
+    return set(info.duplicate_of for info in all_files if info.duplicate_of)
+
+
 def sort_result_files(summary):
     """Sort result infos based on priority.
 
+    Files that other files were de-duplicated to are left out, so that
+    throttling them doesn't break the references of the summary.
+
     @param summary: A ResultInfo object containing result summary.
     @return: A tuple of (sorted_files, grouped_files)
             sorted_files: A list of ResultInfo, sorted based on file size and
@@ -84,6 +96,11 @@ def sort_result_files(summary):
                 RESULT_THROTTLE_PRIORITY.
     """
     all_files = _list_files(summary.files)
+    dedupe_targets = _get_dedupe_targets(all_files)
+    if dedupe_targets:
+        all_files = [info for info in all_files
+                     if os.path.relpath(info.path, summary.path)
+                     not in dedupe_targets]
 
     # Scan all file paths and group them based on the throttle priority.
     grouped_files = {pattern: [] for pattern in RESULT_THROTTLE_PRIORITY}
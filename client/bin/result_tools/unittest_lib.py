@@ -8,8 +8,11 @@ SIZE = 10
 def create_file(path, size=SIZE):
     """Create a temp file at given path with the given size.
 
+    The file ends with its path, so that files of the same size don't have
+    identical content.
+
     @param path: Path to the temp file.
     @param size: Size of the temp file, default to SIZE.
     """
     with open(path, 'w') as f:
-        f.write('A' * size)
\ No newline at end of file
+        f.write(('A' * size + path)[-size:] if size else '')
\ No newline at end of file
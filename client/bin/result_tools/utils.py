@@ -262,8 +262,13 @@ def _throttle_results(summary, max_result_size_KB):
             'max_result_size_KB': max_result_size_KB}
     args_skip_autotest_log = copy.copy(args)
     args_skip_autotest_log['skip_autotest_log'] = True
+    args_compare_content = copy.copy(args)
+    args_compare_content['compare_content'] = True
     # Apply the throttlers in following order.
     throttlers = [
+            # Removing files identical to other files loses no information,
+            # so do it first.
+            (dedupe_file_throttler, args_compare_content),
             (shrink_file_throttler, copy.copy(args_skip_autotest_log)),
             (zip_file_throttler, copy.copy(args_skip_autotest_log)),
             (shrink_file_throttler, copy.copy(args)),
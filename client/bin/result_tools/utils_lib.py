@@ -25,6 +25,9 @@ TRIMMED_SIZE_BYTES = '/T'
 COLLECTED_SIZE_BYTES = '/C'
 # A dictionary of sub-directories' summary: name: {directory_summary}
 DIRS = '/D'
+# Path, relative to the result root, of a file with identical content. It is
+# set on files removed by content based de-duplication.
+DUPLICATE_OF = '/R'
 # Default root directory name. To allow summaries to be merged effectively, all
 # summaries are collected with root directory of ''
 ROOT_DIR = ''
@@ -535,6 +535,28 @@ class ThrottleTest(unittest.TestCase):
         self.assertEqual(0, entry.trimmed_size)
         self.assertEqual(LARGE_SIZE, entry.original_size)
 
+    def testThrottleResults_DedupeTargetKept(self):
+        """Test that the files others are duplicates of aren't throttled."""
+        folder = os.path.join(self.test_dir, 'files_identical')
+        os.mkdir(folder)
+        for name in ('crash_1.log', 'crash_2.log'):
+            with open(os.path.join(folder, name), 'w') as f:
+                f.write('A' * LARGE_SIZE)
+        summary = result_info.ResultInfo.build_from_path(self.test_dir)
+        result_utils._throttle_results(summary, 1)
+
+        kept_path = os.path.join(folder, 'crash_1.log')
+        self.assertEqual(LARGE_SIZE, os.stat(kept_path).st_size)
+        entry = summary.get_file('files_identical').get_file('crash_1.log')
+        self.assertEqual(LARGE_SIZE, entry.trimmed_size)
+        self.assertFalse(os.path.exists(kept_path + '.tgz'))
+        entry = summary.get_file('files_identical').get_file('crash_2.log')
+        self.assertEqual('files_identical/crash_1.log', entry.duplicate_of)
+        self.assertEqual(0, entry.trimmed_size)
+        # The other files are throttled still.
+        entry = summary.get_file('files_to_delete').get_file('file.png')
+        self.assertEqual(0, entry.trimmed_size)
+
 
 # this is so the test can be run in standalone mode
 if __name__ == '__main__':
@@ -5,9 +5,12 @@
 """This throttler tries to reduce result size by compress files to tgz file.
 """
 
+import multiprocessing
 import re
 import os
 import tarfile
+import time
+from multiprocessing import pool
 
 import throttler_lib
 import utils_lib
@@ -16,9 +19,11 @@ import utils_lib
 # File with extensions that can not be zipped or compression won't reduce file
 # size further.
 UNZIPPABLE_EXTENSIONS = set([
+        '.bz2',
         '.gz',
         '.jpg',
         '.png',
+        '.tbz2',
         '.tgz',
         '.xz',
         '.zip',
@@ -33,32 +38,82 @@ UNZIPPABLE_FILE_PATTERNS = [
 # Files smaller than the threshold will not be compressed.
 DEFAULT_FILE_SIZE_THRESHOLD_BYTE = 100 * 1024
 
-def _zip_file(file_info):
-    """Zip the file to reduce the file size.
+
+def _get_default_max_workers():
+    """Get the default number of files to compress concurrently.
+
+    Use half of the CPUs, so the DUT or drone stays responsive.
+    """
+    try:
+        return max(1, multiprocessing.cpu_count() // 2)
+    except NotImplementedError:
+        return 1
+
+
+# Default number of files to compress concurrently.
+DEFAULT_MAX_WORKERS = _get_default_max_workers()
+
+
+def _compress_file(args):
+    """Compress a file, and delete the original one.
+
+    This runs in worker threads, so it must not touch any ResultInfo. Errors
+    are caught, so that the files of the other workers are still recorded.
+
+    @param args: A tuple of (path, new_path):
+            path: Path to the file to compress.
+            new_path: Path to the compressed file.
+    @return: True if the file was compressed.
+    """
+    path, new_path = args
+    utils_lib.LOG('Compressing file %s' % path)
+    try:
+        with tarfile.open(new_path, 'w:gz') as tar:
+            tar.add(path, arcname=os.path.basename(path))
+        stat = os.stat(path)
+    except (IOError, OSError, tarfile.TarError) as e:
+        # Clean up the intermediate file.
+        throttler_lib.try_delete_file_on_disk(new_path)
+        utils_lib.LOG('Failed to compress %s: %s' % (path, e))
+        return False
+    if not throttler_lib.try_delete_file_on_disk(path):
+        # Clean up the intermediate file.
+        throttler_lib.try_delete_file_on_disk(new_path)
+        utils_lib.LOG('Failed to compress %s' % path)
+        return False
+
+    # Modify the new file's timestamp to the old one.
+    os.utime(new_path, (stat.st_atime, stat.st_mtime))
+    return True
+
+
+def _prepare_zip_file(file_info):
+    """Get the name of the compressed file, and clear the way for it.
 
     @param file_info: A ResultInfo object containing summary for the file to be
-            shrunk.
+            compressed.
+    @return: Name of the compressed file, or None if the file can't be
+            compressed.
     """
-    utils_lib.LOG('Compressing file %s' % file_info.path)
     parent_result_info = file_info.parent_result_info
     new_name = file_info.name + '.tgz'
     new_path = os.path.join(os.path.dirname(file_info.path), new_name)
     if os.path.exists(new_path):
         utils_lib.LOG('File %s already exists, removing...' % new_path)
         if not throttler_lib.try_delete_file_on_disk(new_path):
-            return
+            return None
         parent_result_info.remove_file(new_name)
-    with tarfile.open(new_path, 'w:gz') as tar:
-        tar.add(file_info.path, arcname=os.path.basename(file_info.path))
-    stat = os.stat(file_info.path)
-    if not throttler_lib.try_delete_file_on_disk(file_info.path):
-        # Clean up the intermediate file.
-        throttler_lib.try_delete_file_on_disk(new_path)
-        utils_lib.LOG('Failed to compress %s' % file_info.path)
-        return
+    return new_name
 
-    # Modify the new file's timestamp to the old one.
-    os.utime(new_path, (stat.st_atime, stat.st_mtime))
+
+def _update_summary(file_info, new_name):
+    """Replace a file in the summary with its compressed file.
+
+    @param file_info: A ResultInfo object containing summary for the file
+            that was compressed.
+    @param new_name: Name of the compressed file.
+    """
+    parent_result_info = file_info.parent_result_info
     # Get the original file size before compression.
     original_size = file_info.original_size
     parent_result_info.remove_file(file_info.name)
@@ -99,27 +154,61 @@ def _get_zippable_files(file_infos, file_size_threshold_byte):
 
 def throttle(summary, max_result_size_KB,
              file_size_threshold_byte=DEFAULT_FILE_SIZE_THRESHOLD_BYTE,
-             skip_autotest_log=False):
+             skip_autotest_log=False, max_workers=DEFAULT_MAX_WORKERS):
     """Throttle the files in summary by compressing file.
 
     Stop throttling until all files are processed or the result file size is
     already reduced to be under the given max_result_size_KB.
 
+    Files are compressed in batches of max_workers files, concurrently, so at
+    most one batch is compressed beyond what's needed to reach the limit.
+
     @param summary: A ResultInfo object containing result summary.
     @param max_result_size_KB: Maximum test result size in KB.
     @param file_size_threshold_byte: Threshold of file size in byte for it to be
             qualified for compression.
     @param skip_autotest_log: True to skip shrink Autotest logs, default is
             False.
+    @param max_workers: Maximum number of files to compress concurrently.
     """
     file_infos, _ = throttler_lib.sort_result_files(summary)
     extra_patterns = ([throttler_lib.AUTOTEST_LOG_PATTERN] if skip_autotest_log
                       else [])
     file_infos = throttler_lib.get_throttleable_files(
             file_infos, extra_patterns)
-    file_infos = _get_zippable_files(file_infos, file_size_threshold_byte)
-    for info in file_infos:
-        _zip_file(info)
+    file_infos = list(_get_zippable_files(file_infos, file_size_threshold_byte))
+    if not file_infos:
+        return
 
-        if throttler_lib.check_throttle_limit(summary, max_result_size_KB):
-            return
+    max_workers = max(1, max_workers)
+    workers = pool.ThreadPool(min(max_workers, len(file_infos)))
+    start_time = time.time()
+    compressed_bytes = 0
+    try:
+        for i in range(0, len(file_infos), max_workers):
+            batch = []
+            for info in file_infos[i:i + max_workers]:
+                new_name = _prepare_zip_file(info)
+                if new_name is not None:
+                    batch.append((info, new_name))
+            results = workers.map(
+                    _compress_file,
+                    [(info.path,
+                      os.path.join(os.path.dirname(info.path), new_name))
+                     for info, new_name in batch])
+            for (info, new_name), compressed in zip(batch, results):
+                if compressed:
+                    compressed_bytes += info.trimmed_size
+                    _update_summary(info, new_name)
+
+            if throttler_lib.check_throttle_limit(summary, max_result_size_KB):
+                return
+    finally:
+        workers.close()
+        workers.join()
+        elapsed = time.time() - start_time
+        utils_lib.LOG('Compressed %s in %.2f seconds with %d workers (%s/s).' %
+                      (utils_lib.get_size_string(compressed_bytes), elapsed,
+                       max_workers,
+                       utils_lib.get_size_string(
+                               compressed_bytes / max(elapsed, 0.001))))
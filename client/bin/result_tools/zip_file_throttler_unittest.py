@@ -126,6 +126,41 @@ class ZipFileThrottleTest(unittest.TestCase):
                             'File %s is not compressed!' % f)
 
 
+    def testTrimSerial(self):
+        """Test throttle method compressing one file at a time."""
+        summary = result_info.ResultInfo.build_from_path(self.test_dir)
+        zip_file_throttler.throttle(
+                summary,
+                max_result_size_KB=MAX_RESULT_SIZE_KB,
+                file_size_threshold_byte=FILE_SIZE_THRESHOLD_BYTE,
+                max_workers=1)
+
+        expected_summary = result_info.ResultInfo(
+                parent_dir=self.test_dir, original_info=SUMMARY_AFTER_TRIMMING)
+        self.compareSummary(expected_summary, summary)
+
+    def testTrimWithFailure(self):
+        """Test that a failure doesn't lose the other files of its batch."""
+        summary = result_info.ResultInfo.build_from_path(self.test_dir)
+        failed_file = self.files_to_zip.pop(0)
+        os.remove(failed_file)
+        zip_file_throttler.throttle(
+                summary,
+                max_result_size_KB=MAX_RESULT_SIZE_KB,
+                file_size_threshold_byte=FILE_SIZE_THRESHOLD_BYTE,
+                max_workers=len(self.files_to_zip) + 1)
+
+        self.assertFalse(os.path.exists(failed_file + '.tgz'))
+        self.assertIsNotNone(summary.get_file(os.path.basename(failed_file)))
+        for f in self.files_to_zip:
+            self.assertFalse(os.path.exists(f))
+            f += '.tgz'
+            info = summary
+            for name in os.path.relpath(f, self.test_dir).split(os.sep):
+                info = info.get_file(name)
+            self.assertEqual(ORIGINAL_SIZE_BYTE, info.original_size)
+            self.assertEqual(os.stat(f).st_size, info.trimmed_size)
+
 # this is so the test can be run in standalone mode
 if __name__ == '__main__':
     """Main"""
@@ -159,14 +159,25 @@ def with_backing_file(method):
     write-and-unlock. Any operation that is reading or writing state
     should be decorated with this method to ensure that backing file
     state is consistently maintained.
+
+    In write-behind mode, the state is only read again when the backing file
+    was changed by someone else, and it is not written; see job_state.flush.
     """
     @with_backing_lock
-    def wrapped_method(self, *args, **dargs):
+    def locked_method(self, *args, **dargs):
         self._read_from_backing_file()
         try:
             return method(self, *args, **dargs)
         finally:
             self._write_to_backing_file()
+
+    def wrapped_method(self, *args, **dargs):
+        if not self._write_behind:
+            return locked_method(self, *args, **dargs)
+        if (not self._backing_file_initialized or
+                self._get_backing_file_key() != self._backing_file_key):
+            self._refresh_from_backing_file()
+        return method(self, *args, **dargs)
     wrapped_method.__name__ = method.__name__
     wrapped_method.__doc__ = method.__doc__
     return wrapped_method
@@ -182,6 +193,13 @@ class job_state(object):
     as names. Additionally, the namespace 'stateful_property' is used for
     storing the valued associated with properties constructed using the
     property_factory method.
+
+    By default, every access to the state reads and writes the whole backing
+    file. In write-behind mode, the state is cached in memory and changes
+    are only written by flush(), which the job calls before anything that
+    relies on the backing file: forking, rebooting and exiting. Changes made
+    to the backing file by other processes in the meantime are detected by
+    its inode, size and times, and merged with the changes not flushed yet.
     """
 
     NO_DEFAULT = object()
@@ -194,6 +212,14 @@ class job_state(object):
         self._backing_file = None
         self._backing_file_initialized = False
         self._backing_file_lock = None
+        self._write_behind = False
+        # Identifies the contents of the backing file last read or written,
+        # in write-behind mode.
+        self._backing_file_key = None
+        # Names and namespaces changed since the last flush, in write-behind
+        # mode.
+        self._dirty_names = set()
+        self._dirty_namespaces = set()
 
 
     def _lock_backing_file(self):
@@ -293,6 +319,91 @@ class job_state(object):
         """Flush the current state to the backing file."""
         if self._backing_file:
             self.write_to_file(self._backing_file)
+            self._dirty_names.clear()
+            self._dirty_namespaces.clear()
+            if self._write_behind:
+                self._backing_file_key = self._get_backing_file_key()
+
+
+    def _get_backing_file_key(self):
+        """Return what identifies the current contents of the backing file.
+
+        @return: An (inode, size, mtime, ctime) tuple, or None if the file
+            does not exist.
+        """
+        try:
+            st = os.stat(self._backing_file)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime, st.st_ctime)
+
+
+    @with_backing_lock
+    def _refresh_from_backing_file(self):
+        """Reload the cached state if the backing file was changed.
+
+        The names and namespaces changed since the last flush keep their
+        in-memory values, the rest of the state is replaced by the contents
+        of the backing file.
+        """
+        if not self._backing_file_initialized:
+            self._read_from_backing_file()
+            return
+        if self._get_backing_file_key() == self._backing_file_key:
+            return
+
+        logging.debug('State file %s changed, reloading it',
+                      self._backing_file)
+        in_memory_state = self._state
+        if os.path.getsize(self._backing_file) == 0:
+            self._state = {}
+        else:
+            self._state = pickle.load(open(self._backing_file))
+        for namespace in self._dirty_namespaces:
+            self._state.pop(namespace, None)
+        for namespace, name in self._dirty_names:
+            in_memory_namespace = in_memory_state.get(namespace, {})
+            if name in in_memory_namespace:
+                namespace_dict = self._state.setdefault(namespace, {})
+                namespace_dict[name] = in_memory_namespace[name]
+            elif namespace in self._state:
+                self._state[namespace].pop(name, None)
+                if not self._state[namespace]:
+                    del self._state[namespace]
+        self._backing_file_key = self._get_backing_file_key()
+
+
+    def _mark_dirty(self, namespace, name=None):
+        """Record a change to flush, in write-behind mode.
+
+        @param namespace: The namespace that was changed.
+        @param name: The name that was changed, or None if the whole
+            namespace was discarded.
+        """
+        if not self._write_behind:
+            return
+        if name is None:
+            self._dirty_namespaces.add(namespace)
+        else:
+            self._dirty_names.add((namespace, name))
+
+
+    @with_backing_lock
+    def _flush_to_backing_file(self):
+        """Merge the backing file with the cached state, and write it."""
+        self._refresh_from_backing_file()
+        self._write_to_backing_file()
+
+
+    def flush(self):
+        """Write the changes cached in write-behind mode to the backing file.
+
+        This does nothing when there is no change to write, e.g. when not in
+        write-behind mode, where every change is written immediately.
+        """
+        if self._write_behind and (self._dirty_names or
+                                   self._dirty_namespaces):
+            self._flush_to_backing_file()
 
 
     @with_backing_file
@@ -302,7 +413,7 @@ class job_state(object):
         pass
 
 
-    def set_backing_file(self, file_path):
+    def set_backing_file(self, file_path, write_behind=False):
         """Change the path used as the backing file for the persistent state.
 
         When a new backing file is specified if a file already exists then
@@ -313,10 +424,14 @@ class job_state(object):
 
         @param file_path: A path on the filesystem that can be read from and
             written to, or None to turn off the backing store.
+        @param write_behind: If True, cache the state in memory and only
+            write it to the new backing file on flush().
         """
+        self.flush()
         self._synchronize_backing_file()
         self._backing_file = file_path
         self._backing_file_initialized = False
+        self._write_behind = bool(write_behind and file_path)
         self._synchronize_backing_file()
 
 
@@ -353,6 +468,7 @@ class job_state(object):
         """
         namespace_dict = self._state.setdefault(namespace, {})
         namespace_dict[name] = copy.deepcopy(value)
+        self._mark_dirty(namespace, name)
         logging.debug('Persistent state %s.%s now set to %r', namespace,
                       name, value)
 
@@ -381,6 +497,7 @@ class job_state(object):
             del self._state[namespace][name]
             if len(self._state[namespace]) == 0:
                 del self._state[namespace]
+            self._mark_dirty(namespace, name)
             logging.debug('Persistent state %s.%s deleted', namespace, name)
         else:
             logging.debug(
@@ -396,6 +513,7 @@ class job_state(object):
         """
         if namespace in self._state:
             del self._state[namespace]
+        self._mark_dirty(namespace)
         logging.debug('Persistent state %s.* deleted', namespace)
 
 
@@ -38,6 +38,7 @@ class stub_job_state(base_job.job_state):
     def __init__(self):
         self._state = {}
         self._backing_file_lock = None
+        self._write_behind = False
 
     def read_from_file(self, file_path):
         pass
@@ -45,7 +46,7 @@ class stub_job_state(base_job.job_state):
     def write_to_file(self, file_path):
         pass
 
-    def set_backing_file(self, file_path):
+    def set_backing_file(self, file_path, write_behind=False):
         pass
 
     def _read_from_backing_file(self):
@@ -519,6 +520,75 @@ class test_job_state_with_backing_file(test_job_state):
         self.assertRaises(KeyError, written_state.get, 'persist', 'var')
 
 
+# run the same tests as test_job_state, with a write-behind backing file
+class test_job_state_with_write_behind_backing_file(test_job_state):
+    def setUp(self):
+        self.backing_file = tempfile.mktemp()
+        self.state = base_job.job_state()
+        self.state.set_backing_file(self.backing_file, write_behind=True)
+
+
+    def tearDown(self):
+        if os.path.exists(self.backing_file):
+            os.remove(self.backing_file)
+
+
+    def _read_backing_file(self):
+        written_state = base_job.job_state()
+        written_state.read_from_file(self.backing_file)
+        return written_state
+
+
+    def test_set_is_persistent_after_flush(self):
+        self.state.set('persist', 'var', 'value')
+        self.assertFalse(self._read_backing_file().has('persist', 'var'))
+        self.state.flush()
+        self.assertEqual('value',
+                         self._read_backing_file().get('persist', 'var'))
+
+
+    def test_discard_namespace_is_persistent_after_flush(self):
+        self.state.set('persist', 'var', 'value')
+        self.state.flush()
+        self.state.discard_namespace('persist')
+        self.state.flush()
+        self.assertFalse(self._read_backing_file().has('persist', 'var'))
+
+
+    def test_unchanged_backing_file_is_not_read(self):
+        self.state.set('ns', 'var', 'value')
+        self.state.flush()
+        self.state.read_from_file = None
+        self.state.set('ns', 'var', 'value2')
+        self.assertEqual('value2', self.state.get('ns', 'var'))
+
+
+    def test_external_changes_are_seen(self):
+        self.state.get('ns', 'var', None)
+        other_state = base_job.job_state()
+        other_state.set_backing_file(self.backing_file)
+        other_state.set('ns', 'var', 'external')
+        self.assertEqual('external', self.state.get('ns', 'var'))
+
+
+    def test_flush_merges_external_changes(self):
+        self.state.set('ns', 'kept', 'value')
+        self.state.set('ns', 'discarded', 'value')
+        self.state.flush()
+        self.state.set('ns', 'mine', 'local')
+        self.state.discard('ns', 'discarded')
+        other_state = base_job.job_state()
+        other_state.set_backing_file(self.backing_file)
+        other_state.set('ns', 'theirs', 'external')
+        other_state.set('ns', 'discarded', 'external')
+        self.state.flush()
+        written_state = self._read_backing_file()
+        self.assertEqual('value', written_state.get('ns', 'kept'))
+        self.assertEqual('local', written_state.get('ns', 'mine'))
+        self.assertEqual('external', written_state.get('ns', 'theirs'))
+        self.assertFalse(written_state.has('ns', 'discarded'))
+
+
 class test_job_state_read_write_file(unittest.TestCase):
     def setUp(self):
         self.testdir = tempfile.mkdtemp(suffix='unittest')
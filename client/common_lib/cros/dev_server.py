@@ -3,7 +3,9 @@
 # found in the LICENSE file.
 
 from distutils import version
+import bisect
 import cStringIO
+import hashlib
 import HTMLParser
 import httplib
 import json
@@ -12,6 +14,7 @@ import multiprocessing
 import os
 import re
 import socket
+import threading
 import time
 import urllib2
 import urlparse
@@ -58,6 +61,17 @@ SKIP_DEVSERVER_HEALTH_CHECK = CONFIG.get_config_value(
         'CROS', 'skip_devserver_health_check', type=bool)
 # Number of seconds for the call to get devserver load to time out.
 TIMEOUT_GET_DEVSERVER_LOAD = 2.0
+# Number of seconds a devserver health check result is reused for.
+DEVSERVER_HEALTH_CACHE_TTL_SECS = CONFIG.get_config_value(
+        'CROS', 'devserver_health_cache_ttl_secs', type=int, default=60)
+# Number of points each devserver has on the hash ring used to pick the
+# devserver of a build. More points spread the builds more evenly.
+_HASH_RING_POINTS_PER_DEVSERVER = 64
+# Number of candidate devservers whose health is checked concurrently.
+_HEALTH_CHECK_BATCH_SIZE = 3
+# Number of seconds to wait for concurrent health checks, on top of the
+# timeout of the checks themselves.
+_HEALTH_CHECK_GRACE_SECS = 10
 
 # Android artifact path in devserver
 ANDROID_BUILD_NAME_PATTERN = CONFIG.get_config_value(
@@ -418,6 +432,148 @@ def get_resolved_hostname(url):
     return _reverse_lookup_from_config(get_hostname(url))
 
 
+def _ring_hash(key):
+    """Return the position of a key on the hash ring.
+
+    The builtin hash() is not used, as it differs between platforms.
+
+    @param key: A string.
+    """
+    return int(hashlib.md5(key).hexdigest()[:16], 16)
+
+
+class _HashRing(object):
+    """A consistent hash ring of devservers.
+
+    Each devserver is placed at many points on the ring, and a build goes to
+    the devserver of the first point after the build's hash. Adding or
+    removing a devserver only moves the builds of that devserver, so that
+    the other devservers keep the artifacts they already staged.
+    """
+
+    def __init__(self, devservers,
+                 points_per_devserver=_HASH_RING_POINTS_PER_DEVSERVER):
+        """
+        @param devservers: A list of devserver urls.
+        @param points_per_devserver: Number of points of each devserver.
+        """
+        self._points = sorted(
+                (_ring_hash('%s-%d' % (devserver, i)), devserver)
+                for devserver in set(devservers)
+                for i in xrange(points_per_devserver))
+        self._hashes = [point[0] for point in self._points]
+        self._size = len(set(devservers))
+
+
+    def get_devservers(self, build):
+        """Return all devservers, in order of preference for a build.
+
+        @param build: The build (e.g. x86-mario-release/R18-1586.0.0-a1-b1514).
+
+        @return: A list of devserver urls.
+        """
+        devservers = []
+        start = bisect.bisect(self._hashes, _ring_hash(str(build)))
+        for i in xrange(len(self._points)):
+            devserver = self._points[(start + i) % len(self._points)][1]
+            if devserver not in devservers:
+                devservers.append(devserver)
+                if len(devservers) == self._size:
+                    break
+        return devservers
+
+
+# Hash rings, by the set of devservers they are built from.
+_hash_rings = {}
+
+
+def _get_hash_ring(devservers):
+    """Return the hash ring of a list of devservers.
+
+    @param devservers: A list of devserver urls.
+    """
+    key = frozenset(devservers)
+    ring = _hash_rings.get(key)
+    if ring is None:
+        ring = _hash_rings[key] = _HashRing(devservers)
+    return ring
+
+
+def _run_in_threads(function, args, timeout):
+    """Call a function on each of a list of arguments, in threads.
+
+    Threads still running after the timeout are left behind as daemons.
+
+    @param function: A function taking one argument.
+    @param args: The list of arguments.
+    @param timeout: Seconds to wait for all the calls.
+
+    @return: A dict of the results by argument, of the calls which completed
+             before the timeout.
+    """
+    results = {}
+    threads = []
+    for arg in args:
+        thread = threading.Thread(
+                target=lambda a=arg: results.__setitem__(a, function(a)))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    deadline = time.time() + timeout
+    for thread in threads:
+        thread.join(max(0, deadline - time.time()))
+    # Copy, so that calls completing later don't change the result.
+    return dict(results)
+
+
+class _DevServerHealthCache(object):
+    """Recent health check results, shared by all lookups in this process."""
+
+    def __init__(self, ttl_secs):
+        """
+        @param ttl_secs: Number of seconds a result is valid for.
+        """
+        self._ttl_secs = ttl_secs
+        self._lock = threading.Lock()
+        self._results = {}
+
+
+    def get(self, devserver):
+        """Return the last health check result of a devserver.
+
+        @param devserver: url of the devserver.
+
+        @return: A (healthy, load) tuple, or None if the devserver was not
+                 checked within the TTL.
+        """
+        with self._lock:
+            result = self._results.get(devserver)
+        if result is None or result[0] < time.time():
+            return None
+        return result[1:]
+
+
+    def set(self, devserver, healthy, load):
+        """Record the result of a health check.
+
+        @param devserver: url of the devserver.
+        @param healthy: Whether the devserver is healthy.
+        @param load: A dict of the load of the devserver, or None.
+        """
+        with self._lock:
+            self._results[devserver] = (time.time() + self._ttl_secs,
+                                        healthy, load)
+
+
+    def clear(self):
+        """Forget all the health check results."""
+        with self._lock:
+            self._results.clear()
+
+
+_health_cache = _DevServerHealthCache(DEVSERVER_HEALTH_CACHE_TTL_SECS)
+
+
 class DevServer(object):
     """Base class for all DevServer-like server stubs.
 
@@ -615,6 +771,7 @@ class DevServer(object):
             healthy = bool(disk_ok)
             return disk_ok
         finally:
+            _health_cache.set(devserver, healthy, load)
             c.increment(fields={'dev_server': cls(devserver).resolved_hostname,
                                 'healthy': healthy,
                                 'reason': reason})
@@ -760,10 +917,69 @@ class DevServer(object):
         metrics.Counter('chromeos/autotest/devserver/unrestricted_hotfix')
         return cls.servers()
 
+    @classmethod
+    def check_health(cls, devservers):
+        """Check the health of devservers, concurrently.
+
+        Results from the last DEVSERVER_HEALTH_CACHE_TTL_SECS are reused.
+
+        @param devservers: A list of devserver urls.
+
+        @return: A dict of (healthy, load) tuples by devserver. load is a dict
+                 of the load of the devserver, or None if it is not known.
+                 Devservers whose check did not complete in time are missing.
+        """
+        results = {}
+        to_check = []
+        for devserver in devservers:
+            result = _health_cache.get(devserver)
+            if result is None:
+                to_check.append(devserver)
+            else:
+                results[devserver] = result
+
+        def check(devserver):
+            """Check the health of one devserver.
+
+            @param devserver: url of the devserver.
+
+            @return: A (healthy, load) tuple.
+            """
+            try:
+                healthy = cls.devserver_healthy(devserver)
+            except Exception as e:
+                logging.error('Failed to check health of %s: %s',
+                              devserver, e)
+                healthy = False
+            # devserver_healthy caches the load it got.
+            result = _health_cache.get(devserver)
+            return result if result is not None else (healthy, None)
+
+        if len(to_check) == 1:
+            # Check in this thread, so that the timeouts of the check are
+            # enforced.
+            results[to_check[0]] = check(to_check[0])
+            return results
+
+        checked = _run_in_threads(
+                check, to_check,
+                DEVSERVER_SSH_TIMEOUT_MINS * 60 + _HEALTH_CHECK_GRACE_SECS)
+        if len(checked) < len(to_check):
+            logging.error('Timed out checking health of %s',
+                          sorted(set(to_check) - set(checked)))
+        results.update(checked)
+        return results
+
+
     @classmethod
     def get_healthy_devserver(cls, build, devservers, ban_list=None):
         """"Get a healthy devserver instance from the list of devservers.
 
+        The devservers are tried in the order given by a consistent hash ring,
+        so that a build keeps the same devserver when devservers are added or
+        removed. They are checked a few at a time, and within each batch, a
+        healthy devserver whose load is below the thresholds is preferred.
+
         @param build: The build (e.g. x86-mario-release/R18-1586.0.0-a1-b1514).
         @param devservers: The devserver list to be chosen out a healthy one.
         @param ban_list: The blacklist of devservers we don't want to choose.
@@ -774,16 +990,30 @@ class DevServer(object):
 
         """
         logging.debug('Pick one healthy devserver from %r', devservers)
-        while devservers:
-            hash_index = hash(build) % len(devservers)
-            devserver = devservers.pop(hash_index)
-            logging.debug('Check health for %s', devserver)
-            if ban_list and devserver in ban_list:
+        if not devservers:
+            return None
+        candidates = [devserver for devserver
+                      in _get_hash_ring(devservers).get_devservers(build)
+                      if not ban_list or devserver not in ban_list]
+        for i in xrange(0, len(candidates), _HEALTH_CHECK_BATCH_SIZE):
+            batch = candidates[i:i + _HEALTH_CHECK_BATCH_SIZE]
+            logging.debug('Check health for %s', batch)
+            results = cls.check_health(batch)
+            healthy = [devserver for devserver in batch
+                       if results.get(devserver, (False, None))[0]]
+            if not healthy:
                 continue
-
-            if cls.devserver_healthy(devserver):
-                logging.debug('Pick %s', devserver)
-                return cls(devserver)
+            for devserver in healthy:
+                load = results[devserver][1]
+                if (not load or DevServer.CPU_LOAD not in load or
+                    DevServer.NETWORK_IO not in load or
+                    _is_load_healthy(dict(load, devserver=devserver))):
+                    break
+            else:
+                # All are busy, keep the first one for its staged artifacts.
+                devserver = healthy[0]
+            logging.debug('Pick %s', devserver)
+            return cls(devserver)
 
 
     @classmethod
@@ -13,6 +13,7 @@ import json
 import mox
 import os
 import StringIO
+import threading
 import time
 import unittest
 import urllib2
@@ -50,6 +51,18 @@ def retry_mock(ExceptionToCheck, timeout_min, exception_to_raise=None,
     return inner_retry
 
 
+def run_serially(function, args, timeout):
+    """Run the calls of dev_server._run_in_threads in order, in this thread.
+
+    @param function: A function taking one argument.
+    @param args: The list of arguments.
+    @param timeout: Ignored.
+
+    @return: A dict of the results by argument.
+    """
+    return dict((arg, function(arg)) for arg in args)
+
+
 class MockSshResponse(object):
     """An ssh response mocked for testing."""
 
@@ -172,7 +185,8 @@ class RunCallTest(mox.MoxTestBase):
         (call, timeout=xxx)."""
         dev_server.ENABLE_SSH_CONNECTION_FOR_DEVSERVER = False
 
-        urllib2.urlopen(mox.StrContains(self.test_call), data=None).AndReturn(
+        urllib2.urlopen(mox.StrContains(self.test_call), data=None,
+                        timeout=60).AndReturn(
                 StringIO.StringIO(self.contents))
         self.mox.ReplayAll()
         response = dev_server.ImageServerBase.run_call(
@@ -265,14 +279,70 @@ class RunCallTest(mox.MoxTestBase):
         """Test dev_server.DevServer.run_call, which uses http, and can be
         directly called by CrashServer."""
         urllib2.urlopen(
-                mox.StrContains(self.test_call), data=None).AndReturn(
-                        StringIO.StringIO(self.contents))
+                mox.StrContains(self.test_call), data=None,
+                timeout=60).AndReturn(StringIO.StringIO(self.contents))
         self.mox.ReplayAll()
         response = dev_server.DevServer.run_call(
                self.test_call, timeout=60)
         self.assertEquals(self.contents, response)
 
 
+class HashRingTest(unittest.TestCase):
+    """Unit tests for dev_server._HashRing."""
+
+    _DEVSERVERS = ['http://host%d:8082' % i for i in range(7)]
+    _BUILDS = ['board%d-release/R70-%d.0.0' % (i % 40, i) for i in range(500)]
+
+
+    def testAllDevserversAreReturned(self):
+        """Ensure every devserver is a candidate, once."""
+        ring = dev_server._HashRing(self._DEVSERVERS)
+        self.assertEqual(sorted(ring.get_devservers('build')),
+                         sorted(self._DEVSERVERS))
+
+
+    def testRemovingDevserverKeepsOtherBuilds(self):
+        """Ensure only the builds of a removed devserver move."""
+        ring = dev_server._HashRing(self._DEVSERVERS)
+        smaller_ring = dev_server._HashRing(self._DEVSERVERS[:-1])
+        for build in self._BUILDS:
+            devserver = ring.get_devservers(build)[0]
+            if devserver != self._DEVSERVERS[-1]:
+                self.assertEqual(smaller_ring.get_devservers(build)[0],
+                                 devserver)
+
+
+    def testBuildsAreSpread(self):
+        """Ensure every devserver gets some builds."""
+        ring = dev_server._HashRing(self._DEVSERVERS)
+        self.assertEqual(
+                set(ring.get_devservers(build)[0] for build in self._BUILDS),
+                set(self._DEVSERVERS))
+
+
+class RunInThreadsTest(unittest.TestCase):
+    """Unit tests for dev_server._run_in_threads."""
+
+    def testCallsAreCompleted(self):
+        """Ensure the result of every call is returned."""
+        self.assertEqual(dev_server._run_in_threads(lambda x: x * 2, [1, 2],
+                                                    timeout=10),
+                         {1: 2, 2: 4})
+
+
+    def testSlowCallsAreDropped(self):
+        """Ensure calls still running at the timeout are left out."""
+        release = threading.Event()
+        self.addCleanup(release.set)
+        def call(arg):
+            if arg == 'slow':
+                release.wait()
+            return arg
+        self.assertEqual(dev_server._run_in_threads(call, ['fast', 'slow'],
+                                                    timeout=0.1),
+                         {'fast': 'fast'})
+
+
 class DevServerTest(mox.MoxTestBase):
     """Unit tests for dev_server.DevServer.
 
@@ -299,6 +369,10 @@ class DevServerTest(mox.MoxTestBase):
         dev_server.RESTRICTED_SUBNETS = []
         self.mox.StubOutWithMock(dev_server.ImageServer,
                                  '_read_json_response_from_devserver')
+        dev_server._health_cache.clear()
+        # Check devservers in this thread, in order, so that the calls match
+        # the recorded expectations and no check outlives the test.
+        self.stubs.Set(dev_server, '_run_in_threads', run_serially)
 
         sleep = mock.patch('time.sleep', autospec=True)
         sleep.start()
@@ -337,7 +411,8 @@ class DevServerTest(mox.MoxTestBase):
                         '{"free_disk": 1024}')
 
         self.mox.ReplayAll()
-        host = dev_server.ImageServer.resolve(0) # Using 0 as it'll hash to 0.
+        # Using 0 as bad_host comes first on the hash ring for it.
+        host = dev_server.ImageServer.resolve(0)
         self.assertEquals(host.url(), good_host)
         self.mox.VerifyAll()
 
@@ -351,6 +426,7 @@ class DevServerTest(mox.MoxTestBase):
         # Will reset retry.retry to real retry at the end of this test.
         real_retry = retry.retry
         retry.retry = retry_mock
+        self.addCleanup(setattr, retry, 'retry', real_retry)
 
         self.mox.StubOutWithMock(dev_server, '_get_dev_server_list')
         bad_host, good_host = 'http://bad_host:99', 'http://good_host:8080'
@@ -370,12 +446,11 @@ class DevServerTest(mox.MoxTestBase):
                         '{"free_disk": 1024}')
 
         self.mox.ReplayAll()
-        host = dev_server.ImageServer.resolve(0) # Using 0 as it'll hash to 0.
+        # Using 0 as bad_host comes first on the hash ring for it.
+        host = dev_server.ImageServer.resolve(0)
         self.assertEquals(host.url(), good_host)
         self.mox.VerifyAll()
 
-        retry.retry = real_retry
-
 
     def testResolveWithManyDevservers(self):
         """Should be able to return different urls with multiple devservers."""
@@ -387,18 +462,63 @@ class DevServerTest(mox.MoxTestBase):
 
         dev_server.ImageServer.servers().MultipleTimes().AndReturn(
                 [host0_expected, host1_expected])
+        # Both hosts are checked on each resolve, in the order of the hash
+        # ring for the build.
         dev_server.ImageServer.devserver_healthy(host0_expected).AndReturn(True)
         dev_server.ImageServer.devserver_healthy(host1_expected).AndReturn(True)
+        dev_server.ImageServer.devserver_healthy(host1_expected).AndReturn(True)
+        dev_server.ImageServer.devserver_healthy(host0_expected).AndReturn(True)
 
         self.mox.ReplayAll()
-        host0 = dev_server.ImageServer.resolve(0)
-        host1 = dev_server.ImageServer.resolve(1)
+        # The builds come first on the hash ring for different hosts.
+        host0 = dev_server.ImageServer.resolve(1)
+        host1 = dev_server.ImageServer.resolve(0)
         self.mox.VerifyAll()
 
         self.assertEqual(host0.url(), host0_expected)
         self.assertEqual(host1.url(), host1_expected)
 
 
+    def testResolveReusesHealthCheck(self):
+        """Ensure a recent health check is reused by the next resolve."""
+        self.mox.StubOutWithMock(dev_server, '_get_dev_server_list')
+        dev_server._get_dev_server_list().MultipleTimes().AndReturn(
+                [DevServerTest._HOST])
+        dev_server.ImageServerBase.run_call(
+                mox.StrContains(DevServerTest._HOST),
+                timeout=mox.IgnoreArg()).AndReturn('{"free_disk": 1024}')
+
+        self.mox.ReplayAll()
+        for build in ('build1', 'build2'):
+            devserver = dev_server.ImageServer.resolve(build)
+            self.assertEquals(devserver.url(), DevServerTest._HOST)
+        self.mox.VerifyAll()
+
+
+    def testResolvePrefersDevserverNotOverloaded(self):
+        """Ensure an overloaded devserver is skipped if another is healthy."""
+        self.mox.StubOutWithMock(dev_server, '_get_dev_server_list')
+        busy_host, idle_host = 'http://bad_host:99', 'http://good_host:8080'
+        dev_server._get_dev_server_list().MultipleTimes().AndReturn(
+                [busy_host, idle_host])
+        load = {dev_server.DevServer.FREE_DISK: 1024,
+                dev_server.DevServer.NETWORK_IO: 0}
+        dev_server.ImageServerBase.run_call(
+                mox.StrContains(busy_host),
+                timeout=mox.IgnoreArg()).AndReturn(
+                        json.dumps(dict(load, cpu_percent=95)))
+        dev_server.ImageServerBase.run_call(
+                mox.StrContains(idle_host),
+                timeout=mox.IgnoreArg()).AndReturn(
+                        json.dumps(dict(load, cpu_percent=10)))
+
+        self.mox.ReplayAll()
+        # Using 0 as busy_host comes first on the hash ring for it.
+        host = dev_server.ImageServer.resolve(0)
+        self.assertEquals(host.url(), idle_host)
+        self.mox.VerifyAll()
+
+
     def testCmdErrorRetryCollectAULog(self):
         """Devserver should retry _collect_au_log() on CMDError,
         but pass through real exception."""
@@ -0,0 +1,228 @@
+# Copyright 2019 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Buffered writing of the perf values of a test to results-chart.json.
+
+Rewriting the whole chart file for every perf value makes a test emitting
+N values do O(N^2) work. A ChartWriter instead keeps the values added to a
+results directory in memory, and only writes the chart file when flushed.
+
+Each value is also appended to a log next to the chart file when it is
+added, so that it is not lost if the test dies before the values are
+flushed: the log is replayed by the next flush, and by load_charts.
+"""
+
+import json
+import logging
+import os
+
+# Name of the chart file, in the results directory.
+CHART_FILE = 'results-chart.json'
+
+# Name of the log of the values not written to the chart file yet.
+LOG_FILE = 'results-chart.log'
+
+# Number of values kept in memory before they are written to the chart file.
+MAX_PENDING_VALUES = 1000
+
+# Writers of the results directories used in this process, by path.
+_writers = {}
+# The process _writers belongs to. Forked children start with no writers, so
+# that they don't flush the values the parent is accumulating.
+_writers_pid = os.getpid()
+
+
+def add_value(charts, first_level, second_level, value, units, direction,
+              replace_existing_values):
+    """Add a perf value to a chart dict, in the chart json format.
+
+    A single value is recorded as a scalar, and becomes a list of scalars
+    when other values are added to the same chart, unless they replace it.
+
+    @param charts: The chart dict to update.
+    @param first_level: Name of the chart.
+    @param second_level: Name of the trace in the chart.
+    @param value: A float, or a list of floats.
+    @param units: A string describing the units of the value.
+    @param direction: 'up' if higher values are better, 'down' otherwise.
+    @param replace_existing_values: Whether the value replaces the values
+            already in the trace.
+    """
+    result_type = 'scalar'
+    value_key = 'value'
+    result_value = value
+
+    # The chart json spec go/telemetry-json differenciates between a single
+    # value vs a list of values.  Lists of values get extra processing in
+    # the chromeperf dashboard ( mean, standard deviation etc)
+    # Tests can log one or more values for the same metric, to adhere stricly
+    # to the specification the first value logged is a scalar but if another
+    # value is logged the results become a list of scalar.
+    # TODO Figure out if there would be any difference of always using list
+    # of scalar even if there is just one item in the list.
+    if isinstance(value, list):
+        result_type = 'list_of_scalar_values'
+        value_key = 'values'
+        if first_level in charts and second_level in charts[first_level]:
+            if 'values' in charts[first_level][second_level]:
+                result_value = charts[first_level][second_level]['values']
+            elif 'value' in charts[first_level][second_level]:
+                result_value = [charts[first_level][second_level]['value']]
+            if replace_existing_values:
+                result_value = value
+            else:
+                result_value.extend(value)
+        else:
+            result_value = value
+    elif (first_level in charts and second_level in charts[first_level] and
+          not replace_existing_values):
+        result_type = 'list_of_scalar_values'
+        value_key = 'values'
+        if 'values' in charts[first_level][second_level]:
+            result_value = charts[first_level][second_level]['values']
+            result_value.append(value)
+        else:
+            result_value = [charts[first_level][second_level]['value'], value]
+
+    test_data = {
+        second_level: {
+             'type': result_type,
+             'units': units,
+             value_key: result_value,
+             'improvement_direction': direction
+       }
+    }
+
+    if first_level in charts:
+        charts[first_level].update(test_data)
+    else:
+        charts.update({first_level: test_data})
+
+
+def _read_charts(resultsdir):
+    """Read the chart file of a results directory.
+
+    @param resultsdir: The results directory.
+
+    @return: The chart dict, empty if there is no chart file.
+    """
+    path = os.path.join(resultsdir, CHART_FILE)
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        contents = f.read()
+    return json.loads(contents) if contents else {}
+
+
+def _read_log(resultsdir):
+    """Read the values logged in a results directory, but not flushed.
+
+    @param resultsdir: The results directory.
+
+    @return: A list of lists of add_value arguments, after the chart dict.
+    """
+    path = os.path.join(resultsdir, LOG_FILE)
+    if not os.path.isfile(path):
+        return []
+    entries = []
+    with open(path) as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # The last line is incomplete if the writer died while
+                # writing it.
+                logging.warning('Ignoring incomplete perf value in %s: %r',
+                                path, line)
+    return entries
+
+
+def load_charts(resultsdir):
+    """Return the charts of a results directory, including logged values.
+
+    @param resultsdir: The results directory.
+
+    @return: The chart dict.
+    """
+    charts = _read_charts(resultsdir)
+    for entry in _read_log(resultsdir):
+        add_value(charts, *entry)
+    return charts
+
+
+class ChartWriter(object):
+    """Accumulates the perf values of a results directory."""
+
+    def __init__(self, resultsdir):
+        """
+        @param resultsdir: The results directory.
+        """
+        self.resultsdir = resultsdir
+        # Values logged by a writer which died before flushing them.
+        self._pending = _read_log(resultsdir)
+        self._log = None
+
+
+    def add(self, *entry):
+        """Add a perf value. It is logged, and written at the next flush.
+
+        @param entry: The arguments of add_value, after the chart dict.
+        """
+        self._pending.append(entry)
+        if self._log is None:
+            if not os.path.exists(self.resultsdir):
+                os.makedirs(self.resultsdir)
+            self._log = open(os.path.join(self.resultsdir, LOG_FILE), 'a+')
+            self._log.seek(0, os.SEEK_END)
+            if self._log.tell():
+                self._log.seek(-1, os.SEEK_END)
+                if self._log.read(1) != '\n':
+                    # End the incomplete line of a dead writer.
+                    self._log.write('\n')
+        self._log.write(json.dumps(entry) + '\n')
+        # Hand the value to the kernel, so that it survives the process.
+        self._log.flush()
+        if len(self._pending) >= MAX_PENDING_VALUES:
+            self.flush()
+
+
+    def flush(self):
+        """Write the pending values to the chart file, and clear the log.
+
+        The chart file is read again, so that changes made to it by other
+        writers since the last flush are kept.
+        """
+        if not self._pending:
+            return
+        charts = _read_charts(self.resultsdir)
+        for entry in self._pending:
+            add_value(charts, *entry)
+        path = os.path.join(self.resultsdir, CHART_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(charts, indent=2))
+        os.rename(tmp_path, path)
+        self._pending = []
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        log_path = os.path.join(self.resultsdir, LOG_FILE)
+        if os.path.exists(log_path):
+            os.remove(log_path)
+
+
+def get_writer(resultsdir):
+    """Return the writer of a results directory, shared in this process.
+
+    @param resultsdir: The results directory.
+    """
+    global _writers, _writers_pid
+    if _writers_pid != os.getpid():
+        _writers = {}
+        _writers_pid = os.getpid()
+    key = os.path.abspath(resultsdir)
+    writer = _writers.get(key)
+    if writer is None:
+        writer = _writers[key] = ChartWriter(resultsdir)
+    return writer
@@ -0,0 +1,125 @@
+#!/usr/bin/python2
+#
+# Copyright 2019 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for client/common_lib/perf_chart.py."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import common
+from autotest_lib.client.common_lib import perf_chart
+
+
+class ChartWriterTest(unittest.TestCase):
+    """Unit tests for perf_chart.ChartWriter."""
+
+    def setUp(self):
+        self.resultsdir = tempfile.mkdtemp()
+        self.chart_file = os.path.join(self.resultsdir, perf_chart.CHART_FILE)
+        self.log_file = os.path.join(self.resultsdir, perf_chart.LOG_FILE)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.resultsdir)
+
+
+    def _read_chart_file(self):
+        """Return the contents of the chart file, parsed."""
+        with open(self.chart_file) as f:
+            return json.load(f)
+
+
+    def testValuesAreWrittenOnFlush(self):
+        """Ensure the chart file is only written on flush."""
+        writer = perf_chart.ChartWriter(self.resultsdir)
+        writer.add('Test', 'summary', 1.0, 'ms', 'up', False)
+        writer.add('Test', 'summary', 2.0, 'ms', 'up', False)
+        self.assertFalse(os.path.exists(self.chart_file))
+
+        writer.flush()
+        self.assertEqual(self._read_chart_file(),
+                         {'Test': {'summary': {
+                                 'type': 'list_of_scalar_values',
+                                 'units': 'ms', 'values': [1.0, 2.0],
+                                 'improvement_direction': 'up'}}})
+        self.assertFalse(os.path.exists(self.log_file))
+
+
+    def testFlushKeepsExistingValues(self):
+        """Ensure a flush adds to the values already in the chart file."""
+        with open(self.chart_file, 'w') as f:
+            json.dump({'Test': {'summary': {
+                    'type': 'scalar', 'units': 'ms', 'value': 1.0,
+                    'improvement_direction': 'up'}}}, f)
+        writer = perf_chart.ChartWriter(self.resultsdir)
+        writer.add('Test', 'summary', 2.0, 'ms', 'up', False)
+        writer.flush()
+        self.assertEqual(self._read_chart_file()['Test']['summary']['values'],
+                         [1.0, 2.0])
+
+
+    def testTooManyValuesAreFlushed(self):
+        """Ensure the values are written when too many are pending."""
+        writer = perf_chart.ChartWriter(self.resultsdir)
+        for i in xrange(perf_chart.MAX_PENDING_VALUES):
+            writer.add('Test', 'summary', float(i), 'ms', 'up', False)
+        self.assertEqual(
+                len(self._read_chart_file()['Test']['summary']['values']),
+                perf_chart.MAX_PENDING_VALUES)
+
+
+    def testLoggedValuesAreRecovered(self):
+        """Ensure values not flushed by a dead writer are not lost."""
+        writer = perf_chart.ChartWriter(self.resultsdir)
+        writer.add('Test', 'summary', 1.0, 'ms', 'up', False)
+        # The writer dies while logging a value.
+        with open(self.log_file, 'a') as f:
+            f.write('["Test", "summ')
+
+        self.assertEqual(perf_chart.load_charts(self.resultsdir),
+                         {'Test': {'summary': {
+                                 'type': 'scalar', 'units': 'ms',
+                                 'value': 1.0,
+                                 'improvement_direction': 'up'}}})
+
+        writer = perf_chart.ChartWriter(self.resultsdir)
+        writer.add('Test', 'summary', 2.0, 'ms', 'up', False)
+        self.assertEqual(
+                perf_chart.load_charts(self.resultsdir)['Test']['summary'],
+                {'type': 'list_of_scalar_values', 'units': 'ms',
+                 'values': [1.0, 2.0], 'improvement_direction': 'up'})
+        writer.flush()
+        self.assertEqual(self._read_chart_file()['Test']['summary']['values'],
+                         [1.0, 2.0])
+        self.assertFalse(os.path.exists(self.log_file))
+
+
+    def testForkedChildDoesNotShareWriters(self):
+        """Ensure a forked child doesn't flush the values of its parent."""
+        perf_chart.get_writer(self.resultsdir).add(
+                'Test', 'summary', 1.0, 'ms', 'up', False)
+        child_resultsdir = os.path.join(self.resultsdir, 'child')
+        pid = os.fork()
+        if not pid:
+            try:
+                perf_chart.get_writer(child_resultsdir).flush()
+                os._exit(0 if perf_chart._writers.keys() ==
+                         [os.path.abspath(child_resultsdir)] else 1)
+            finally:
+                os._exit(2)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertTrue(os.path.exists(self.log_file))
+
+        perf_chart.get_writer(self.resultsdir).flush()
+        self.assertEqual(self._read_chart_file()['Test']['summary']['value'],
+                         1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
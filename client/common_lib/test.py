@@ -19,7 +19,6 @@
 #pylint: disable=C0111
 
 import fcntl
-import json
 import logging
 import os
 import re
@@ -32,6 +31,7 @@ import traceback
 
 from autotest_lib.client.bin import utils
 from autotest_lib.client.common_lib import error
+from autotest_lib.client.common_lib import perf_chart
 from autotest_lib.client.common_lib import utils as client_utils
 
 try:
@@ -68,6 +68,8 @@ class base_test(object):
                                        dir=job.tmpdir)
         self._keyvals = []
         self._new_keyval = False
+        # Results directories output_perf_value wrote to.
+        self._perf_resultsdirs = set()
         self.failed_constraints = []
         self.iteration = 0
         self.before_iteration_hooks = []
@@ -159,17 +161,8 @@ class base_test(object):
         description = re.sub(string_regex, replacement, description)
         units = re.sub(string_regex, replacement, units) if units else None
 
-        charts = {}
         if not resultsdir:
             resultsdir = self.resultsdir
-        if not os.path.exists(resultsdir):
-            os.makedirs(resultsdir)
-        output_file = os.path.join(resultsdir, 'results-chart.json')
-        if os.path.isfile(output_file):
-            with open(output_file, 'r') as fp:
-                contents = fp.read()
-                if contents:
-                     charts = json.loads(contents)
 
         if graph:
             first_level = graph
@@ -188,58 +181,37 @@ class base_test(object):
         else:
           value = float(value)
 
-        result_type = 'scalar'
-        value_key = 'value'
-        result_value = value
-
-        # The chart json spec go/telemetry-json differenciates between a single
-        # value vs a list of values.  Lists of values get extra processing in
-        # the chromeperf dashboard ( mean, standard deviation etc)
-        # Tests can log one or more values for the same metric, to adhere stricly
-        # to the specification the first value logged is a scalar but if another
-        # value is logged the results become a list of scalar.
-        # TODO Figure out if there would be any difference of always using list
-        # of scalar even if there is just one item in the list.
-        if isinstance(value, list):
-            result_type = 'list_of_scalar_values'
-            value_key = 'values'
-            if first_level in charts and second_level in charts[first_level]:
-                if 'values' in charts[first_level][second_level]:
-                    result_value = charts[first_level][second_level]['values']
-                elif 'value' in charts[first_level][second_level]:
-                    result_value = [charts[first_level][second_level]['value']]
-                if replace_existing_values:
-                    result_value = value
-                else:
-                    result_value.extend(value)
-            else:
-                result_value = value
-        elif (first_level in charts and second_level in charts[first_level] and
-              not replace_existing_values):
-            result_type = 'list_of_scalar_values'
-            value_key = 'values'
-            if 'values' in charts[first_level][second_level]:
-                result_value = charts[first_level][second_level]['values']
-                result_value.append(value)
-            else:
-                result_value = [charts[first_level][second_level]['value'], value]
-
-        test_data = {
-            second_level: {
-                 'type': result_type,
-                 'units': units,
-                 value_key: result_value,
-                 'improvement_direction': direction
-           }
-        }
-
-        if first_level in charts:
-            charts[first_level].update(test_data)
-        else:
-            charts.update({first_level: test_data})
+        # The value is only written to results-chart.json when the perf values
+        # are flushed, see flush_perf_values.
+        self._perf_resultsdirs.add(resultsdir)
+        perf_chart.get_writer(resultsdir).add(
+                first_level, second_level, value, units, direction,
+                replace_existing_values)
+
+
+    def flush_perf_values(self):
+        """
+        Writes the perf values recorded by output_perf_value to their
+        results-chart.json files.
 
-        with open(output_file, 'w') as fp:
-            fp.write(json.dumps(charts, indent=2))
+        This is done at the end of every iteration and of the test; tests
+        reading results-chart.json themselves must call it first.
+        """
+        for resultsdir in self._perf_resultsdirs:
+            perf_chart.get_writer(resultsdir).flush()
+
+
+    def _flush_perf_values_after_failure(self):
+        """
+        Flushes the perf values of a failed test, without hiding its error.
+
+        Values which can't be written are still in the perf value log, which
+        is read by the TKO parser.
+        """
+        try:
+            self.flush_perf_values()
+        except Exception:
+            logging.exception('Failed to write perf values of failed test')
 
 
     def write_perf_keyval(self, perf_dict):
@@ -378,6 +350,7 @@ class base_test(object):
                 logging.debug('The test has completed successfully')
                 self.after_run_once()
 
+            self.flush_perf_values()
             self.postprocess_iteration()
             self.analyze_perf_constraints(constraints)
             finished = True
@@ -387,6 +360,9 @@ class base_test(object):
                           'after_iteration_hooks.', str(e))
             raise
         finally:
+            if not finished:
+                # Keep the values recorded before the failure.
+                self._flush_perf_values_after_failure()
             if not finished or not self.job.fast:
                 logging.debug('Starting after_iteration_hooks for %s',
                               self.tagged_testname)
@@ -474,6 +450,7 @@ class base_test(object):
             self.run_once_profiling(postprocess_profiled_run, *args, **dargs)
 
         # Do any postprocessing, normally extracting performance keyvals, etc
+        self.flush_perf_values()
         self.postprocess()
         self.process_failed_constraints()
 
@@ -500,6 +477,7 @@ class base_test(object):
                 if (postprocess_profiled_run or
                     (postprocess_profiled_run is None and
                      postprocess_attribute)):
+                    self.flush_perf_values()
                     self.postprocess_iteration()
 
             finally:
@@ -622,6 +600,7 @@ class base_test(object):
                         traceback.print_exc()
                         logging.error('Now raising the earlier %s error',
                                       exc_info[0])
+                    self._flush_perf_values_after_failure()
                     self.crash_handler_report()
                 finally:
                     # Raise exception after running cleanup, reporting crash,
@@ -638,6 +617,7 @@ class base_test(object):
                 try:
                     if run_cleanup:
                         _cherry_pick_call(self.cleanup, *args, **dargs)
+                    self.flush_perf_values()
                     self.crash_handler_report()
                 finally:
                     self.job.logging.restore()
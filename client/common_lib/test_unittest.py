@@ -5,9 +5,11 @@
 __author__ = 'gps@google.com (Gregory P. Smith)'
 
 import json
+import os
 import tempfile
 import unittest
 import common
+from autotest_lib.client.common_lib import perf_chart
 from autotest_lib.client.common_lib import test
 from autotest_lib.client.common_lib.test_utils import mock
 
@@ -28,6 +30,7 @@ class TestTestCase(unittest.TestCase):
             self.job.test_retry = 0
             self.job.fast = False
             self._new_keyval = False
+            self._perf_resultsdirs = set()
             self.iteration = 0
             self.tagged_testname = 'neutered_base_test'
             self.before_iteration_hooks = []
@@ -203,6 +206,7 @@ class Test_base_test_execute(TestTestCase):
 
         self.test.output_perf_value("Test", 1, units="ms", higher_is_better=True)
 
+        self.test.flush_perf_values()
         f = open(self.test.resultsdir + "/results-chart.json")
         expected_result = {"Test": {"summary": {"units": "ms", "type": "scalar",
                            "value": 1, "improvement_direction": "up"}}}
@@ -215,18 +219,35 @@ class Test_base_test_execute(TestTestCase):
         self.test.output_perf_value("Test", 1, units="ms",higher_is_better=True,
                                     resultsdir=resultsdir)
 
+        self.test.flush_perf_values()
         f = open(self.test.resultsdir + "/tests/tmp/results-chart.json")
         expected_result = {"Test": {"summary": {"units": "ms", "type": "scalar",
                            "value": 1, "improvement_direction": "up"}}}
         self.assertDictEqual(expected_result, json.loads(f.read()))
 
 
+    def test_flush_perf_values_of_other_tests(self):
+        self.test.resultsdir = tempfile.mkdtemp()
+        other_resultsdir = tempfile.mkdtemp()
+        perf_chart.get_writer(other_resultsdir).add(
+                "Other", "summary", 1, "ms", "up", False)
+
+        self.test.output_perf_value("Test", 1, units="ms", higher_is_better=True)
+
+        self.test.flush_perf_values()
+        self.assertTrue(os.path.exists(
+                self.test.resultsdir + "/results-chart.json"))
+        self.assertFalse(os.path.exists(
+                other_resultsdir + "/results-chart.json"))
+
+
     def test_output_single_perf_value_twice(self):
         self.test.resultsdir = tempfile.mkdtemp()
 
         self.test.output_perf_value("Test", 1, units="ms", higher_is_better=True)
         self.test.output_perf_value("Test", 2, units="ms", higher_is_better=True)
 
+        self.test.flush_perf_values()
         f = open(self.test.resultsdir + "/results-chart.json")
         expected_result = {"Test": {"summary": {"units": "ms",
                            "type": "list_of_scalar_values", "values": [1, 2],
@@ -242,6 +263,7 @@ class Test_base_test_execute(TestTestCase):
         self.test.output_perf_value("Test", 2, units="ms", higher_is_better=True)
         self.test.output_perf_value("Test", 3, units="ms", higher_is_better=True)
 
+        self.test.flush_perf_values()
         f = open(self.test.resultsdir + "/results-chart.json")
         expected_result = {"Test": {"summary": {"units": "ms",
                            "type": "list_of_scalar_values", "values": [1, 2, 3],
@@ -255,6 +277,7 @@ class Test_base_test_execute(TestTestCase):
         self.test.output_perf_value("Test", [1, 2, 3], units="ms",
                                     higher_is_better=False)
 
+        self.test.flush_perf_values()
         f = open(self.test.resultsdir + "/results-chart.json")
         expected_result = {"Test": {"summary": {"units": "ms",
                            "type": "list_of_scalar_values", "values": [1, 2, 3],
@@ -268,6 +291,7 @@ class Test_base_test_execute(TestTestCase):
                                     higher_is_better=False)
         self.test.output_perf_value("Test", [4, 3, 2], units="ms",
                                     higher_is_better=False)
+        self.test.flush_perf_values()
         f = open(self.test.resultsdir + "/results-chart.json")
         expected_result = {"Test": {"summary": {"units": "ms",
                            "type": "list_of_scalar_values",
@@ -282,6 +306,7 @@ class Test_base_test_execute(TestTestCase):
                                     higher_is_better=False)
         self.test.output_perf_value("Test", [4, 3, 2], units="ms",
                                     higher_is_better=False)
+        self.test.flush_perf_values()
         f = open(self.test.resultsdir + "/results-chart.json")
         expected_result = {"Test": {"summary": {"units": "ms",
                            "type": "list_of_scalar_values",
@@ -296,6 +321,7 @@ class Test_base_test_execute(TestTestCase):
         self.test.output_perf_value("Test", u'-0.34', units="ms",
                                     higher_is_better=True)
 
+        self.test.flush_perf_values()
         f = open(self.test.resultsdir + "/results-chart.json")
         expected_result = {"Test": {"summary": {"units": "ms", "type": "scalar",
                            "value": -0.34, "improvement_direction": "up"}}}
@@ -308,6 +334,7 @@ class Test_base_test_execute(TestTestCase):
         self.test.output_perf_value("Test", [0, u'-0.34', 1], units="ms",
                                     higher_is_better=True)
 
+        self.test.flush_perf_values()
         f = open(self.test.resultsdir + "/results-chart.json")
         expected_result = {"Test": {"summary": {"units": "ms",
                            "type": "list_of_scalar_values",
@@ -322,6 +349,7 @@ class Test_base_test_execute(TestTestCase):
         self.test.output_perf_value("Test", [4, 5, 6], units="ms",
                                     higher_is_better=False,
                                     replace_existing_values=True)
+        self.test.flush_perf_values()
         f = open(self.test.resultsdir + "/results-chart.json")
         expected_result = {"Test": {"summary": {"units": "ms",
                            "type": "list_of_scalar_values",
@@ -336,6 +364,7 @@ class Test_base_test_execute(TestTestCase):
         self.test.output_perf_value("Test", [4, 5, 6], units="ms",
                                     higher_is_better=False,
                                     replace_existing_values=True)
+        self.test.flush_perf_values()
         f = open(self.test.resultsdir + "/results-chart.json")
         expected_result = {"Test": {"summary": {"units": "ms",
                            "type": "list_of_scalar_values",
@@ -350,6 +379,7 @@ class Test_base_test_execute(TestTestCase):
         self.test.output_perf_value("Test", 4, units="ms",
                                     higher_is_better=False,
                                     replace_existing_values=True)
+        self.test.flush_perf_values()
         f = open(self.test.resultsdir + "/results-chart.json")
         expected_result = {"Test": {"summary": {"units": "ms",
                            "type": "scalar",
@@ -364,6 +394,7 @@ class Test_base_test_execute(TestTestCase):
         self.test.output_perf_value("Test", 2, units="ms",
                                     higher_is_better=False,
                                     replace_existing_values=True)
+        self.test.flush_perf_values()
         f = open(self.test.resultsdir + "/results-chart.json")
         expected_result = {"Test": {"summary": {"units": "ms",
                            "type": "scalar",
@@ -382,6 +413,7 @@ class Test_base_test_execute(TestTestCase):
         self.test.output_perf_value("Test2", -1, units="ms",
                                     higher_is_better=False,
                                     replace_existing_values=True)
+        self.test.flush_perf_values()
         f = open(self.test.resultsdir + "/results-chart.json")
         expected_result = {"Test1": {"summary":
                                        {"units": "ms",
@@ -423,6 +455,7 @@ class Test_base_test_execute(TestTestCase):
                                       drop, units='percent_drop',
                                       higher_is_better=False,
                                       graph=ap_config_tag + '_drop')
+        self.test.flush_perf_values()
         f = open(self.test.resultsdir + "/results-chart.json")
         expected_result = {
           "ch006_mode11B_none_drop": {
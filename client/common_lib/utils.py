@@ -15,6 +15,8 @@ import StringIO
 import collections
 import datetime
 import errno
+import fcntl
+import functools
 import inspect
 import itertools
 import logging
@@ -92,6 +94,15 @@ DEFAULT_STDERR_LEVEL = logging.ERROR
 STDOUT_PREFIX = '[stdout] '
 STDERR_PREFIX = '[stderr] '
 
+# Bytes read from a command's output pipe per wakeup. The read size doubles
+# while the command keeps filling it, up to the size of a Linux pipe buffer.
+_MIN_READ_SIZE = 4096
+_MAX_READ_SIZE = 64 * 1024
+
+# Seconds between checks for exited commands. SIGCHLD only wakes up the wait
+# sooner: it may be delivered to a thread which doesn't run the handler.
+_EXIT_POLL_INTERVAL = 1
+
 # safe characters for the shell (do not need quoting)
 SHELL_QUOTING_WHITELIST = frozenset(string.ascii_letters +
                                     string.digits +
@@ -236,6 +247,7 @@ class BgJob(object):
                 env=env, close_fds=True)
 
         self._cleanup_called = False
+        self._read_sizes = {True: _MIN_READ_SIZE, False: _MIN_READ_SIZE}
         self._stdout_file = (
             None if stdout_tee == DEVNULL else StringIO.StringIO())
         self._stderr_file = (
@@ -244,9 +256,10 @@ class BgJob(object):
     def process_output(self, stdout=True, final_read=False):
         """Read from process's output stream, and write data to destinations.
 
-        This function reads up to 1024 bytes from the background job's
-        stdout or stderr stream, and writes the resulting data to the BgJob's
-        output tee and to the stream set up in output_prepare.
+        This function reads a chunk of data from the background job's stdout
+        or stderr stream, and writes the resulting data to the BgJob's
+        output tee and to the stream set up in output_prepare. The chunk size
+        grows while the job fills it, so chatty jobs take fewer wakeups.
 
         Warning: Calls to process_output will block on reads from the
         subprocess stream, and will block on writes to the configured
@@ -255,9 +268,10 @@ class BgJob(object):
         @param stdout: True = read and process data from job's stdout.
                        False = from stderr.
                        Default: True
-        @param final_read: Do not read only 1024 bytes from stream. Instead,
+        @param final_read: Do not read only one chunk from stream. Instead,
                            read and process all data until end of the stream.
 
+        @return: The number of bytes read, 0 at the end of the stream.
         """
         if self.unjoinable:
             raise error.InvalidBgJobCall('Cannot call process_output on '
@@ -270,21 +284,25 @@ class BgJob(object):
                 self.sp.stderr, self._stderr_file, self._stderr_tee)
 
         if not pipe:
-            return
+            return 0
 
         if final_read:
             # read in all the data we can from pipe and then stop
             data = []
-            while select.select([pipe], [], [], 0)[0]:
-                data.append(os.read(pipe.fileno(), 1024))
+            while _fd_is_readable(pipe.fileno()):
+                data.append(os.read(pipe.fileno(), _MAX_READ_SIZE))
                 if len(data[-1]) == 0:
                     break
             data = "".join(data)
         else:
             # perform a single read
-            data = os.read(pipe.fileno(), 1024)
+            read_size = self._read_sizes[stdout]
+            data = os.read(pipe.fileno(), read_size)
+            if len(data) == read_size:
+                self._read_sizes[stdout] = min(read_size * 2, _MAX_READ_SIZE)
         buf.write(data)
         tee.write(data)
+        return len(data)
 
     def cleanup(self):
         """Clean up after BgJob.
@@ -319,6 +337,99 @@ class BgJob(object):
             signal.signal(signal.SIGPIPE, signal.SIG_DFL)
 
 
+def _fd_is_readable(fd):
+    """Check whether a read from a file descriptor would not block.
+
+    Unlike select.select, poll works with file descriptors above FD_SETSIZE.
+
+    @param fd: The file descriptor.
+    """
+    poller = select.poll()
+    poller.register(fd, select.POLLIN | select.POLLPRI)
+    while True:
+        try:
+            return bool(poller.poll(0))
+        except select.error as v:
+            if v[0] != errno.EINTR:
+                raise
+
+
+class _ChildExitNotifier(object):
+    """Context manager making a pipe readable whenever a child process exits.
+
+    While active, a SIGCHLD handler writes to the pipe, so that a poll loop
+    wakes up as soon as a child exits. The handler only runs in the main
+    thread, and SIGCHLD may be delivered to another thread, so callers must
+    still check on their children periodically. Signal handlers can only be
+    set from the main thread; elsewhere, fd is None.
+    """
+
+    def __init__(self):
+        self.fd = None
+        self._write_fd = None
+        self._old_handler = None
+
+
+    def __enter__(self):
+        if env.IN_MOD_WSGI:
+            return self
+        old_handler = signal.getsignal(signal.SIGCHLD)
+        if old_handler is None:
+            # The handler was not set from Python, so it can't be restored.
+            return self
+        read_fd, write_fd = os.pipe()
+        for fd in (read_fd, write_fd):
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            fcntl.fcntl(fd, fcntl.F_SETFD,
+                        fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+        self._write_fd = write_fd
+        self._old_handler = old_handler
+        try:
+            signal.signal(signal.SIGCHLD, self._handle_sigchld)
+        except ValueError:
+            # Not in the main thread.
+            os.close(read_fd)
+            os.close(write_fd)
+            self._write_fd = None
+            return self
+        # Don't make other system calls fail with EINTR.
+        signal.siginterrupt(signal.SIGCHLD, False)
+        self.fd = read_fd
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.fd is None:
+            return
+        signal.signal(signal.SIGCHLD, self._old_handler)
+        os.close(self.fd)
+        os.close(self._write_fd)
+        self.fd = self._write_fd = None
+
+
+    def _handle_sigchld(self, signum, frame):
+        """Wake up the poll loop, and chain to the previous handler."""
+        try:
+            os.write(self._write_fd, '\0')
+        except (OSError, TypeError):
+            # The pipe is full, so a wakeup is pending already, or it was
+            # closed.
+            pass
+        if callable(self._old_handler):
+            self._old_handler(signum, frame)
+
+
+    def drain(self):
+        """Empty the pipe, after the wakeups it holds were handled."""
+        try:
+            while os.read(self.fd, 512):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+
 def ip_to_long(ip):
     # !L is a long in network byte order
     return struct.unpack('!L', socket.inet_aton(ip))[0]
@@ -765,30 +876,35 @@ def run(command, timeout=None, ignore_status=False, stdout_tee=None,
 
 def run_parallel(commands, timeout=None, ignore_status=False,
                  stdout_tee=None, stderr_tee=None,
-                 nicknames=None):
+                 nicknames=None, max_parallel=None):
     """
     Behaves the same as run() with the following exceptions:
 
     - commands is a list of commands to run in parallel.
     - ignore_status toggles whether or not an exception should be raised
       on any error.
+    - max_parallel is the maximum number of commands running at once, or
+      None to start all the commands at once. Queued commands are started
+      as running ones exit, in order.
 
     @return: a list of CmdResult objects
     """
-    bg_jobs = []
+    job_starters = []
     if nicknames is None:
         nicknames = []
     for (command, nickname) in itertools.izip_longest(commands, nicknames):
-        bg_jobs.append(BgJob(command, stdout_tee, stderr_tee,
-                             stderr_level=get_stderr_level(ignore_status),
-                             nickname=nickname))
+        job_starters.append(functools.partial(
+                BgJob, command, stdout_tee, stderr_tee,
+                stderr_level=get_stderr_level(ignore_status),
+                nickname=nickname))
 
+    bg_jobs = [start() for start in job_starters[:max_parallel]]
     # Updates objects in bg_jobs list with their process information
-    join_bg_jobs(bg_jobs, timeout)
+    join_bg_jobs(bg_jobs, timeout, queued_jobs=job_starters[len(bg_jobs):])
 
     for bg_job in bg_jobs:
         if not ignore_status and bg_job.result.exit_status:
-            raise error.CmdError(command, bg_job.result,
+            raise error.CmdError(bg_job.command, bg_job.result,
                                  "Command returned non-zero exit status")
 
     return [bg_job.result for bg_job in bg_jobs]
@@ -801,10 +917,16 @@ def run_bg(command):
     return bg_job.sp, bg_job.result
 
 
-def join_bg_jobs(bg_jobs, timeout=None):
+def join_bg_jobs(bg_jobs, timeout=None, queued_jobs=()):
     """Joins the bg_jobs with the current thread.
 
     Returns the same list of bg_jobs objects that was passed in.
+
+    @param bg_jobs: A list of BgJob objects to join.
+    @param timeout: The timeout of the list of bg_jobs.
+    @param queued_jobs: A list of functions starting and returning a BgJob.
+            One is called whenever a job in bg_jobs exits, and the new job
+            is appended to bg_jobs.
     """
     if any(bg_job.unjoinable for bg_job in bg_jobs):
         raise error.InvalidBgJobCall(
@@ -815,16 +937,16 @@ def join_bg_jobs(bg_jobs, timeout=None):
         # We are holding ends to stdin, stdout pipes
         # hence we need to be sure to close those fds no mater what
         start_time = time.time()
-        timeout_error = _wait_for_commands(bg_jobs, start_time, timeout)
+        timeout_error = _wait_for_commands(bg_jobs, start_time, timeout,
+                                           iter(queued_jobs))
 
         for bg_job in bg_jobs:
-            # Process stdout and stderr
-            bg_job.process_output(stdout=True,final_read=True)
-            bg_job.process_output(stdout=False,final_read=True)
+            _finish_bg_job(bg_job)
     finally:
         # close our ends of the pipes to the sp no matter what
         for bg_job in bg_jobs:
-            bg_job.cleanup()
+            if not bg_job._cleanup_called:
+                bg_job.cleanup()
 
     if timeout_error:
         # TODO: This needs to be fixed to better represent what happens when
@@ -838,111 +960,168 @@ def join_bg_jobs(bg_jobs, timeout=None):
     return bg_jobs
 
 
-def _wait_for_commands(bg_jobs, start_time, timeout):
-    """Waits for background jobs by select polling their stdout/stderr.
+def _finish_bg_job(bg_job):
+    """Process the remaining output of an exited job, and clean it up.
+
+    @param bg_job: The BgJob. Nothing is done if it was cleaned up already.
+    """
+    if bg_job._cleanup_called:
+        return
+    # Process stdout and stderr
+    bg_job.process_output(stdout=True, final_read=True)
+    bg_job.process_output(stdout=False, final_read=True)
+    bg_job.cleanup()
+
+
+def _wait_for_commands(bg_jobs, start_time, timeout, queued_jobs=None):
+    """Waits for background jobs by polling their stdout/stderr.
+
+    The jobs' pipes are watched with poll, which unlike select has no limit on
+    the file descriptor numbers. Exited jobs are detected on SIGCHLD when
+    possible, rather than by checking on every job at every wakeup, and at
+    least every _EXIT_POLL_INTERVAL seconds, in case SIGCHLD was missed.
 
     @param bg_jobs: A list of background jobs to wait on.
     @param start_time: Time used to calculate the timeout lifetime of a job.
     @param timeout: The timeout of the list of bg_jobs.
+    @param queued_jobs: An optional iterator of functions starting and
+            returning a BgJob. One is called whenever a job exits, and the
+            new job is appended to bg_jobs. The exited job is then finished
+            right away, to release its pipes.
 
     @return: True if the return was due to a timeout, False otherwise.
     """
+    poller = select.poll()
+    # Maps file descriptors to (bg_job, is_stdout) tuples, with is_stdout
+    # None for the stdin of the job.
+    fd_map = {}
+    running = []
+    # Maps jobs to the time they were started at.
+    job_start_times = {}
+
+    def watch(bg_job, job_start_time):
+        """Start watching the pipes of a job."""
+        running.append(bg_job)
+        job_start_times[bg_job] = job_start_time
+        for pipe, is_stdout in ((bg_job.sp.stdout, True),
+                                (bg_job.sp.stderr, False)):
+            if pipe:
+                fd_map[pipe.fileno()] = (bg_job, is_stdout)
+                poller.register(pipe, select.POLLIN | select.POLLPRI)
+        if bg_job.string_stdin is not None:
+            fd_map[bg_job.sp.stdin.fileno()] = (bg_job, None)
+            poller.register(bg_job.sp.stdin, select.POLLOUT)
 
-    # To check for processes which terminate without producing any output
-    # a 1 second timeout is used in select.
-    SELECT_TIMEOUT = 1
-
-    read_list = []
-    write_list = []
-    reverse_dict = {}
+    def unwatch(fd):
+        """Stop watching a pipe of a job, closing it if it's stdin."""
+        bg_job, is_stdout = fd_map.pop(fd)
+        poller.unregister(fd)
+        if is_stdout is None:
+            bg_job.sp.stdin.close()
 
     for bg_job in bg_jobs:
-        if bg_job.sp.stdout:
-            read_list.append(bg_job.sp.stdout)
-            reverse_dict[bg_job.sp.stdout] = (bg_job, True)
-        if bg_job.sp.stderr:
-            read_list.append(bg_job.sp.stderr)
-            reverse_dict[bg_job.sp.stderr] = (bg_job, False)
-        if bg_job.string_stdin is not None:
-            write_list.append(bg_job.sp.stdin)
-            reverse_dict[bg_job.sp.stdin] = bg_job
+        if bg_job.result.exit_status is None:
+            watch(bg_job, start_time)
 
     if timeout:
         stop_time = start_time + timeout
-        time_left = stop_time - time.time()
-    else:
-        time_left = None # so that select never times out
-
-    while not timeout or time_left > 0:
-        # select will return when we may write to stdin, when there is
-        # stdout/stderr output we can read (including when it is
-        # EOF, that is the process has terminated) or when a non-fatal
-        # signal was sent to the process. In the last case the select returns
-        # EINTR, and we continue waiting for the job if the signal handler for
-        # the signal that interrupted the call allows us to.
-        try:
-            read_ready, write_ready, _ = select.select(read_list, write_list,
-                                                       [], SELECT_TIMEOUT)
-        except select.error as v:
-            if v[0] == errno.EINTR:
-                logging.warning(v)
-                continue
-            else:
-                raise
-        # os.read() has to be used instead of
-        # subproc.stdout.read() which will otherwise block
-        for file_obj in read_ready:
-            bg_job, is_stdout = reverse_dict[file_obj]
-            bg_job.process_output(is_stdout)
-
-        for file_obj in write_ready:
-            # we can write PIPE_BUF bytes without blocking
-            # POSIX requires PIPE_BUF is >= 512
-            bg_job = reverse_dict[file_obj]
-            file_obj.write(bg_job.string_stdin[:512])
-            bg_job.string_stdin = bg_job.string_stdin[512:]
-            # no more input data, close stdin, remove it from the select set
-            if not bg_job.string_stdin:
-                file_obj.close()
-                write_list.remove(file_obj)
-                del reverse_dict[file_obj]
-
-        all_jobs_finished = True
-        for bg_job in bg_jobs:
-            if bg_job.result.exit_status is not None:
-                continue
-
-            bg_job.result.exit_status = bg_job.sp.poll()
-            if bg_job.result.exit_status is not None:
-                # process exited, remove its stdout/stdin from the select set
-                bg_job.result.duration = time.time() - start_time
-                if bg_job.sp.stdout:
-                    read_list.remove(bg_job.sp.stdout)
-                    del reverse_dict[bg_job.sp.stdout]
-                if bg_job.sp.stderr:
-                    read_list.remove(bg_job.sp.stderr)
-                    del reverse_dict[bg_job.sp.stderr]
-            else:
-                all_jobs_finished = False
-
-        if all_jobs_finished:
-            return False
 
-        if timeout:
-            time_left = stop_time - time.time()
+    with _ChildExitNotifier() as child_exits:
+        if child_exits.fd is not None:
+            poller.register(child_exits.fd, select.POLLIN)
+        check_exits = True
+        next_exit_check = 0
+
+        while True:
+            if time.time() >= next_exit_check:
+                next_exit_check = time.time() + _EXIT_POLL_INTERVAL
+                check_exits = True
+            if check_exits:
+                check_exits = False
+                for bg_job in running[:]:
+                    bg_job.result.exit_status = bg_job.sp.poll()
+                    if bg_job.result.exit_status is None:
+                        continue
+                    # process exited, remove its pipes from the poll set
+                    bg_job.result.duration = (time.time() -
+                                              job_start_times[bg_job])
+                    running.remove(bg_job)
+                    for fd, (job, _) in fd_map.items():
+                        if job is bg_job:
+                            unwatch(fd)
+                    next_job = next(queued_jobs, None) if queued_jobs else None
+                    if next_job:
+                        _finish_bg_job(bg_job)
+                        next_job_start_time = time.time()
+                        bg_jobs.append(next_job())
+                        watch(bg_jobs[-1], next_job_start_time)
+                if not running:
+                    return False
+
+            if timeout:
+                time_left = stop_time - time.time()
+                if time_left <= 0:
+                    break
+            else:
+                time_left = None
+            time_left = min(time_left or _EXIT_POLL_INTERVAL,
+                            max(next_exit_check - time.time(), 0))
+
+            # poll will return when we may write to stdin, when there is
+            # stdout/stderr output we can read (including when it is
+            # EOF, that is the process has terminated) or when a non-fatal
+            # signal was sent to the process. In the last case the poll raises
+            # EINTR, and we continue waiting for the job if the signal handler
+            # for the signal that interrupted the call allows us to.
+            try:
+                events = poller.poll(time_left * 1000)
+            except select.error as v:
+                if v[0] == errno.EINTR:
+                    # SIGCHLD interrupts are expected, and handled below.
+                    if child_exits.fd is None:
+                        logging.warning(v)
+                    continue
+                else:
+                    raise
+
+            for fd, event in events:
+                if fd == child_exits.fd:
+                    child_exits.drain()
+                    check_exits = True
+                    continue
+                if fd not in fd_map:
+                    # The job exited while handling an earlier event.
+                    continue
+                bg_job, is_stdout = fd_map[fd]
+                if is_stdout is None:
+                    if not event & select.POLLOUT:
+                        # The job closed its stdin.
+                        unwatch(fd)
+                        continue
+                    # we can write PIPE_BUF bytes without blocking
+                    # POSIX requires PIPE_BUF is >= 512
+                    bg_job.sp.stdin.write(bg_job.string_stdin[:512])
+                    bg_job.string_stdin = bg_job.string_stdin[512:]
+                    # no more input data, close stdin, remove it from the
+                    # poll set
+                    if not bg_job.string_stdin:
+                        unwatch(fd)
+                # os.read() has to be used instead of
+                # subproc.stdout.read() which will otherwise block
+                elif not bg_job.process_output(is_stdout):
+                    # End of the stream, don't wake up for it anymore.
+                    poller.unregister(fd)
+                    del fd_map[fd]
 
     # Kill all processes which did not complete prior to timeout
-    for bg_job in bg_jobs:
-        if bg_job.result.exit_status is not None:
-            continue
-
+    for bg_job in running:
         logging.warning('run process timeout (%s) fired on: %s', timeout,
                         bg_job.command)
         if nuke_subprocess(bg_job.sp) is None:
             # If process could not be SIGKILL'd, log kernel stack.
             logging.warning(read_file('/proc/%d/stack' % bg_job.sp.pid))
         bg_job.result.exit_status = bg_job.sp.poll()
-        bg_job.result.duration = time.time() - start_time
+        bg_job.result.duration = time.time() - job_start_times[bg_job]
 
     return True
 
@@ -1034,12 +1213,18 @@ def system(command, timeout=None, ignore_status=False):
                stdout_tee=TEE_TO_LOGS, stderr_tee=TEE_TO_LOGS).exit_status
 
 
-def system_parallel(commands, timeout=None, ignore_status=False):
+def system_parallel(commands, timeout=None, ignore_status=False,
+                    max_parallel=None):
     """This function returns a list of exit statuses for the respective
-    list of commands."""
+    list of commands.
+
+    @param max_parallel: Maximum number of commands running at once, or None
+            to start all the commands at once.
+    """
     return [bg_jobs.exit_status for bg_jobs in
             run_parallel(commands, timeout=timeout, ignore_status=ignore_status,
-                         stdout_tee=TEE_TO_LOGS, stderr_tee=TEE_TO_LOGS)]
+                         stdout_tee=TEE_TO_LOGS, stderr_tee=TEE_TO_LOGS,
+                         max_parallel=max_parallel)]
 
 
 def system_output(command, timeout=None, ignore_status=False,
@@ -2283,16 +2468,14 @@ def urlopen_socket_timeout(url, data=None, timeout=5):
              urllib2.URLError for errors that not caused by timeout.
              urllib2.HTTPError for errors like 404 url not found.
     """
-    old_timeout = socket.getdefaulttimeout()
-    socket.setdefaulttimeout(timeout)
+    # The timeout is passed to the socket rather than set as the default
+    # timeout, so that concurrent calls from several threads are safe.
     try:
-        return urllib2.urlopen(url, data=data)
+        return urllib2.urlopen(url, data=data, timeout=timeout)
     except urllib2.URLError as e:
         if type(e.reason) is socket.timeout:
             raise error.TimeoutException(str(e))
         raise
-    finally:
-        socket.setdefaulttimeout(old_timeout)
 
 
 def parse_chrome_version(version_string):
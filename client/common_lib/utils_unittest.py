@@ -8,8 +8,10 @@ import itertools
 import logging
 import os
 import select
+import shutil
 import socket
 import subprocess
+import tempfile
 import time
 import unittest
 import urllib2
@@ -834,23 +836,97 @@ class test_run(unittest.TestCase):
 
 
     def test_wait_interrupt(self):
-        """Test that we actually select twice if the first one returns EINTR."""
+        """Test that we actually poll twice if the first one returns EINTR."""
         utils.logging.debug.expect_any_call()
 
-        bg_job = utils.BgJob('echo "hello world"')
-        bg_job.result.exit_status = 0
-        self.god.stub_function(utils.select, 'select')
+        # cat exits only once _wait_for_commands wrote its stdin, which takes
+        # a successful poll after the interrupted one.
+        bg_job = utils.BgJob('cat', stdin='hello world')
+        poller = _FakePoller([select.error(errno.EINTR, 'Poll interrupted')])
+        self.god.stub_with(utils.select, 'poll', lambda: poller)
 
-        utils.select.select.expect_any_call().and_raises(
-                select.error(errno.EINTR, 'Select interrupted'))
-        utils.logging.warning.expect_any_call()
+        self.assertFalse(
+                utils._wait_for_commands([bg_job], time.time(), None))
+        self.assertTrue(poller.poll_count >= 2)
+        self.assertEqual(bg_job.result.exit_status, 0)
 
-        utils.select.select.expect_any_call().and_return(
-                ([bg_job.sp.stdout, bg_job.sp.stderr], [], None))
-        utils.logging.warning.expect_any_call()
+
+    def test_wait_polls_with_timeout(self):
+        """Test that exits are checked on even if SIGCHLD is missed."""
+        utils.logging.debug.expect_any_call()
+
+        bg_job = utils.BgJob('sleep 0.1')
+        poller = _FakePoller([])
+        self.god.stub_with(utils.select, 'poll', lambda: poller)
+        self.god.stub_with(utils._ChildExitNotifier, '_handle_sigchld',
+                           lambda *args: None)
 
         self.assertFalse(
                 utils._wait_for_commands([bg_job], time.time(), None))
+        self.assertEqual(bg_job.result.exit_status, 0)
+        for timeout in poller.timeouts:
+            self.assertIsNotNone(timeout)
+            self.assertTrue(
+                    timeout <= utils._EXIT_POLL_INTERVAL * 1000, timeout)
+
+
+class test_run_parallel(unittest.TestCase):
+    """Test the utils.run_parallel() function."""
+
+    def test_max_parallel(self):
+        """Test that queued commands run in order, a few at a time."""
+        running_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, running_dir)
+        # Each command prints its index, and the number of commands running
+        # when it started.
+        commands = ['touch %(dir)s/%(i)d && echo %(i)d $(ls %(dir)s | wc -l) '
+                    '&& sleep 0.3 && rm %(dir)s/%(i)d'
+                    % {'dir': running_dir, 'i': i} for i in xrange(10)]
+        results = utils.run_parallel(commands, max_parallel=3)
+        outputs = [result.stdout.split() for result in results]
+        self.assertEqual([int(index) for index, _ in outputs], range(10))
+        self.assertTrue(max(int(running) for _, running in outputs) <= 3)
+        # Durations are measured from the start of each command, not from the
+        # start of the first ones.
+        for result in results:
+            self.assertTrue(result.duration < 1, result.duration)
+
+
+    def test_chatty_commands(self):
+        """Test many commands with more output than a pipe buffer holds."""
+        command = 'yes | head -c 200000'
+        results = utils.run_parallel([command] * 50)
+        for result in results:
+            self.assertEqual(result.stdout, 'y\n' * 100000)
+
+
+class _FakePoller(object):
+    """Poll object raising canned errors, then polling for real."""
+
+    def __init__(self, results):
+        """
+        @param results: List of exceptions to raise from the first poll calls.
+        """
+        self._results = list(results)
+        self._poller = select.poll()
+        self.poll_count = 0
+        self.timeouts = []
+
+
+    def register(self, fd, eventmask):
+        self._poller.register(fd, eventmask)
+
+
+    def unregister(self, fd):
+        self._poller.unregister(fd)
+
+
+    def poll(self, timeout=None):
+        self.poll_count += 1
+        self.timeouts.append(timeout)
+        if self._results:
+            raise self._results.pop(0)
+        return self._poller.poll(timeout)
 
 
 class test_compare_versions(unittest.TestCase):
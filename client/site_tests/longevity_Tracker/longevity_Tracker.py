@@ -248,6 +248,7 @@ class longevity_Tracker(test.test):
 
         @returns dict of perf results, formatted as JSON chart data.
         """
+        self.flush_perf_values()
         results_file = os.path.join(self.resultsdir, 'results-chart.json')
         with open(results_file, 'r') as fp:
             contents = fp.read()
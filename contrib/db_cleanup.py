@@ -43,6 +43,44 @@ INNER JOIN %(related_table)s
   %(related_table)s.%(related_primary_key)s
 WHERE %(related_table)s.%(time_column)s <= "%(date)s"
 """
+# tko_test_status_rollups is maintained by tko/db.py, which is bypassed here.
+UNCOUNT_ROLLUPS_CMD_FORMAT = """
+UPDATE tko_test_status_rollups
+INNER JOIN (
+  SELECT SHA1(CONCAT_WS(CHAR(10), IFNULL(tko_jobs.label, ''),
+                        IFNULL(tko_jobs.build, ''), IFNULL(tko_jobs.board, ''),
+                        IFNULL(tko_tests.test, ''), tko_status.word))
+           AS key_hash,
+         COUNT(*) AS test_count
+  FROM tko_tests
+  INNER JOIN tko_jobs ON tko_jobs.job_idx = tko_tests.job_idx
+  INNER JOIN tko_status ON tko_status.status_idx = tko_tests.status
+  WHERE tko_jobs.started_time <= "%(date)s"
+  GROUP BY 1) AS deleted
+  ON tko_test_status_rollups.key_hash = deleted.key_hash
+SET tko_test_status_rollups.test_count =
+    tko_test_status_rollups.test_count - deleted.test_count
+"""
+DELETE_EMPTY_ROLLUPS_CMD = """
+DELETE FROM tko_test_status_rollups WHERE test_count <= 0
+"""
+# Rollups whose latest test was deleted, but not all of their tests.
+FIX_ROLLUPS_LATEST_TEST_CMD = """
+UPDATE tko_test_status_rollups
+SET tko_test_status_rollups.max_test_idx = IFNULL((
+  SELECT MAX(tko_tests.test_idx) FROM tko_tests
+  INNER JOIN tko_jobs ON tko_jobs.job_idx = tko_tests.job_idx
+  INNER JOIN tko_status ON tko_status.status_idx = tko_tests.status
+  WHERE IFNULL(tko_jobs.label, '') = tko_test_status_rollups.job_name
+    AND IFNULL(tko_jobs.build, '') = tko_test_status_rollups.build
+    AND IFNULL(tko_jobs.board, '') = tko_test_status_rollups.board
+    AND IFNULL(tko_tests.test, '') = tko_test_status_rollups.test_name
+    AND tko_status.word = tko_test_status_rollups.status),
+  tko_test_status_rollups.max_test_idx)
+WHERE NOT EXISTS (
+  SELECT 1 FROM tko_tests
+  WHERE tko_tests.test_idx = tko_test_status_rollups.max_test_idx)
+"""
 DELETE_ROWS_FORMAT = """
 DELETE FROM %(table)s
 WHERE %(table)s.%(primary_key)s IN (%(rows)s)
@@ -225,6 +263,17 @@ def _delete_table_data_before_date(table_to_delete_from, primary_key,
                 time.sleep((end - start) / LOAD_RATIO)
 
 
+def _execute(sql):
+    """Execute and commit a statement, unless this is a dry run.
+
+    @param sql: The statement.
+    """
+    logging.debug('SQL: %s', sql)
+    if not DRY_RUN:
+        cursor.execute(sql, [])
+        transaction.commit_unless_managed(using='default')
+
+
 def _subtract_days(date, days_to_subtract):
     """
     Return a date (string) that is 'days' before 'date'
@@ -342,9 +391,13 @@ def _delete_all_data_before_date(date):
     _delete_table_data_before_date('afe_jobs', 'id',
                                    'tko_jobs', AFE_JOB_ID,
                                    date, foreign_key='id')
+    logging.info('Uncounting tko_tests prior to %s from the rollups.', date)
+    _execute(UNCOUNT_ROLLUPS_CMD_FORMAT % {'date': date})
+    _execute(DELETE_EMPTY_ROLLUPS_CMD)
     _delete_table_data_before_date('tko_tests', TEST_IDX,
                                    'tko_jobs', JOB_IDX,
                                    date, foreign_key=JOB_IDX)
+    _execute(FIX_ROLLUPS_LATEST_TEST_CMD)
     _delete_table_data_before_date('tko_jobs', JOB_IDX,
                                    None, None, date)
 
@@ -3,6 +3,7 @@
 import contextlib
 from datetime import datetime
 from datetime import timedelta
+import json
 import logging
 import os
 
@@ -233,6 +234,44 @@ class Shard(dbmodels.Model, model_logic.ModelExtensions):
         db_table = 'afe_shards'
 
 
+class ShardHeartbeatState(dbmodels.Model, model_logic.ModelExtensions):
+    """The records a shard reported knowing at its last heartbeat.
+
+    Stored so that shards can send only what changed since then.
+
+    sequence: Number of the last heartbeat, incremented at each heartbeat.
+    known_job_ids: JSON list of the ids of the jobs the shard knows.
+    known_host_ids: JSON list of the ids of the hosts the shard knows.
+    """
+    shard = dbmodels.OneToOneField(Shard, on_delete=dbmodels.CASCADE,
+                                   primary_key=True)
+    sequence = dbmodels.IntegerField(default=0)
+    known_job_ids = dbmodels.TextField(default='[]')
+    known_host_ids = dbmodels.TextField(default='[]')
+
+    class Meta:
+        """Metadata for class ShardHeartbeatState."""
+        db_table = 'afe_shard_heartbeat_states'
+
+
+    def get_known_ids(self):
+        """@returns A (job ids, host ids) tuple of sets."""
+        return (set(json.loads(self.known_job_ids)),
+                set(json.loads(self.known_host_ids)))
+
+
+    def set_known_ids(self, job_ids, host_ids):
+        """Record the ids the shard knows, and start a new heartbeat.
+
+        @param job_ids: Iterable of the ids of the jobs the shard knows.
+        @param host_ids: Iterable of the ids of the hosts the shard knows.
+        """
+        self.known_job_ids = json.dumps(sorted(job_ids))
+        self.known_host_ids = json.dumps(sorted(host_ids))
+        self.sequence += 1
+        self.save()
+
+
 class Drone(dbmodels.Model, model_logic.ModelExtensions):
     """
     A scheduler drone
@@ -632,6 +632,10 @@ def get_hosts(multiple_labels=(), exclude_only_if_needed_labels=False,
     @param exclude_only_if_needed_labels: Deprecated. Raise error if it's True.
     @param include_current_job: Set to True to include ids of currently running
             job and special task.
+
+    Large sets of hosts can be fetched in pages, with the query_start and
+    query_limit filters.  The number of database queries does not depend on
+    the number of hosts.
     """
     if exclude_only_if_needed_labels:
         raise error.RPCException('exclude_only_if_needed_labels is deprecated')
@@ -649,6 +653,13 @@ def get_hosts(multiple_labels=(), exclude_only_if_needed_labels=False,
     models.Host.objects.populate_relationships(hosts,
                                                models.StaticHostAttribute,
                                                'staticattribute_list')
+    if RESPECT_STATIC_LABELS:
+        static_labels = rpc_utils.get_replacing_static_labels(
+                label for host_obj in hosts for label in host_obj.label_list)
+    if include_current_job:
+        current_jobs, current_special_tasks = (
+                rpc_utils.get_current_jobs_and_special_tasks(
+                        [host_obj.id for host_obj in hosts]))
     host_dicts = []
     for host_obj in hosts:
         host_dict = host_obj.get_object_dict()
@@ -660,11 +671,7 @@ def get_hosts(multiple_labels=(), exclude_only_if_needed_labels=False,
             # Only keep static labels which has a corresponding entries in
             # afe_labels.
             for label in host_obj.label_list:
-                if label.is_replaced_by_static():
-                    static_label = models.StaticLabel.smart_get(label.name)
-                    label_list.append(static_label)
-                else:
-                    label_list.append(label)
+                label_list.append(static_labels.get(label.id, label))
 
             host_dict['labels'] = [label.name for label in label_list]
             host_dict['platform'] = rpc_utils.find_platform(
@@ -681,19 +688,9 @@ def get_hosts(multiple_labels=(), exclude_only_if_needed_labels=False,
                     host_dict['attributes'][attr.attribute] = attr.value
 
         if include_current_job:
-            host_dict['current_job'] = None
-            host_dict['current_special_task'] = None
-            entries = models.HostQueueEntry.objects.filter(
-                    host_id=host_dict['id'], active=True, complete=False)
-            if entries:
-                host_dict['current_job'] = (
-                        entries[0].get_object_dict()['job'])
-            tasks = models.SpecialTask.objects.filter(
-                    host_id=host_dict['id'], is_active=True, is_complete=False)
-            if tasks:
-                host_dict['current_special_task'] = (
-                        '%d-%s' % (tasks[0].get_object_dict()['id'],
-                                   tasks[0].get_object_dict()['task'].lower()))
+            host_dict['current_job'] = current_jobs.get(host_obj.id)
+            host_dict['current_special_task'] = current_special_tasks.get(
+                    host_obj.id)
         host_dicts.append(host_dict)
 
     return rpc_utils.prepare_for_serialization(host_dicts)
@@ -1478,6 +1475,55 @@ def get_host_special_tasks(host_id, **filter_data):
                              host_id=host_id, **filter_data)
 
 
+def _group_host_ids_by_shard(host_ids, valid_only):
+    """Group hosts by the shard they are assigned to.
+
+    @param host_ids     Ids in the database of the hosts.
+    @param valid_only   Whether to leave out hosts in an invalid state.
+
+    @return A dict of lists of host ids, by shard hostname.  The
+            hosts that are not assigned to a shard, or all the hosts
+            when running on a shard, are listed under `None`.
+
+    """
+    manager = models.Host.valid_objects if valid_only else models.Host.objects
+    rows = manager.filter(id__in=host_ids).values_list('id',
+                                                       'shard__hostname')
+    if utils.is_shard():
+        return {None: [host_id for host_id, _ in rows]}
+    groups = collections.defaultdict(list)
+    for host_id, shard_hostname in rows:
+        groups[shard_hostname].append(host_id)
+    return groups
+
+
+def get_special_tasks_for_hosts(host_ids, **filter_data):
+    """Get special task entries for a set of hosts.
+
+    This is the bulk version of `get_host_special_tasks()`:  the
+    hosts are grouped by shard, and every shard is queried once for
+    the tasks of all its hosts.
+
+    @param host_ids     Ids in the database of the target hosts.
+    @param filter_data  Filter keywords to pass to the underlying
+                        database query.
+
+    """
+    tasks = []
+    # Retrieve host data even if the host is in an invalid state.
+    for shard_hostname, shard_host_ids in _group_host_ids_by_shard(
+            host_ids, False).iteritems():
+        if not shard_hostname:
+            tasks.extend(get_special_tasks(host_id__in=shard_host_ids,
+                                           **filter_data))
+        else:
+            shard_afe = frontend.AFE(server=shard_hostname)
+            tasks.extend(shard_afe.run('get_special_tasks',
+                                       host_id__in=shard_host_ids,
+                                       **filter_data))
+    return tasks
+
+
 def get_num_special_tasks(**kwargs):
     """Get the number of special task entries from the local database.
 
@@ -1567,6 +1613,56 @@ def get_host_status_task(host_id, end_time):
                              host_id=host_id, end_time=end_time)
 
 
+def get_status_tasks(host_ids, end_time):
+    """Get the "status tasks" for a set of hosts from the local shard.
+
+    This is the bulk version of `get_status_task()`; this call will
+    not be forwarded to a shard either.
+
+    @param host_ids     Ids in the database of the target hosts.
+    @param end_time     Time reference for the hosts' status.
+
+    @return A list with a dict for each valid host, with its `host_id`,
+            and its status `task`, or `None` if no task is found.
+
+    """
+    tasks = {}
+    for task in rpc_utils.prepare_rows_as_nested_dicts(
+            status_history.get_status_tasks(host_ids, end_time),
+            ('host', 'queue_entry')):
+        tasks.setdefault(task['host']['id'], task)
+    valid_ids = models.Host.valid_objects.filter(
+            id__in=host_ids).values_list('id', flat=True)
+    return [{'host_id': host_id, 'task': tasks.get(host_id)}
+            for host_id in valid_ids]
+
+
+def get_host_status_tasks(host_ids, end_time):
+    """Get the "status tasks" for a set of hosts from their shards.
+
+    Groups the given hosts by owning shard, and forwards to each
+    shard a single call to `get_status_tasks()` (see above).
+
+    @param host_ids     Ids in the database of the target hosts.
+    @param end_time     Time reference for the hosts' status.
+
+    @return A list with a dict for each valid host, with its `host_id`,
+            and its status `task`, or `None` if no task is found.
+
+    """
+    tasks = []
+    for shard_hostname, shard_host_ids in _group_host_ids_by_shard(
+            host_ids, True).iteritems():
+        if not shard_hostname:
+            tasks.extend(get_status_tasks(shard_host_ids, end_time))
+        else:
+            shard_afe = frontend.AFE(server=shard_hostname)
+            tasks.extend(shard_afe.run('get_status_tasks',
+                                       host_ids=shard_host_ids,
+                                       end_time=end_time))
+    return tasks
+
+
 def get_host_diagnosis_interval(host_id, end_time, success):
     """Find a "diagnosis interval" for a given host.
 
@@ -2074,15 +2170,85 @@ def shard_heartbeat(shard_hostname, jobs=(), hqes=(), known_job_ids=(),
     # A NOT IN query with 5000 ids took about 30ms in tests made.
     # These numbers seem low enough to outweigh the disadvantages of the
     # solutions described above.
+    #
+    # As shards grow, shard_heartbeat_delta lets them send only the changes
+    # since their last heartbeat instead.
     shard_obj = rpc_utils.retrieve_shard(shard_hostname=shard_hostname)
     rpc_utils.persist_records_sent_from_shard(shard_obj, jobs, hqes)
     assert len(known_host_ids) == len(known_host_statuses)
-    for i in range(len(known_host_ids)):
-        host_model = models.Host.objects.get(pk=known_host_ids[i])
-        if host_model.status != known_host_statuses[i]:
-            host_model.status = known_host_statuses[i]
-            host_model.save()
+    rpc_utils.update_host_statuses_sent_from_shard(
+            dict(zip(known_host_ids, known_host_statuses)))
+
+    state, _ = models.ShardHeartbeatState.objects.get_or_create(
+            shard=shard_obj)
+    state.set_known_ids(known_job_ids, known_host_ids)
+    return _shard_heartbeat_response(shard_obj, state, known_job_ids,
+                                     known_host_ids)
+
 
+def shard_heartbeat_delta(shard_hostname, base_sequence, jobs=(), hqes=(),
+                          added_job_ids=(), removed_job_ids=(),
+                          added_host_ids=(), removed_host_ids=(),
+                          host_statuses=None):
+    """Like shard_heartbeat, with only the changes since a previous heartbeat.
+
+    The master keeps the ids of the jobs and hosts the shard reported at its
+    last heartbeat, with a sequence number returned in the response. Shards
+    report the changes to these ids since that heartbeat. If the sequence
+    doesn't match, e.g. because a response was lost, nothing is updated and
+    the shard must send a full shard_heartbeat.
+
+    @param shard_hostname: Hostname of the calling shard
+    @param base_sequence: The sequence returned by the last heartbeat.
+    @param jobs: Jobs in serialized form that should be updated with newer
+                 status from a shard.
+    @param hqes: Hostqueueentries in serialized form that should be updated with
+                 newer status from a shard. Note that for every hostqueueentry
+                 the corresponding job must be in jobs.
+    @param added_job_ids: Ids of jobs the shard got since the last heartbeat.
+    @param removed_job_ids: Ids of jobs the shard forgot since then.
+    @param added_host_ids: Ids of hosts the shard got since the last heartbeat.
+    @param removed_host_ids: Ids of hosts the shard forgot since then.
+    @param host_statuses: Dict mapping ids of hosts whose status changed since
+                          the last heartbeat, or which were added, to their
+                          status.
+
+    @returns: Same as shard_heartbeat, or {'resync_required': True} if the
+              shard must send a full shard_heartbeat.
+    """
+    shard_obj = rpc_utils.retrieve_shard(shard_hostname=shard_hostname)
+    try:
+        state = models.ShardHeartbeatState.objects.get(shard=shard_obj)
+    except models.ShardHeartbeatState.DoesNotExist:
+        return {'resync_required': True}
+    if state.sequence != base_sequence:
+        return {'resync_required': True}
+
+    rpc_utils.persist_records_sent_from_shard(shard_obj, jobs, hqes)
+    # Host ids are strings once they are JSON object keys.
+    rpc_utils.update_host_statuses_sent_from_shard(
+            dict((int(host_id), status)
+                 for host_id, status in (host_statuses or {}).iteritems()))
+
+    known_job_ids, known_host_ids = state.get_known_ids()
+    known_job_ids = (known_job_ids - set(removed_job_ids)) | set(added_job_ids)
+    known_host_ids = ((known_host_ids - set(removed_host_ids)) |
+                      set(added_host_ids))
+    state.set_known_ids(known_job_ids, known_host_ids)
+    return _shard_heartbeat_response(shard_obj, state, list(known_job_ids),
+                                     list(known_host_ids))
+
+
+def _shard_heartbeat_response(shard_obj, state, known_job_ids, known_host_ids):
+    """Assign records to a shard, and build the response to its heartbeat.
+
+    @param shard_obj: The shard.
+    @param state: The ShardHeartbeatState of the shard.
+    @param known_job_ids: Ids of the jobs the shard already has.
+    @param known_host_ids: Ids of the hosts the shard already has.
+
+    @returns: The response to shard_heartbeat.
+    """
     hosts, jobs, suite_keyvals, inc_ids = rpc_utils.find_records_for_shard(
             shard_obj, known_job_ids=known_job_ids,
             known_host_ids=known_host_ids)
@@ -2091,6 +2257,7 @@ def shard_heartbeat(shard_hostname, jobs=(), hqes=(), known_job_ids=(),
         'jobs': [job.serialize() for job in jobs],
         'suite_keyvals': [kv.serialize() for kv in suite_keyvals],
         'incorrect_host_ids': [int(i) for i in inc_ids],
+        'sequence': state.sequence,
     }
 
 
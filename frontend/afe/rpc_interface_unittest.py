@@ -784,6 +784,20 @@ class RpcInterfaceTest(unittest.TestCase,
         self._check_hostnames(hosts, ['host1'])
 
 
+    def test_get_hosts_with_current_job(self):
+        self._setup_special_tasks()
+        job = self._create_job(hosts=[2])
+        job.hostqueueentry_set.update(active=True)
+
+        hosts = rpc_interface.get_hosts(include_current_job=True)
+        hosts = dict((host['hostname'], host) for host in hosts)
+        self.assertEquals(hosts['host1']['current_job'], None)
+        self.assertEquals(hosts['host1']['current_special_task'],
+                          '%d-verify' % self.task2.id)
+        self.assertEquals(hosts['host2']['current_job'], job.id)
+        self.assertEquals(hosts['host2']['current_special_task'], None)
+
+
     def test_job_keyvals(self):
         keyval_dict = {'mykey': 'myvalue'}
         job_id = rpc_interface.create_job(name='test',
@@ -963,6 +977,39 @@ class RpcInterfaceTest(unittest.TestCase,
         self.assertEquals(tasks[0]['id'], 2)
 
 
+    def test_get_special_tasks_for_hosts(self):
+        self._setup_special_tasks()
+        models.SpecialTask.objects.create(
+                host=self.hosts[1], task=models.SpecialTask.Task.VERIFY,
+                is_complete=True, requested_by=models.User.current_user())
+
+        tasks = rpc_interface.get_special_tasks_for_hosts(
+                [self.hosts[0].id, self.hosts[1].id], is_complete=True)
+        self.assertEquals(sorted(task['host']['hostname'] for task in tasks),
+                          ['host1', 'host2'])
+
+
+    def test_get_status_tasks(self):
+        host = self.hosts[0]
+        for day, task in ((1, models.SpecialTask.Task.VERIFY),
+                          (2, models.SpecialTask.Task.REPAIR),
+                          (4, models.SpecialTask.Task.REPAIR)):
+            models.SpecialTask.objects.create(
+                    host=host, task=task, success=True, is_complete=True,
+                    time_started=datetime.datetime(2009, 1, day),
+                    time_finished=datetime.datetime(2009, 1, day, 1),
+                    requested_by=models.User.current_user())
+
+        tasks = rpc_interface.get_status_tasks(
+                [host.id, self.hosts[1].id], '2009-01-03 00:00:00')
+        tasks = {t['host_id']: t['task'] for t in tasks}
+        self.assertEquals(tasks[host.id]['task'],
+                          models.SpecialTask.Task.REPAIR)
+        self.assertEquals(tasks[host.id]['time_started'],
+                          '2009-01-02 00:00:00')
+        self.assertEquals(tasks[self.hosts[1].id], None)
+
+
     def _common_entry_check(self, entry_dict):
         self.assertEquals(entry_dict['host']['hostname'], 'host1')
         self.assertEquals(entry_dict['job']['id'], 2)
@@ -1888,5 +1935,44 @@ class ExtraRpcInterfaceTest(frontend_test_utils.FrontendTestMixin,
         self._testResendHostsAfterFailedHeartbeatHelper(host1)
 
 
+    def testShardHeartbeatDelta(self):
+        """Ensure shards can send only what changed since the last heartbeat."""
+        shard1, host1, label1 = self._createShardAndHostWithLabel()
+        retval = rpc_interface.shard_heartbeat(shard_hostname='shard1')
+        self._assert_shard_heartbeat_response('shard1', retval, hosts=[host1])
+
+        job1 = self._createJobForLabel(label1)
+        retval = rpc_interface.shard_heartbeat_delta(
+                shard_hostname='shard1', base_sequence=retval['sequence'],
+                added_host_ids=[host1.id],
+                host_statuses={str(host1.id): 'Running'})
+        self._assert_shard_heartbeat_response(
+                'shard1', retval, jobs=[job1],
+                hqes=job1.hostqueueentry_set.all())
+        self.assertEqual(models.Host.objects.get(pk=host1.id).status,
+                         'Running')
+
+        retval = rpc_interface.shard_heartbeat_delta(
+                shard_hostname='shard1', base_sequence=retval['sequence'],
+                added_job_ids=[job1.id])
+        self._assert_shard_heartbeat_response('shard1', retval)
+
+
+    def testShardHeartbeatDeltaResync(self):
+        """Ensure a delta heartbeat on an unknown sequence is refused."""
+        shard1, host1, label1 = self._createShardAndHostWithLabel()
+        self.assertEqual(
+                rpc_interface.shard_heartbeat_delta(shard_hostname='shard1',
+                                                    base_sequence=0),
+                {'resync_required': True})
+
+        retval = rpc_interface.shard_heartbeat(shard_hostname='shard1')
+        self.assertEqual(
+                rpc_interface.shard_heartbeat_delta(
+                        shard_hostname='shard1',
+                        base_sequence=retval['sequence'] - 1),
+                {'resync_required': True})
+
+
 if __name__ == '__main__':
     unittest.main()
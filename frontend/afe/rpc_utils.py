@@ -203,6 +203,55 @@ def get_host_query(multiple_labels, exclude_only_if_needed_labels,
         return models.Host.objects.none()
 
 
+def get_replacing_static_labels(labels):
+    """Get the static labels replacing some labels, in two queries.
+
+    @param labels: an iterable of Label objects.
+
+    @returns: a dict of StaticLabel objects, by id of the Label object they
+              replace.  Labels that are not replaced are left out.
+    """
+    labels_by_id = dict((label.id, label) for label in labels)
+    replaced_ids = models.ReplacedLabel.objects.filter(
+            label__id__in=labels_by_id.keys()).values_list('label_id',
+                                                           flat=True)
+    names = set(labels_by_id[label_id].name for label_id in replaced_ids)
+    static_labels = dict(
+            (static_label.name, static_label) for static_label in
+            models.StaticLabel.get_valid_manager().filter(name__in=names))
+    replacing = {}
+    for label_id in replaced_ids:
+        name = labels_by_id[label_id].name
+        if name not in static_labels:
+            # Raise the same error as looking the static label up.
+            static_labels[name] = models.StaticLabel.smart_get(name)
+        replacing[label_id] = static_labels[name]
+    return replacing
+
+
+def get_current_jobs_and_special_tasks(host_ids):
+    """Get the jobs and special tasks running on hosts, in two queries.
+
+    @param host_ids: ids of the hosts.
+
+    @returns: a (current_jobs, current_special_tasks) tuple, with a dict of
+              job ids by host id, and a dict of special task names like
+              '<id>-<task>' by host id.  Idle hosts are left out.
+    """
+    current_jobs = {}
+    entries = models.HostQueueEntry.objects.filter(
+            host__id__in=host_ids, active=True, complete=False)
+    for host_id, job_id in entries.values_list('host_id', 'job_id'):
+        current_jobs.setdefault(host_id, job_id)
+    current_special_tasks = {}
+    tasks = models.SpecialTask.objects.filter(
+            host__id__in=host_ids, is_active=True, is_complete=False)
+    for host_id, task_id, task in tasks.values_list('host_id', 'id', 'task'):
+        current_special_tasks.setdefault(host_id,
+                                         '%d-%s' % (task_id, task.lower()))
+    return current_jobs, current_special_tasks
+
+
 class InconsistencyException(Exception):
     'Raised when a list of objects does not have a consistent value'
 
@@ -983,11 +1032,13 @@ def _persist_records_with_type_sent_from_shard(
     @returns: List of primary keys of the processed records.
     """
     pks = []
+    # Fetch all the records at once, rather than with one query per record.
+    current_records = record_type.objects.in_bulk(
+            [serialized_record['id'] for serialized_record in records])
     for serialized_record in records:
         pk = serialized_record['id']
-        try:
-            current_record = record_type.objects.get(pk=pk)
-        except record_type.DoesNotExist:
+        current_record = current_records.get(pk)
+        if current_record is None:
             raise error.UnallowedRecordsSentToMaster(
                 'Object with pk %s of type %s does not exist on master.' % (
                     pk, record_type))
@@ -1032,6 +1083,34 @@ def persist_records_sent_from_shard(shard, jobs, hqes):
             job_ids_sent=job_ids_persisted)
 
 
+def update_host_statuses_sent_from_shard(host_statuses):
+    """Update the statuses of hosts as reported by a shard.
+
+    The hosts are fetched with one query, and updated with one query per
+    new status, rather than saved one at a time.
+
+    @param host_statuses: Dict mapping host ids to their status on the shard.
+    """
+    if not host_statuses:
+        return
+    hosts_by_status = collections.defaultdict(list)
+    changed_hosts = []
+    for host in models.Host.objects.filter(pk__in=host_statuses.keys()):
+        status = host_statuses[host.id]
+        if host.status != status:
+            changed_hosts.append(host)
+            hosts_by_status[status].append(host.id)
+    if not changed_hosts:
+        return
+
+    models.AclGroup.check_for_acl_violation_hosts(changed_hosts)
+    for status, host_ids in hosts_by_status.iteritems():
+        models.Host.objects.filter(pk__in=host_ids).update(status=status)
+    for host in changed_hosts:
+        # Same as Host.on_attribute_changed, which update() doesn't call.
+        logging.info('%s -> %s', host.hostname, host_statuses[host.id])
+
+
 def forward_single_host_rpc_to_shard(func):
     """This decorator forwards rpc calls that modify a host to a shard.
 
@@ -0,0 +1,16 @@
+UP_SQL = """
+CREATE TABLE afe_shard_heartbeat_states (
+  shard_id int(11) NOT NULL,
+  sequence int(11) NOT NULL DEFAULT 0,
+  known_job_ids longtext NOT NULL,
+  known_host_ids longtext NOT NULL,
+  PRIMARY KEY (shard_id),
+  CONSTRAINT shard_heartbeat_states_shard_fk FOREIGN KEY (shard_id)
+    REFERENCES afe_shards(id)
+    ON DELETE CASCADE
+) ENGINE=INNODB;
+"""
+
+DOWN_SQL = """
+DROP TABLE afe_shard_heartbeat_states;
+"""
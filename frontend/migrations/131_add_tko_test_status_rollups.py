@@ -0,0 +1,40 @@
+# Per (job name, build, board, test, status) counts of tko_tests, maintained by
+# tko/db.py as tests are inserted, updated and deleted. The key columns store
+# NULL as '' so that they can be matched with '=', and key_hash stands in for
+# the five columns in the unique key, which would be too long for an index.
+UP_SQL = """
+CREATE TABLE tko_test_status_rollups (
+  id int(11) NOT NULL AUTO_INCREMENT,
+  key_hash char(40) NOT NULL,
+  job_name varchar(100) NOT NULL DEFAULT '',
+  build varchar(255) NOT NULL DEFAULT '',
+  board varchar(40) NOT NULL DEFAULT '',
+  test_name varchar(300) NOT NULL DEFAULT '',
+  status varchar(10) NOT NULL DEFAULT '',
+  test_count int(11) NOT NULL DEFAULT 0,
+  max_test_idx int(10) unsigned NOT NULL,
+  PRIMARY KEY (id),
+  UNIQUE KEY key_hash (key_hash),
+  KEY job_name (job_name),
+  KEY build (build),
+  KEY test_name (test_name)
+) ENGINE=InnoDB;
+
+INSERT INTO tko_test_status_rollups
+  (key_hash, job_name, build, board, test_name, status, test_count,
+   max_test_idx)
+SELECT SHA1(CONCAT_WS(CHAR(10), IFNULL(tko_jobs.label, ''),
+                      IFNULL(tko_jobs.build, ''), IFNULL(tko_jobs.board, ''),
+                      IFNULL(tko_tests.test, ''), tko_status.word)),
+       IFNULL(tko_jobs.label, ''), IFNULL(tko_jobs.build, ''),
+       IFNULL(tko_jobs.board, ''), IFNULL(tko_tests.test, ''),
+       tko_status.word, COUNT(*), MAX(tko_tests.test_idx)
+FROM tko_tests
+INNER JOIN tko_jobs ON tko_jobs.job_idx = tko_tests.job_idx
+INNER JOIN tko_status ON tko_status.status_idx = tko_tests.status
+GROUP BY 1;
+"""
+
+DOWN_SQL = """
+DROP TABLE tko_test_status_rollups;
+"""
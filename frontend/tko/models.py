@@ -745,3 +745,67 @@ class TestView(dbmodels.Model, model_logic.ModelExtensions):
     class Meta:
         """Metadata for class TestView."""
         db_table = 'tko_test_view_2'
+
+
+class TestStatusRollupManager(TempManager):
+    """A Test Status Rollup Manager."""
+
+    def execute_group_query(self, query, group_by):
+        """Performs the given query grouped by the specified fields.
+
+        Rollups store NULL key values as '', which are returned as None, like
+        TestView does.
+
+        @param query: The query to perform.
+        @param group_by: The fields by which to group.
+
+        @return A list of dicts, see TempManager.execute_group_query().
+
+        """
+        row_dicts = super(TestStatusRollupManager, self).execute_group_query(
+                query, group_by)
+        for row_dict in row_dicts:
+            for field in group_by:
+                if row_dict.get(field) == '':
+                    row_dict[field] = None
+        return row_dicts
+
+
+    def get_count_sql(self, query):
+        """Get SQL to select the per-group count of tests of a query.
+
+        @param query: The query to use.
+
+        @return A tuple (field alias, field SQL).
+
+        """
+        return self._GROUP_COUNT_NAME, 'CAST(SUM(test_count) AS SIGNED)'
+
+
+class TestStatusRollup(dbmodels.Model, model_logic.ModelExtensions):
+    """Models the count of tests of a job name, build, board, test and status.
+
+    Maintained by tko/db.py, read by rollup_planner.
+    """
+    key_hash = dbmodels.CharField(unique=True, max_length=40)
+    job_name = dbmodels.CharField(blank=True, max_length=100)
+    build = dbmodels.CharField(blank=True, max_length=255)
+    board = dbmodels.CharField(blank=True, max_length=40)
+    test_name = dbmodels.CharField(blank=True, max_length=300)
+    status = dbmodels.CharField(blank=True, max_length=10)
+    test_count = dbmodels.IntegerField()
+    max_test_idx = dbmodels.IntegerField('latest test index')
+
+    objects = TestStatusRollupManager()
+
+    def save(self):
+        raise NotImplementedError('TestStatusRollup is read-only')
+
+
+    def delete(self):
+        raise NotImplementedError('TestStatusRollup is read-only')
+
+
+    class Meta:
+        """Metadata for class TestStatusRollup."""
+        db_table = 'tko_test_status_rollups'
@@ -0,0 +1,118 @@
+"""Answers eligible TestView group queries from tko_test_status_rollups.
+
+The rollups count the tests of each job name, build, board, test name and
+status, and record the latest test of each, so that the spreadsheet and
+dashboard queries grouping by those fields only read one row per group
+instead of every matching test. Queries which group or filter by anything
+else are left to TestView.
+"""
+
+from autotest_lib.client.common_lib import global_config
+from autotest_lib.frontend.tko import models, tko_rpc_utils
+
+# The rollups must be backfilled before this is enabled, see migration 131.
+USE_ROLLUPS = global_config.global_config.get_config_value(
+        'AUTOTEST_WEB', 'use_tko_status_rollups', type=bool, default=False)
+
+_GROUP_FIELDS = frozenset(('job_name', 'build', 'board', 'test_name',
+                           'status'))
+# TestView has no build and board fields, so they can't be filtered on.
+_FILTER_FIELDS = frozenset(('job_name', 'test_name', 'status'))
+_FILTER_LOOKUPS = frozenset(('', 'exact', 'iexact', 'in', 'startswith',
+                             'istartswith', 'contains', 'icontains'))
+_PRESENTATION_KEYS = frozenset(('sort_by', 'query_start', 'query_limit'))
+
+# tko_rpc_utils.STATUS_FIELDS, summed over rollups.
+_STATUS_FIELDS = {
+        tko_rpc_utils._PASS_COUNT_NAME:
+                'CAST(SUM(IF(status="GOOD", test_count, 0)) AS SIGNED)',
+        tko_rpc_utils._COMPLETE_COUNT_NAME:
+                'CAST(SUM(IF(status NOT IN ("TEST_NA", "RUNNING", '
+                '"NOSTATUS"), test_count, 0)) AS SIGNED)',
+        tko_rpc_utils._INCOMPLETE_COUNT_NAME:
+                'CAST(SUM(IF(status="RUNNING", test_count, 0)) AS SIGNED)',
+}
+
+
+def _is_rollup_filter(key, value):
+    """Whether a filter can be applied to the rollups.
+
+    Rollups store NULL as '', so filters on '' would match NULL values.
+
+    @param key: The Django filter key, e.g. 'job_name__in'.
+    @param value: The filter value.
+    """
+    field, _, lookup = key.partition('__')
+    if field not in _FILTER_FIELDS or lookup not in _FILTER_LOOKUPS:
+        return False
+    if lookup == 'in':
+        return '' not in value
+    return value != ''
+
+
+def can_use_rollups(group_by, filter_data, header_groups=(),
+                    fixed_headers=None, extra_select_fields=None):
+    """Whether a group query can be answered from the rollups.
+
+    @param group_by: The fields to group by.
+    @param filter_data: The filter data of the query.
+    @param header_groups: The lists of header fields.
+    @param fixed_headers: A dict of header values by header field.
+    @param extra_select_fields: The extra fields to select, which can only be
+            tko_rpc_utils.STATUS_FIELDS.
+
+    @return True if the rollups give the same result as TestView.
+    """
+    if not USE_ROLLUPS:
+        return False
+    if extra_select_fields and (extra_select_fields !=
+                                tko_rpc_utils.STATUS_FIELDS):
+        return False
+    header_fields = set(field for group in header_groups for field in group)
+    if not _GROUP_FIELDS.issuperset(set(group_by) | header_fields):
+        return False
+    if not _FILTER_FIELDS.issuperset(fixed_headers or {}):
+        return False
+    for field in filter_data.get('sort_by') or []:
+        if field.lstrip('-') not in _GROUP_FIELDS:
+            return False
+    return all(key in _PRESENTATION_KEYS or _is_rollup_filter(key, value)
+               for key, value in filter_data.iteritems())
+
+
+def _query_rollups(filter_data):
+    """Query the rollups matching the filters, without presentation."""
+    return models.TestStatusRollup.query_objects(
+            filter_data, initial_query=models.TestStatusRollup.objects.all(),
+            apply_presentation=False)
+
+
+def get_group_counts_query(filter_data, extra_select_fields=None):
+    """Build the rollup query of get_group_counts().
+
+    @param filter_data: The filter data, for which can_use_rollups() is True.
+    @param extra_select_fields: None, or tko_rpc_utils.STATUS_FIELDS.
+
+    @return A query for tko_rpc_utils.GroupDataProcessor.
+    """
+    query = _query_rollups(filter_data)
+    count_alias, count_sql = models.TestStatusRollup.objects.get_count_sql(
+            query)
+    query = query.extra(select={count_alias: count_sql})
+    if extra_select_fields:
+        query = query.extra(select=_STATUS_FIELDS)
+    return models.TestStatusRollup.apply_presentation(query, filter_data)
+
+
+def get_latest_tests_query(filter_data):
+    """Build the rollup query of get_latest_tests().
+
+    @param filter_data: The filter data, for which can_use_rollups() is True.
+
+    @return A query for tko_rpc_utils.GroupDataProcessor, which selects the
+            latest test of each group as latest_test_idx.
+    """
+    query = _query_rollups(filter_data)
+    query = query.exclude(status__in=tko_rpc_utils._INVALID_STATUSES)
+    query = query.extra(select={'latest_test_idx': 'MAX(max_test_idx)'})
+    return models.TestStatusRollup.apply_presentation(query, filter_data)
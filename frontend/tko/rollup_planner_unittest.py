@@ -0,0 +1,198 @@
+#!/usr/bin/python2
+# pylint: disable=missing-docstring
+
+import hashlib
+import unittest
+
+import common
+from autotest_lib.frontend import setup_django_environment
+from autotest_lib.frontend import setup_test_environment
+from autotest_lib.frontend.afe import readonly_connection
+from autotest_lib.frontend.tko import models, rollup_planner, rpc_interface
+from autotest_lib.frontend.tko import tko_rpc_utils
+
+
+class CanUseRollupsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._saved_use_rollups = rollup_planner.USE_ROLLUPS
+        rollup_planner.USE_ROLLUPS = True
+
+
+    def tearDown(self):
+        rollup_planner.USE_ROLLUPS = self._saved_use_rollups
+
+
+    def test_status_counts(self):
+        self.assertTrue(rollup_planner.can_use_rollups(
+                ['build', 'test_name'],
+                {'job_name__startswith': 'lumpy-release/',
+                 'status__in': ['GOOD', 'FAIL'],
+                 'sort_by': ['-build'], 'query_start': 0, 'query_limit': 10},
+                header_groups=[['build'], ['test_name']],
+                fixed_headers={'test_name': ['dummy_Pass']},
+                extra_select_fields=tko_rpc_utils.STATUS_FIELDS))
+
+
+    def test_disabled(self):
+        rollup_planner.USE_ROLLUPS = False
+        self.assertFalse(rollup_planner.can_use_rollups(['build'], {}))
+
+
+    def test_other_group_field(self):
+        self.assertFalse(rollup_planner.can_use_rollups(['hostname'], {}))
+        self.assertFalse(rollup_planner.can_use_rollups(
+                ['build'], {}, header_groups=[['hostname']]))
+
+
+    def test_other_filters(self):
+        for filter_data in ({'hostname': 'host1'},
+                            {'build': 'lumpy-release/R1-1.0.0'},
+                            {'job_name__isnull': True},
+                            {'job_name': ''},
+                            {'status__in': ['GOOD', '']},
+                            {'extra_where': 'invalid = 0'},
+                            {'include_labels': ['label']},
+                            {'sort_by': ['test_finished_time']}):
+            self.assertFalse(
+                    rollup_planner.can_use_rollups(['build'], filter_data),
+                    filter_data)
+
+
+    def test_other_extra_select_fields(self):
+        self.assertFalse(rollup_planner.can_use_rollups(
+                ['build'], {}, extra_select_fields={'x': 'MAX(test_idx)'}))
+
+
+class RollupQueryTest(unittest.TestCase):
+    """Compares the rollup queries with the TestView queries."""
+
+    # The keys of the groups the RPCs document, besides the group by fields.
+    # The groups also have the other columns of an arbitrary row of the group.
+    _GROUP_KEYS = ('id', 'header_indices', 'group_count', 'pass_count',
+                   'complete_count', 'incomplete_count', 'extra_info')
+
+    _TESTS = [
+            # job_name, test_name, status, reason
+            ('lumpy-release/R1-1.0.0/bvt', 'dummy_Pass', 'GOOD', ''),
+            ('lumpy-release/R1-1.0.0/bvt', 'dummy_Pass', 'FAIL', 'failed'),
+            ('lumpy-release/R1-1.0.0/bvt', 'dummy_Fail', 'FAIL', 'failed'),
+            ('lumpy-release/R1-1.0.0/bvt', 'dummy_Fail', 'TEST_NA', ''),
+            ('lumpy-release/R2-1.0.0/bvt', 'dummy_Pass', 'GOOD', ''),
+            ('lumpy-release/R2-1.0.0/bvt', 'dummy_Pass', 'RUNNING', ''),
+            ('lumpy-release/R2-1.0.0/bvt', 'dummy_Fail', 'NOSTATUS', ''),
+            ('link-release/R1-1.0.0/bvt', 'dummy_Pass', 'GOOD', 'passed'),
+            ('link-release/R1-1.0.0/bvt', 'dummy_Pass', 'GOOD', ''),
+    ]
+
+    def setUp(self):
+        setup_test_environment.set_up()
+        connection = setup_test_environment.connection_global
+        # The group queries run on the readonly connection, which is another
+        # database than the TKO models here.
+        self._saved_readonly_cursor = readonly_connection.cursor
+        readonly_connection.cursor = connection.cursor
+        # SQLite has no IF(), which both the TestView and rollup status
+        # counts use.
+        connection.cursor()
+        connection.connection.create_function(
+                'IF', 3, lambda condition, true, false:
+                         true if condition else false)
+        self._saved_use_rollups = rollup_planner.USE_ROLLUPS
+        # TestView is a view in MySQL, and a table here.
+        models.TestView.objects.bulk_create([
+                models.TestView(test_idx=test_idx, job_name=job_name,
+                                test_name=test_name, status=status,
+                                reason=reason, kernel_idx=1, status_idx=1,
+                                machine_idx=1)
+                for test_idx, (job_name, test_name, status, reason)
+                in enumerate(self._TESTS, start=1)])
+        self._fill_rollups()
+
+
+    def tearDown(self):
+        rollup_planner.USE_ROLLUPS = self._saved_use_rollups
+        readonly_connection.cursor = self._saved_readonly_cursor
+        setup_test_environment.tear_down()
+
+
+    def _fill_rollups(self):
+        """Count the TestViews in rollups, like tko/db.py does."""
+        rollups = {}
+        for test in models.TestView.objects.all():
+            key = (test.job_name, '', '', test.test_name, test.status)
+            test_count, max_test_idx = rollups.get(key, (0, 0))
+            rollups[key] = test_count + 1, max(max_test_idx, test.test_idx)
+        models.TestStatusRollup.objects.bulk_create([
+                models.TestStatusRollup(
+                        key_hash=hashlib.sha1('\n'.join(key)).hexdigest(),
+                        job_name=key[0], build=key[1], board=key[2],
+                        test_name=key[3], status=key[4],
+                        test_count=test_count, max_test_idx=max_test_idx)
+                for key, (test_count, max_test_idx) in rollups.iteritems()])
+
+
+    def _assert_same_result(self, function, group_by, filter_data, **kwargs):
+        """Check that a query gives the same result with and without rollups.
+
+        @param function: The rpc_interface function.
+        @param group_by: The fields to group by.
+        @param filter_data: The filter data of the query.
+        @param kwargs: The other keyword arguments of the function.
+        """
+        rollup_planner.USE_ROLLUPS = False
+        expected = self._call(function, group_by, filter_data, kwargs)
+        self.assertTrue(expected['groups'])
+
+        rollup_planner.USE_ROLLUPS = True
+        self.assertTrue(rollup_planner.can_use_rollups(
+                group_by, filter_data, kwargs.get('header_groups', ()),
+                kwargs.get('fixed_headers')))
+        self.assertEqual(self._call(function, group_by, filter_data, kwargs),
+                         expected)
+
+
+    def _call(self, function, group_by, filter_data, kwargs):
+        """Call an RPC, and keep the documented keys of its groups."""
+        info = function(group_by, **dict(filter_data, **kwargs))
+        keys = self._GROUP_KEYS + tuple(group_by)
+        if function == rpc_interface.get_latest_tests:
+            keys += ('test_idx',)
+        info['groups'] = [dict((key, group[key]) for key in keys
+                               if key in group)
+                          for group in info['groups']]
+        return info
+
+
+    def test_group_counts(self):
+        self._assert_same_result(rpc_interface.get_group_counts,
+                                 ['test_name', 'status'],
+                                 {'sort_by': ['test_name', 'status']})
+
+
+    def test_status_counts(self):
+        self._assert_same_result(
+                rpc_interface.get_status_counts, ['job_name', 'test_name'],
+                {'job_name__startswith': 'lumpy-release/',
+                 'sort_by': ['job_name', 'test_name']},
+                header_groups=[['job_name'], ['test_name']])
+
+
+    def test_latest_tests(self):
+        self._assert_same_result(
+                rpc_interface.get_latest_tests, ['job_name', 'test_name'],
+                {'test_name__in': ['dummy_Pass', 'dummy_Fail'],
+                 'sort_by': ['job_name', 'test_name']},
+                header_groups=[['job_name'], ['test_name']],
+                extra_info=['reason'])
+
+
+    def test_latest_tests_with_deleted_test(self):
+        models.TestView.objects.filter(test_idx=len(self._TESTS)).delete()
+        self._assert_same_result(rpc_interface.get_latest_tests,
+                                 ['job_name', 'test_name'],
+                                 {'sort_by': ['job_name', 'test_name']},
+                                 extra_info=['reason'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,7 +5,7 @@ from autotest_lib.client.common_lib import priorities
 from autotest_lib.frontend.afe import rpc_utils, model_logic
 from autotest_lib.frontend.afe import models as afe_models, readonly_connection
 from autotest_lib.frontend.tko import models, tko_rpc_utils
-from autotest_lib.frontend.tko import preconfigs
+from autotest_lib.frontend.tko import preconfigs, rollup_planner
 
 
 # table/spreadsheet view support
@@ -43,16 +43,25 @@ def get_group_counts(group_by, header_groups=None, fixed_headers=None,
       total count in the group, plus keys for each of the extra_select_fields.
       The keys for the extra_select_fields are determined by the "AS" alias of
       the field.
+
+    Queries grouping and filtering only by job name, build, board, test name
+    and status are answered from the status rollups, see rollup_planner.
     """
-    query = models.TestView.objects.get_query_set_with_joins(filter_data)
-    # don't apply presentation yet, since we have extra selects to apply
-    query = models.TestView.query_objects(filter_data, initial_query=query,
-                                          apply_presentation=False)
-    count_alias, count_sql = models.TestView.objects.get_count_sql(query)
-    query = query.extra(select={count_alias: count_sql})
-    if extra_select_fields:
-        query = query.extra(select=extra_select_fields)
-    query = models.TestView.apply_presentation(query, filter_data)
+    if rollup_planner.can_use_rollups(group_by, filter_data,
+                                      header_groups or [], fixed_headers,
+                                      extra_select_fields):
+        query = rollup_planner.get_group_counts_query(filter_data,
+                                                      extra_select_fields)
+    else:
+        query = models.TestView.objects.get_query_set_with_joins(filter_data)
+        # don't apply presentation yet, since we have extra selects to apply
+        query = models.TestView.query_objects(filter_data, initial_query=query,
+                                              apply_presentation=False)
+        count_alias, count_sql = models.TestView.objects.get_count_sql(query)
+        query = query.extra(select={count_alias: count_sql})
+        if extra_select_fields:
+            query = query.extra(select=extra_select_fields)
+        query = models.TestView.apply_presentation(query, filter_data)
 
     group_processor = tko_rpc_utils.GroupDataProcessor(query, group_by,
                                                        header_groups or [],
@@ -83,6 +92,25 @@ def get_status_counts(group_by, header_groups=[], fixed_headers={},
                             **filter_data)
 
 
+def _get_latest_test_views(query, initial_query, group_by, header_groups,
+                           fixed_headers):
+    """
+    Runs a get_latest_tests() group query, and fetches the full info of the
+    latest test of each group so we can access their statuses.
+    @param query the group query, selecting the latest test as latest_test_idx.
+    @param initial_query the TestView query to fetch the latest tests from.
+    @returns a tuple of the info dict of the groups and a dict of the TestViews
+             by test_idx.
+    """
+    group_processor = tko_rpc_utils.GroupDataProcessor(query, group_by,
+                                                       header_groups,
+                                                       fixed_headers)
+    group_processor.process_group_dicts()
+    info = group_processor.get_info_dict()
+    all_test_ids = [group['latest_test_idx'] for group in info['groups']]
+    return info, initial_query.in_bulk(all_test_ids)
+
+
 def get_latest_tests(group_by, header_groups=[], fixed_headers={},
                      extra_info=[], **filter_data):
     """
@@ -94,27 +122,32 @@ def get_latest_tests(group_by, header_groups=[], fixed_headers={},
                       with each cell. The fields are returned in the extra_info
                       field of the return dictionary.
     """
-    # find latest test per group
-    initial_query = models.TestView.objects.get_query_set_with_joins(
-            filter_data)
-    query = models.TestView.query_objects(filter_data,
-                                          initial_query=initial_query,
-                                          apply_presentation=False)
-    query = query.exclude(status__in=tko_rpc_utils._INVALID_STATUSES)
-    query = query.extra(
-            select={'latest_test_idx' : 'MAX(%s)' %
-                    models.TestView.objects.get_key_on_this_table('test_idx')})
-    query = models.TestView.apply_presentation(query, filter_data)
-
-    group_processor = tko_rpc_utils.GroupDataProcessor(query, group_by,
-                                                       header_groups,
-                                                       fixed_headers)
-    group_processor.process_group_dicts()
-    info = group_processor.get_info_dict()
-
-    # fetch full info for these tests so we can access their statuses
-    all_test_ids = [group['latest_test_idx'] for group in info['groups']]
-    test_views = initial_query.in_bulk(all_test_ids)
+    info = None
+    if rollup_planner.can_use_rollups(group_by, filter_data, header_groups,
+                                      fixed_headers):
+        info, test_views = _get_latest_test_views(
+                rollup_planner.get_latest_tests_query(filter_data),
+                models.TestView.objects.all(), group_by, header_groups,
+                fixed_headers)
+        # The latest test of a rollup is gone if it was deleted behind the
+        # back of tko/db.py, until contrib/db_cleanup.py fixes the rollup.
+        if any(group_dict['latest_test_idx'] not in test_views
+               for group_dict in info['groups']):
+            info = None
+    if info is None:
+        initial_query = models.TestView.objects.get_query_set_with_joins(
+                filter_data)
+        query = models.TestView.query_objects(filter_data,
+                                              initial_query=initial_query,
+                                              apply_presentation=False)
+        query = query.exclude(status__in=tko_rpc_utils._INVALID_STATUSES)
+        query = query.extra(
+                select={'latest_test_idx' : 'MAX(%s)' %
+                        models.TestView.objects.get_key_on_this_table(
+                                'test_idx')})
+        query = models.TestView.apply_presentation(query, filter_data)
+        info, test_views = _get_latest_test_views(
+                query, initial_query, group_by, header_groups, fixed_headers)
 
     for group_dict in info['groups']:
         test_idx = group_dict.pop('latest_test_idx')
@@ -123,7 +123,7 @@ class GroupDataProcessor(object):
 
     def _fetch_data(self):
         self._restrict_header_values()
-        self._group_dicts = models.TestView.objects.execute_group_query(
+        self._group_dicts = self._query.model.objects.execute_group_query(
             self._query, self._group_by)
 
 
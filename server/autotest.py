@@ -19,6 +19,7 @@ from autotest_lib.client.common_lib import global_config
 from autotest_lib.client.common_lib import packages
 from autotest_lib.client.common_lib import utils as client_utils
 from autotest_lib.server import installable_object
+from autotest_lib.server import tarball_cache
 from autotest_lib.server import utils
 from autotest_lib.server import utils as server_utils
 from autotest_lib.server.cros.dynamic_suite.constants import JOB_REPO_URL
@@ -37,6 +38,10 @@ _CONFIG = global_config.global_config
 AUTOSERV_PREBUILD = _CONFIG.get_config_value(
         'AUTOSERV', 'enable_server_prebuild', type=bool, default=False)
 
+# File recording the version of a client installed from the source material,
+# in the autodir.
+_INSTALL_VERSION_FILE = '.install_version'
+
 # Match on a line like this:
 # FAIL test_name  test_name timestamp=1 localtime=Nov 15 12:43:10 <fail_msg>
 _FAIL_STATUS_RE = re.compile(
@@ -110,6 +115,16 @@ class Autotest(installable_object.InstallableObject):
         cls.install_in_tmpdir = flag
 
 
+    force_clean_install = _CONFIG.get_config_value(
+            'AUTOSERV', 'client_install_force_clean', type=bool, default=False)
+    @classmethod
+    def set_force_clean_install(cls, flag):
+        """ Sets a flag that controls whether or not Autotest should always
+        be installed from scratch, rather than reusing a client that is
+        already installed on the host from the same package or source. """
+        cls.force_clean_install = flag
+
+
     @classmethod
     def get_client_autodir_paths(cls, host):
         return global_config.global_config.get_config_value(
@@ -284,18 +299,96 @@ class Autotest(installable_object.InstallableObject):
         # are fetched on that client. (for the tests,deps etc.
         # too apart from the client)
         pkg_dir = os.path.join(autodir, 'packages')
-        # clean up the autodir except for the packages and result_tools
-        # directory.
-        host.run('cd %s && ls | grep -v "^packages$" | grep -v "^result_tools$"'
-                 ' | xargs rm -rf && rm -rf .[!.]*' % autodir)
+        if (not self.force_clean_install and
+                self._is_client_package_installed(host, pkgmgr, pkg_dir,
+                                                  autodir)):
+            logging.info('The autotest client package is already installed '
+                         'in %s', autodir)
+            host.run('rm -rf %s' %
+                     utils.sh_escape(os.path.join(autodir, 'tmp')))
+            self.installed = True
+            return
+        self._clean_autodir(host, autodir)
         pkgmgr.install_pkg('autotest', 'client', pkg_dir, autodir,
                            preserve_install_dir=True)
         self.installed = True
 
 
+    def _is_client_package_installed(self, host, pkgmgr, pkg_dir, autodir):
+        """Whether the client package of the repos is installed in autodir.
+
+        The package is fetched unless pkg_dir already has it, and its checksum
+        is compared with the one recorded in autodir when it was last
+        untarred there.
+
+        @param host: The host.
+        @param pkgmgr: The PackageManager of autodir.
+        @param pkg_dir: The directory to fetch the package to.
+        @param autodir: The directory of the installed client.
+        """
+        # Fetch the checksums of the repos, rather than trusting the ones
+        # recorded when the packages of another build were fetched.
+        host.run('rm -f %s' %
+                 utils.sh_escape(os.path.join(autodir, packages.CHECKSUM_FILE)))
+        host.run('mkdir -p %s' % utils.sh_escape(pkg_dir))
+        pkg_name = pkgmgr.get_tarball_name('autotest', 'client')
+        fetch_path = os.path.join(pkg_dir, pkg_name)
+        try:
+            pkgmgr.fetch_pkg(pkg_name, fetch_path, use_checksum=True)
+        except error.PackageFetchError as e:
+            logging.debug('Could not fetch %s: %s', pkg_name, e)
+            return False
+        return not pkgmgr.untar_required(fetch_path, autodir)
+
+
+    def _clean_autodir(self, host, autodir):
+        """Delete everything in autodir but the packages and result_tools.
+
+        @param host: The host.
+        @param autodir: The directory of the installed client.
+        """
+        host.run('cd %s && ls | grep -v "^packages$" | grep -v "^result_tools$"'
+                 ' | xargs rm -rf && rm -rf .[!.]*' % autodir)
+
+
+    def _get_source_version(self, exclude_dirs):
+        """Compute the version of the source material.
+
+        This is much cheaper than comparing the files with the host.
+
+        @param exclude_dirs: Top level directories which are not installed.
+
+        @returns the version string, or None if the source material is not a
+                directory.
+        """
+        if not os.path.isdir(self.source_material):
+            return None
+        return tarball_cache.hash_source_tree(self.source_material,
+                                              exclude_dirs)
+
+
+    def _get_install_version(self, host, autodir):
+        """Read the version of the client installed from source material.
+
+        @param host: The host.
+        @param autodir: The directory of the installed client.
+
+        @returns the version string, or None if there is none.
+        """
+        version_path = os.path.join(autodir, _INSTALL_VERSION_FILE)
+        result = host.run('cat %s' % utils.sh_escape(version_path),
+                          ignore_status=True)
+        if result.exit_status:
+            return None
+        return result.stdout.strip()
+
+
+    # Directories which are not sent by _install_using_send_file.
+    _SEND_FILE_EXCLUDED_DIRS = frozenset(["tests", "site_tests", "deps",
+                                          "profilers", "packages"])
+
     def _install_using_send_file(self, host, autodir):
-        dirs_to_exclude = set(["tests", "site_tests", "deps", "profilers",
-                               "packages"])
+        dirs_to_exclude = self._SEND_FILE_EXCLUDED_DIRS
         light_files = [os.path.join(self.source_material, f)
                        for f in os.listdir(self.source_material)
                        if f not in dirs_to_exclude]
@@ -370,11 +463,31 @@ class Autotest(installable_object.InstallableObject):
             c = global_config.global_config
             supports_autoserv_packaging = c.get_config_value(
                 "PACKAGES", "serve_packages_from_autoserv", type=bool)
-            # Copy autotest recursively
-            if supports_autoserv_packaging and use_autoserv:
-                self._install_using_send_file(host, autodir)
+            light = supports_autoserv_packaging and use_autoserv
+            version = self._get_source_version(
+                    self._SEND_FILE_EXCLUDED_DIRS if light else ())
+            if version:
+                version = '%s-%s' % ('light' if light else 'full', version)
+            if (version and not self.force_clean_install and
+                    self._get_install_version(host, autodir) == version):
+                logging.info('Autotest from %s is already installed',
+                             self.source_material)
             else:
-                host.send_file(self.source_material, autodir, delete_dest=True)
+                version_path = os.path.join(autodir, _INSTALL_VERSION_FILE)
+                if self.force_clean_install:
+                    self._clean_autodir(host, autodir)
+                elif version:
+                    host.run('rm -f %s' % utils.sh_escape(version_path))
+                # Copy autotest recursively, only the files which differ
+                # from the installed ones are transferred.
+                if light:
+                    self._install_using_send_file(host, autodir)
+                else:
+                    host.send_file(self.source_material, autodir,
+                                   delete_dest=True)
+                if version:
+                    host.run('echo %s > %s' %
+                             (version, utils.sh_escape(version_path)))
             logging.info("Installation of autotest completed from %s",
                          self.source_material)
             self.installed = True
@@ -1433,11 +1546,28 @@ class client_logger(object):
         for src_dir in src_dirs:
             if os.path.exists(src_dir):
                 try:
-                    logging.info('Bundling %s into %s', src_dir, pkg_name)
                     temp_dir = autotemp.tempdir(unique_id='autoserv-packager',
                                                 dir=self.job.tmpdir)
-                    tarball_path = self.job.pkgmgr.tar_package(
-                        pkg_name, src_dir, temp_dir.name, " .")
+                    tarball_path = None
+                    cache = tarball_cache.get_tarball_cache()
+                    if cache:
+                        # The cache links the tarball into temp_dir, where
+                        # eviction can't remove it while it is sent.
+                        try:
+                            tarball_path = cache.get(
+                                    pkg_name, src_dir,
+                                    lambda build_dir:
+                                            self.job.pkgmgr.tar_package(
+                                                    pkg_name, src_dir,
+                                                    build_dir, " ."),
+                                    temp_dir.name)
+                        except (IOError, OSError):
+                            logging.exception(
+                                    'Could not use the tarball cache')
+                    if not tarball_path:
+                        logging.info('Bundling %s into %s', src_dir, pkg_name)
+                        tarball_path = self.job.pkgmgr.tar_package(
+                            pkg_name, src_dir, temp_dir.name, " .")
                     self.host.send_file(tarball_path, remote_dest)
                 finally:
                     temp_dir.clean()
@@ -2,7 +2,7 @@
 #pylint: disable-msg=C0111
 __author__ = "raphtee@google.com (Travis Miller)"
 
-import unittest, os, tempfile, logging
+import unittest, os, shutil, tempfile, logging
 
 import common
 from autotest_lib.server import autotest, utils, hosts, server_job, profilers
@@ -34,6 +34,11 @@ class TestAutotest(unittest.TestCase):
         self.host.job.record = lambda *args: None
         self.host.verify_job_repo_url = lambda *args: None
 
+        # Created before os.getcwd is stubbed, which tempfile may call.
+        self.source_dir = tempfile.mkdtemp()
+        # Cleanups run after tearDown() unstubs os.remove.
+        self.addCleanup(shutil.rmtree, self.source_dir)
+
         # stubs
         self.god.stub_function(utils, "get_server_dir")
         self.god.stub_function(utils, "run")
@@ -159,6 +164,7 @@ class TestAutotest(unittest.TestCase):
             repo_urls=['repo'], hostname='hostname', do_locking=False,
             run_function=self.host.run, run_function_dargs=dict(timeout=600))
         pkg_dir = os.path.join('autodir', 'packages')
+        self.record_fetch_client_package(pkgmgr, pkg_dir, untar_required=True)
         cmd = ('cd autodir && ls | grep -v "^packages$" | '
                'grep -v "^result_tools$" | '
                'xargs rm -rf && rm -rf .[!.]*')
@@ -171,6 +177,58 @@ class TestAutotest(unittest.TestCase):
         self.god.check_playback()
 
 
+    def record_fetch_client_package(self, pkgmgr, pkg_dir, untar_required):
+        self.host.run.expect_call('rm -f autodir/packages.checksum')
+        self.host.run.expect_call('mkdir -p %s' % pkg_dir)
+        pkg_name = 'client-autotest.tar.bz2'
+        fetch_path = os.path.join(pkg_dir, pkg_name)
+        pkgmgr.get_tarball_name.expect_call('autotest', 'client').and_return(
+                pkg_name)
+        pkgmgr.fetch_pkg.expect_call(pkg_name, fetch_path, use_checksum=True)
+        pkgmgr.untar_required.expect_call(fetch_path, 'autodir').and_return(
+                untar_required)
+
+
+    def test_packaging_already_installed(self):
+        self.record_install_prologue()
+
+        c = autotest.global_config.global_config
+        c.get_config_value.expect_call('PACKAGES',
+            'fetch_location', type=list, default=[]).and_return(['repo'])
+        os.path.exists.expect_call('/etc/cros_chroot_version').and_return(True)
+        pkgmgr = packages.PackageManager.expect_new('autodir',
+            repo_urls=['repo'], hostname='hostname', do_locking=False,
+            run_function=self.host.run, run_function_dargs=dict(timeout=600))
+        pkg_dir = os.path.join('autodir', 'packages')
+        self.record_fetch_client_package(pkgmgr, pkg_dir,
+                                         untar_required=False)
+        self.host.run.expect_call('rm -rf autodir/tmp')
+
+        # run and check
+        self.autotest.install()
+        self.god.check_playback()
+        self.assertTrue(self.autotest.installed)
+
+
+    def test_source_version(self):
+        self.construct()
+        # Hashing the source tree takes relative paths, which needs abspath.
+        self.god.unstub(os.path, 'abspath')
+        source = self.source_dir
+        os.mkdir(os.path.join(source, 'tests'))
+        with open(os.path.join(source, 'autotest'), 'w') as f:
+            f.write('client')
+        self.autotest.source_material = source
+
+        version = self.autotest._get_source_version(())
+        light_version = self.autotest._get_source_version(['tests'])
+        with open(os.path.join(source, 'tests', 'test'), 'w') as f:
+            f.write('test')
+        self.assertNotEqual(self.autotest._get_source_version(()), version)
+        self.assertEqual(self.autotest._get_source_version(['tests']),
+                         light_version)
+
+
     def test_run(self):
         self.construct()
 
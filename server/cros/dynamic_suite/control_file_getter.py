@@ -163,18 +163,45 @@ class FileSystemGetter(CacheingAndFilteringControlFileGetter):
 
     _CONTROL_PATTERN = '^control(?:\..+)?$'
 
-    def __init__(self, paths):
+    def __init__(self, paths, index=None):
         """
         @param paths: base directories to start search.
+        @param index: A control_file_index.ControlFileIndex, to reuse the
+                      directory listings and parsed control files of
+                      previous runs. Default is None, to not use an index.
         """
         super(FileSystemGetter, self).__init__()
         self._paths = paths
+        self.index = index
 
 
     def _is_useful_file(self, name):
         return '__init__.py' not in name and '.svn' not in name
 
 
+    def _list_directory(self, directory):
+        """
+        List the files and the subdirectories of |directory|.
+
+        @param directory: Path of the directory.
+        @return A (files, subdirectories) tuple of lists of names. Symlinks
+                to directories are not included in subdirectories.
+        @throws OSError if the directory can't be listed.
+        """
+        if self.index:
+            return self.index.list_directory(directory)
+        files = []
+        subdirs = []
+        for name in os.listdir(directory):
+            fullpath = os.path.join(directory, name)
+            if os.path.isfile(fullpath):
+                files.append(name)
+            elif (not os.path.islink(fullpath)
+                  and os.path.isdir(fullpath)):
+                subdirs.append(name)
+        return files, subdirs
+
+
     def _get_control_file_list(self, suite_name=''):
         """
         Gather a list of paths to control files under |self._paths|.
@@ -208,23 +235,22 @@ class FileSystemGetter(CacheingAndFilteringControlFileGetter):
             if not os.path.exists(directory):
                 continue
             try:
-                for name in os.listdir(directory):
-                    if name in blacklist:
-                        continue
-                    fullpath = os.path.join(directory, name)
-                    if os.path.isfile(fullpath):
-                        if regexp.search(name):
-                            # if we are a control file
-                            self._files.append(fullpath)
-                    elif (not os.path.islink(fullpath)
-                          and os.path.isdir(fullpath)):
-                        directories.append(fullpath)
+                files, subdirs = self._list_directory(directory)
             except OSError:
                 # Some directories under results/ like the Chrome Crash
                 # Reports will cause issues when attempted to be searched.
                 logging.error('Unable to search directory %s for control '
                               'files.', directory)
-                pass
+                continue
+            for name in files:
+                if name not in blacklist and regexp.search(name):
+                    # if we are a control file
+                    self._files.append(os.path.join(directory, name))
+            for name in subdirs:
+                if name not in blacklist:
+                    directories.append(os.path.join(directory, name))
+        if self.index:
+            self.index.save()
         if not self._files:
             msg = 'No control files under ' + ','.join(self._paths)
             raise error.NoControlFileList(msg)
@@ -0,0 +1,208 @@
+# Copyright 2019 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""An on-disk index of the control files of an autotest tree.
+
+Finding the tests of a suite in an autotest tree means listing thousands of
+directories, then parsing every control file found. ControlFileIndex keeps
+the listing of every directory, keyed by its mtime, and the ControlData
+parsed from every control file, keyed by its mtime and size. Only what
+changed since the index was saved is listed or parsed again.
+"""
+
+import cPickle as pickle
+import hashlib
+import logging
+import os
+import time
+
+import common
+from autotest_lib.client.common_lib import control_data
+
+# Path of the index file, in the tmp directory of the autotest directory,
+# with the other files autotest writes at run time.
+INDEX_FILE = os.path.join('tmp', '.control_file_index')
+
+# Bump this whenever the index format changes, so that old indexes are
+# ignored instead of being trusted. Changes to control_data are detected from
+# the digest of its source.
+_INDEX_VERSION = 1
+
+# An entry is only trusted if it was recorded this many seconds after the
+# mtime it is keyed on, so that changes made within the mtime resolution of
+# the file system are not missed.
+_MTIME_GRANULARITY_SECS = 2
+
+
+def _get_control_data_digest():
+    """Return the digest of the source of the control_data module.
+
+    The parsed ControlData objects in an index are only used with the
+    control_data module which parsed them.
+    """
+    path = os.path.splitext(control_data.__file__)[0] + '.py'
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except IOError:
+        # Without the source, parsed control files are never trusted.
+        return None
+
+
+def _is_fresh(entry, key):
+    """Check that an index entry can be used.
+
+    @param entry: A (key, recorded time, ...) tuple from the index.
+    @param key: The key of the entry, from the current state of the file.
+    """
+    return (entry is not None and entry[0] == key and
+            entry[1] - key[0] > _MTIME_GRANULARITY_SECS)
+
+
+class ControlFileIndex(object):
+    """Directory listings and parsed control files, saved across runs."""
+
+    def __init__(self, path):
+        """
+        @param path: Path of the index file. It does not need to exist.
+        """
+        self.path = path
+        self._control_data_digest = _get_control_data_digest()
+        self._dirs, self._tests = self._load()
+        # Keys of the control files returned as stale by get_tests, recorded
+        # before they are read.
+        self._stale_keys = {}
+        self._dirty = False
+
+
+    def _load(self):
+        """Load the index saved by a previous run.
+
+        @return: A (dirs, tests) tuple of dicts, empty if there is no usable
+                 index.
+        """
+        if not os.path.exists(self.path):
+            return {}, {}
+        try:
+            with open(self.path, 'rb') as f:
+                index = pickle.load(f)
+        except Exception as e:
+            # Unpickling can fail in many ways on a truncated file.
+            logging.warning('Ignoring unreadable control file index %s: %s',
+                            self.path, e)
+            return {}, {}
+        if index.get('version') != _INDEX_VERSION:
+            return {}, {}
+        if (self._control_data_digest is None or
+            index.get('control_data_digest') != self._control_data_digest):
+            # The directory listings are still good.
+            return index['dirs'], {}
+        return index['dirs'], index['tests']
+
+
+    def save(self):
+        """Write the index, if it changed.
+
+        Failing to write it is not an error, the next run lists and parses
+        the control files again.
+        """
+        if not self._dirty:
+            return
+        index = {'version': _INDEX_VERSION,
+                 'control_data_digest': self._control_data_digest,
+                 'dirs': self._dirs,
+                 'tests': self._tests}
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as e:
+            logging.warning('Failed to save control file index %s: %s',
+                            self.path, e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._dirty = False
+
+
+    def list_directory(self, directory):
+        """List a directory, or return its listing if it did not change.
+
+        @param directory: Path of the directory.
+
+        @return: A (files, subdirectories) tuple of lists of names. Symlinks
+                 to directories are not included in subdirectories.
+
+        @raises OSError: if the directory can't be listed.
+        """
+        try:
+            key = (os.stat(directory).st_mtime,)
+        except OSError:
+            self._dirs.pop(directory, None)
+            raise
+        entry = self._dirs.get(directory)
+        if _is_fresh(entry, key):
+            return entry[2], entry[3]
+
+        now = time.time()
+        files = []
+        subdirs = []
+        for name in os.listdir(directory):
+            fullpath = os.path.join(directory, name)
+            if os.path.isfile(fullpath):
+                files.append(name)
+            elif not os.path.islink(fullpath) and os.path.isdir(fullpath):
+                subdirs.append(name)
+        self._dirs[directory] = (key, now, files, subdirs)
+        self._dirty = True
+        return files, subdirs
+
+
+    def get_tests(self, paths):
+        """Return the ControlData of the control files that did not change.
+
+        @param paths: Paths of control files.
+
+        @return: A (tests, stale_paths) tuple. tests is a dict of ControlData
+                 objects by path. stale_paths is a list of the paths which
+                 need to be parsed, and passed to add_test.
+        """
+        tests = {}
+        stale_paths = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Let the caller fail to read it.
+                self._tests.pop(path, None)
+                stale_paths.append(path)
+                continue
+            key = (st.st_mtime, st.st_size)
+            entry = self._tests.get(path)
+            if _is_fresh(entry, key):
+                # The ControlData is stored pickled, so that callers get
+                # their own copy to modify.
+                tests[path] = pickle.loads(entry[2])
+            else:
+                self._stale_keys[path] = (key, time.time())
+                stale_paths.append(path)
+        return tests, stale_paths
+
+
+    def add_test(self, path, test):
+        """Record the ControlData parsed from a stale control file.
+
+        @param path: A path returned as stale by get_tests.
+        @param test: The ControlData parsed from the control file.
+        """
+        stale_key = self._stale_keys.pop(path, None)
+        if stale_key is None:
+            return
+        key, now = stale_key
+        self._tests[path] = (key, now,
+                             pickle.dumps(test, pickle.HIGHEST_PROTOCOL))
+        self._dirty = True
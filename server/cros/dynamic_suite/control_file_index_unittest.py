@@ -0,0 +1,162 @@
+#!/usr/bin/python2
+#
+# Copyright 2019 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Unit tests for server/cros/dynamic_suite/control_file_index.py."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import common
+
+from autotest_lib.server.cros.dynamic_suite import control_file_getter
+from autotest_lib.server.cros.dynamic_suite import control_file_index
+from autotest_lib.server.cros.dynamic_suite import suite_common
+
+_CONTROL_FILE = """
+AUTHOR = 'someone'
+NAME = '%s'
+TIME = 'SHORT'
+TEST_TYPE = 'client'
+ATTRIBUTES = 'suite:dummy'
+DOC = 'A test.'
+
+job.run_test('%s')
+"""
+
+# An mtime old enough for index entries to be trusted.
+_OLD_MTIME = 1000000000
+
+
+class ControlFileIndexTest(unittest.TestCase):
+    """Unit tests for control_file_index.ControlFileIndex."""
+
+    def setUp(self):
+        self.autotest_dir = tempfile.mkdtemp()
+        self.tests_dir = os.path.join(self.autotest_dir, 'client', 'tests')
+        self.index_path = os.path.join(self.autotest_dir,
+                                       control_file_index.INDEX_FILE)
+        self.control_file = self._write_control_file('dummy_Pass')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.autotest_dir)
+
+
+    def _write_control_file(self, name, mtime=_OLD_MTIME):
+        """Write the control file of a test, with an old mtime.
+
+        @param name: Name of the test.
+        @param mtime: mtime of the control file and of its directories.
+
+        @return: Path of the control file.
+        """
+        test_dir = os.path.join(self.tests_dir, name)
+        if not os.path.isdir(test_dir):
+            os.makedirs(test_dir)
+        path = os.path.join(test_dir, 'control')
+        with open(path, 'w') as f:
+            f.write(_CONTROL_FILE % (name, name))
+        for changed in (path, test_dir, self.tests_dir):
+            os.utime(changed, (mtime, mtime))
+        return path
+
+
+    def _retrieve(self):
+        """Retrieve all tests through a new getter and index.
+
+        @return: A (tests, parsed_paths) tuple, with the dict of ControlData
+                 by path, and the paths which had to be parsed.
+        """
+        parsed_paths = []
+        parse_cf_text_many = suite_common.parse_cf_text_many
+        def record_parse(control_file_texts, **kwargs):
+            control_file_texts = list(control_file_texts)
+            parsed_paths.extend(path for path, _ in control_file_texts)
+            return parse_cf_text_many(control_file_texts, **kwargs)
+
+        suite_common.parse_cf_text_many = record_parse
+        try:
+            getter = control_file_getter.FileSystemGetter(
+                    [self.tests_dir],
+                    index=control_file_index.ControlFileIndex(
+                            self.index_path))
+            tests = suite_common.retrieve_for_suite(getter)
+        finally:
+            suite_common.parse_cf_text_many = parse_cf_text_many
+        return tests, parsed_paths
+
+
+    def testUnchangedControlFilesAreNotParsed(self):
+        """Ensure control files are only parsed once."""
+        tests, parsed_paths = self._retrieve()
+        self.assertEqual(parsed_paths, [self.control_file])
+        self.assertEqual(tests[self.control_file].name, 'dummy_Pass')
+
+        tests, parsed_paths = self._retrieve()
+        self.assertEqual(parsed_paths, [])
+        self.assertEqual(tests[self.control_file].name, 'dummy_Pass')
+        self.assertEqual(tests[self.control_file].text,
+                         _CONTROL_FILE % ('dummy_Pass', 'dummy_Pass'))
+
+
+    def testChangedControlFileIsParsed(self):
+        """Ensure a changed control file is parsed again."""
+        self._retrieve()
+        self._write_control_file('dummy_Pass', mtime=_OLD_MTIME + 1)
+        tests, parsed_paths = self._retrieve()
+        self.assertEqual(parsed_paths, [self.control_file])
+        self.assertEqual(tests[self.control_file].name, 'dummy_Pass')
+
+
+    def testNewControlFileIsFound(self):
+        """Ensure a directory is listed again when it changes."""
+        self._retrieve()
+        new_control_file = self._write_control_file('dummy_Fail',
+                                                    mtime=_OLD_MTIME + 1)
+        tests, parsed_paths = self._retrieve()
+        self.assertEqual(parsed_paths, [new_control_file])
+        self.assertEqual(sorted(tests),
+                         sorted([self.control_file, new_control_file]))
+
+
+    def testRecentlyChangedControlFileIsNotTrusted(self):
+        """Ensure a control file changed within the mtime resolution is
+        parsed again."""
+        self._write_control_file('dummy_Pass', mtime=int(time.time()))
+        self._retrieve()
+        _, parsed_paths = self._retrieve()
+        self.assertEqual(parsed_paths, [self.control_file])
+
+
+    def testCorruptIndexIsIgnored(self):
+        """Ensure an unreadable index makes every control file parsed."""
+        self._retrieve()
+        with open(self.index_path, 'w') as f:
+            f.write('corrupt')
+        tests, parsed_paths = self._retrieve()
+        self.assertEqual(parsed_paths, [self.control_file])
+        self.assertEqual(tests[self.control_file].name, 'dummy_Pass')
+
+
+    def testControlDataChangeInvalidatesTests(self):
+        """Ensure control files are parsed again when control_data changed."""
+        self._retrieve()
+        get_control_data_digest = control_file_index._get_control_data_digest
+        control_file_index._get_control_data_digest = lambda: 'changed'
+        try:
+            tests, parsed_paths = self._retrieve()
+        finally:
+            control_file_index._get_control_data_digest = (
+                    get_control_data_digest)
+        self.assertEqual(parsed_paths, [self.control_file])
+        self.assertEqual(tests[self.control_file].name, 'dummy_Pass')
+
+
+if __name__ == '__main__':
+    unittest.main()
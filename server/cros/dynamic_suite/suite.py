@@ -28,6 +28,7 @@ from autotest_lib.frontend.afe.json_rpc import proxy
 from autotest_lib.server.cros import provision
 from autotest_lib.server.cros.dynamic_suite import constants
 from autotest_lib.server.cros.dynamic_suite import control_file_getter
+from autotest_lib.server.cros.dynamic_suite import control_file_index
 from autotest_lib.server.cros.dynamic_suite import frontend_wrappers
 from autotest_lib.server.cros.dynamic_suite import job_status
 from autotest_lib.server.cros.dynamic_suite import suite_common
@@ -702,16 +703,23 @@ def name_in_tag_predicate(name):
     return suite_common.name_in_tag_predicate(name)
 
 
-def create_fs_getter(autotest_dir):
+def create_fs_getter(autotest_dir, use_index=True):
     """
     @param autotest_dir: the place to find autotests.
+    @param use_index: Whether to keep an index of the control files in the
+                      tmp directory of |autotest_dir|, so that only the
+                      control files changed since the last run are parsed.
     @return a FileSystemGetter instance that looks under |autotest_dir|.
     """
     # currently hard-coded places to look for tests.
     subpaths = ['server/site_tests', 'client/site_tests',
                 'server/tests', 'client/tests']
     directories = [os.path.join(autotest_dir, p) for p in subpaths]
-    return control_file_getter.FileSystemGetter(directories)
+    index = None
+    if use_index:
+        index = control_file_index.ControlFileIndex(
+                os.path.join(autotest_dir, control_file_index.INDEX_FILE))
+    return control_file_getter.FileSystemGetter(directories, index=index)
 
 
 def _create_ds_getter(build, devserver):
@@ -10,6 +10,7 @@ from __future__ import print_function
 import datetime
 import logging
 import multiprocessing
+import multiprocessing.pool
 import re
 
 import common
@@ -27,6 +28,9 @@ from autotest_lib.server.cros.dynamic_suite import tools
 ENABLE_CONTROLS_IN_BATCH = global_config.global_config.get_config_value(
         'CROS', 'enable_getting_controls_in_batch', type=bool, default=False)
 
+# Number of control files fetched from a devserver concurrently.
+_CONTROL_FILE_FETCH_THREADS = 16
+
 
 def canonicalize_suite_name(suite_name):
     """Canonicalize the suite's name.
@@ -209,7 +213,16 @@ def _get_cf_texts_for_suite_batched(cf_getter, suite_name):
 
     See get_cf_texts_for_suite for params & returns.
     """
-    suite_info = cf_getter.get_suite_info(suite_name=suite_name)
+    try:
+        suite_info = cf_getter.get_suite_info(suite_name=suite_name)
+    except error.SuiteControlFileException as e:
+        # The devserver may not support listing the contents in batch.
+        logging.warning('Failed to get control files in batch, getting them '
+                        'one by one instead: %s', e)
+        for path, text in _get_cf_texts_for_suite_unbatched(cf_getter,
+                                                            suite_name):
+            yield path, text
+        return
     files = suite_info.keys()
     filtered_files = _filter_cf_paths(files)
     for path in filtered_files:
@@ -223,8 +236,33 @@ def _get_cf_texts_for_suite_unbatched(cf_getter, suite_name):
     """
     files = cf_getter.get_control_file_list(suite_name=suite_name)
     filtered_files = _filter_cf_paths(files)
-    for path in filtered_files:
-        yield path, cf_getter.get_control_file_contents(path)
+    if isinstance(cf_getter, control_file_getter.DevServerGetter):
+        return _get_cf_texts_concurrently(cf_getter, list(filtered_files))
+    return ((path, cf_getter.get_control_file_contents(path))
+            for path in filtered_files)
+
+
+def _get_cf_texts_concurrently(cf_getter, paths):
+    """Get the content of control files with concurrent calls.
+
+    Getting each control file from a devserver is a separate HTTP request,
+    so they are made from a pool of threads.
+
+    @param cf_getter: a control_file_getter.ControlFileGetter used to fetch
+           the content of control files
+    @param paths: List of control file paths.
+    @returns: list of (path, text) tuples, in the order of paths
+    """
+    if not paths:
+        return []
+    pool = multiprocessing.pool.ThreadPool(
+            min(_CONTROL_FILE_FETCH_THREADS, len(paths)))
+    try:
+        texts = pool.map(cf_getter.get_control_file_contents, paths)
+    finally:
+        pool.close()
+        pool.join()
+    return zip(paths, texts)
 
 
 def _filter_cf_paths(paths):
@@ -327,9 +365,11 @@ def parse_cf_text_many(control_file_texts,
         worker_data = zip(paths, texts, [forgiving_error] * len(paths),
                           [test_args] * len(paths))
         pool = multiprocessing.Pool(processes=get_process_limit())
-        result_list = pool.map(parse_cf_text_process, worker_data)
-        pool.close()
-        pool.join()
+        try:
+            result_list = pool.map(parse_cf_text_process, worker_data)
+        finally:
+            pool.close()
+            pool.join()
 
         # Convert [(path, test), ...] to {path: test, ...}
         tests = dict(result_list)
@@ -354,6 +394,47 @@ def retrieve_control_data_for_test(cf_getter, test_name):
     return parse_cf_text(path, text)
 
 
+def _get_index(cf_getter, test_args):
+    """Return the control file index to use with a getter, if any.
+
+    Only a file system getter can have an index. Test args are injected in
+    the control file text before parsing it, so the index is not used with
+    them.
+
+    @param cf_getter: a control_file_getter.ControlFileGetter used to list
+           and fetch the content of control files
+    @param test_args: The test args to be injected into test control file.
+    """
+    if test_args or not isinstance(cf_getter,
+                                   control_file_getter.FileSystemGetter):
+        return None
+    return cf_getter.index
+
+
+def _retrieve_for_suite_indexed(cf_getter, index, suite_name,
+                                forgiving_error):
+    """Retrieve tests, only parsing the control files changed since indexed.
+
+    See retrieve_for_suite for params & returns.
+
+    @param index: The control_file_index.ControlFileIndex of cf_getter.
+    """
+    paths = _filter_cf_paths(
+            cf_getter.get_control_file_list(suite_name=suite_name))
+    tests, stale_paths = index.get_tests(paths)
+    logging.debug('Found %d control files in the index, parsing %d.',
+                  len(tests), len(stale_paths))
+    control_file_texts = ((path, cf_getter.get_control_file_contents(path))
+                          for path in stale_paths)
+    parsed_tests = parse_cf_text_many(control_file_texts,
+                                      forgiving_error=forgiving_error)
+    for path, test in parsed_tests.iteritems():
+        index.add_test(path, test)
+    index.save()
+    tests.update(parsed_tests)
+    return tests
+
+
 def retrieve_for_suite(cf_getter, suite_name='', forgiving_error=False,
                        test_args=None):
     """Scan through all tests and find all tests.
@@ -366,6 +447,10 @@ def retrieve_for_suite(cf_getter, suite_name='', forgiving_error=False,
     @returns a dictionary of ControlData objects that based on given
              parameters.
     """
+    index = _get_index(cf_getter, test_args)
+    if index:
+        return _retrieve_for_suite_indexed(cf_getter, index, suite_name,
+                                           forgiving_error)
     control_file_texts = get_cf_texts_for_suite(cf_getter, suite_name)
     return parse_cf_text_many(control_file_texts,
                               forgiving_error=forgiving_error,
@@ -381,7 +466,9 @@ def filter_tests(tests, predicate=lambda t: True):
     @returns a list of ControlData objects as tests.
     """
     logging.info('Parsed %s child test control files.', len(tests))
-    tests = [test for test in tests.itervalues() if predicate(test)]
+    # Tests of equal time stay in path order, so that the result does not
+    # depend on the order the control files were retrieved in.
+    tests = [test for _, test in sorted(tests.iteritems()) if predicate(test)]
     tests.sort(key=lambda t:
                control_data.ControlData.get_test_time_index(t.time),
                reverse=True)
@@ -12,6 +12,7 @@ from collections import OrderedDict
 import os
 import shutil
 import tempfile
+import threading
 import unittest
 
 import mock
@@ -39,6 +40,38 @@ from autotest_lib.server.cros.dynamic_suite.fakes import FakeMultiprocessingPool
 from autotest_lib.server.cros.dynamic_suite.suite import RetryHandler
 from autotest_lib.server.cros.dynamic_suite.suite import Suite
 
+class _FakeDevServerGetter(control_file_getter.DevServerGetter):
+    """DevServerGetter serving control files from a dict, from any thread.
+
+    @var fetched: Paths of the control files fetched.
+    """
+
+    def __init__(self, files):
+        """
+        @param files: Dict of control file contents, by path.
+        """
+        self._files = files
+        self._lock = threading.Lock()
+        self.fetched = []
+
+
+    def get_suite_info(self, suite_name=''):
+        """Fail like a devserver which can't list control files in batch."""
+        raise error.SuiteControlFileException('Not supported')
+
+
+    def get_control_file_list(self, suite_name=''):
+        """Return the paths of all the control files."""
+        return sorted(self._files)
+
+
+    def get_control_file_contents(self, test_path):
+        """Return the contents of a control file."""
+        with self._lock:
+            self.fetched.append(test_path)
+            return self._files[test_path]
+
+
 class SuiteTest(mox.MoxTestBase):
     """Unit tests for dynamic_suite Suite class.
 
@@ -190,6 +223,46 @@ class SuiteTest(mox.MoxTestBase):
         suite_common.ENABLE_CONTROLS_IN_BATCH = self.use_batch
 
 
+    def testFindAllTestInBatchFallback(self):
+        """Test that control files are fetched one by one when fetching them
+        in batch fails."""
+        files = dict(self.files.items() + self.files_to_filter.items())
+        getter = _FakeDevServerGetter(
+                dict((path, data.string) for path, data in files.iteritems()))
+        self.mox.StubOutWithMock(control_data, 'parse_control_string')
+        self.mox.StubOutWithMock(suite_common.multiprocessing, 'Pool')
+        suite_common.multiprocessing.Pool(
+            processes=suite_common.get_process_limit()).AndReturn(
+                FakeMultiprocessingPool())
+        for path, data in self.files.iteritems():
+            control_data.parse_control_string(
+                    data.string,
+                    raise_warnings=True,
+                    path=path).InAnyOrder().AndReturn(data)
+        suite_common.ENABLE_CONTROLS_IN_BATCH = True
+
+        self.mox.ReplayAll()
+
+        predicate = lambda d: d.suite == self._TAG
+        tests = SuiteBase.find_and_parse_tests(getter,
+                                               predicate,
+                                               self._TAG)
+        self.assertEquals(len(tests), 6)
+        self.assertTrue(self.files['one'] in tests)
+        self.assertTrue(self.files['seven'] in tests)
+        self.assertEquals(sorted(getter.fetched), sorted(self.files))
+
+
+    def testGetControlFileTextsConcurrently(self):
+        """Test that control files fetched by threads keep their order."""
+        paths = ['client/site_tests/test_%d/control' % i for i in range(50)]
+        getter = _FakeDevServerGetter(
+                dict((path, 'text of %s' % path) for path in paths))
+        self.assertEquals(
+                suite_common._get_cf_texts_concurrently(getter, paths),
+                [(path, 'text of %s' % path) for path in paths])
+
+
     def testFindAndParseStableTests(self):
         """Should find only tests that match a predicate."""
         self.expect_control_file_parsing()
@@ -212,7 +285,8 @@ class SuiteTest(mox.MoxTestBase):
         """
         autodir = os.path.abspath(
             os.path.join(os.path.dirname(__file__), '..', '..', '..'))
-        fs_getter = SuiteBase.create_fs_getter(autodir)
+        # Don't write an index in the source tree.
+        fs_getter = SuiteBase.create_fs_getter(autodir, use_index=False)
         predicate = lambda t: hasattr(t, 'suite')
         SuiteBase.find_and_parse_tests(fs_getter, predicate,
                                        forgiving_parser=False)
@@ -0,0 +1,299 @@
+# Copyright 2019 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Size accounting, LRU eviction and dedupe for the tradefed download cache.
+
+The cache directory holds one entry directory per downloaded uri. An index
+file records the size and the last access time of each complete entry, so
+that the size of the cache is known without walking it, and the least
+recently used entries can be evicted when it grows too large.
+
+Identical files of different entries (e.g. two revisions of a CTS bundle)
+are stored once: they are hard links to a file named after their content in
+the objects directory. An object is deleted when the last entry linking to
+it is evicted.
+
+None of the methods lock the cache, the caller is responsible to hold the
+lock to it.
+"""
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+# Name of the index file, in the cache directory.
+INDEX_FILE = '.index'
+
+# Name of the directory of deduplicated files, in the cache directory.
+OBJECTS_DIR = '.objects'
+
+# Bump this when the index format changes, to rebuild old indexes.
+_INDEX_VERSION = 1
+
+# Files smaller than this are not worth hashing for dedupe.
+_DEDUPE_MIN_SIZE = 64 * 1024
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def _hash_file(path):
+    """Return the sha1 hex digest of the content of a file.
+
+    @param path: Path of the file.
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), ''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+class DownloadCache(object):
+    """The index and objects of a tradefed download cache directory."""
+
+    def __init__(self, cache_dir):
+        """
+        @param cache_dir: The cache directory. Entries are its
+                subdirectories, except the ones starting with a dot.
+        """
+        self.cache_dir = cache_dir
+        self._index_path = os.path.join(cache_dir, INDEX_FILE)
+        self._objects_dir = os.path.join(cache_dir, OBJECTS_DIR)
+
+
+    def _load_index(self, new_entry=None):
+        """Read the index, or rebuild it if it is missing or unreadable.
+
+        @param new_entry: Name of an entry being committed, which is left out
+                of a rebuilt index.
+
+        @return: The index dict, with 'entries', a dict of {'size', 'atime'}
+                dicts by entry name, and 'objects', a dict of object sizes by
+                object name.
+        """
+        try:
+            with open(self._index_path) as f:
+                index = json.load(f)
+            if index.get('version') == _INDEX_VERSION:
+                return index
+        except (IOError, ValueError) as e:
+            if getattr(e, 'errno', None) != errno.ENOENT:
+                logging.warning('Ignoring unreadable cache index %s: %s',
+                                self._index_path, e)
+        return self._rebuild_index(new_entry)
+
+
+    def _rebuild_index(self, new_entry):
+        """Build the index from the content of the cache directory.
+
+        This walks the whole cache, so it is only done when there is no
+        usable index. Entries get their mtime as last access time.
+
+        @param new_entry: Name of an entry to leave out, or None.
+        """
+        logging.info('Rebuilding cache index of %s', self.cache_dir)
+        index = {'version': _INDEX_VERSION, 'entries': {}, 'objects': {}}
+        if os.path.isdir(self._objects_dir):
+            for name in os.listdir(self._objects_dir):
+                index['objects'][name] = os.path.getsize(
+                        os.path.join(self._objects_dir, name))
+        for name in self._list_entries():
+            if name == new_entry:
+                continue
+            entry_dir = os.path.join(self.cache_dir, name)
+            index['entries'][name] = {
+                    'size': self._entry_size(entry_dir),
+                    'atime': os.path.getmtime(entry_dir),
+            }
+        self._save_index(index)
+        return index
+
+
+    def _save_index(self, index):
+        """Write the index atomically.
+
+        @param index: The index dict.
+        """
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        tmp_path = self._index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.rename(tmp_path, self._index_path)
+
+
+    def _list_entries(self):
+        """Return the names of the entry directories in the cache."""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        return [name for name in os.listdir(self.cache_dir)
+                if not name.startswith('.') and
+                os.path.isdir(os.path.join(self.cache_dir, name))]
+
+
+    def _entry_size(self, entry_dir):
+        """Return the size of the files of an entry which are not objects.
+
+        @param entry_dir: Path of the entry directory.
+        """
+        size = 0
+        for root, _, files in os.walk(entry_dir):
+            for name in files:
+                try:
+                    st = os.lstat(os.path.join(root, name))
+                except OSError:
+                    logging.error('Inaccessible path (crbug/793696): %s/%s',
+                                  root, name)
+                    continue
+                if st.st_nlink == 1:
+                    size += st.st_size
+        return size
+
+
+    def _dedupe_entry(self, entry_dir, objects):
+        """Replace the large files of an entry by links to objects.
+
+        Files already linked to an object are left alone, so deduping an
+        entry again only costs a walk.
+
+        @param entry_dir: Path of the entry directory.
+        @param objects: The dict of object sizes of the index, updated with
+                the objects created.
+        """
+        if not os.path.isdir(self._objects_dir):
+            os.makedirs(self._objects_dir)
+        for root, _, files in os.walk(entry_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                st = os.lstat(path)
+                if (not os.path.isfile(path) or os.path.islink(path) or
+                        st.st_nlink > 1 or st.st_size < _DEDUPE_MIN_SIZE):
+                    continue
+                # Links share their mode, so only files with the same mode
+                # are deduplicated.
+                object_name = '%s-%o' % (_hash_file(path), st.st_mode & 0o7777)
+                object_path = os.path.join(self._objects_dir, object_name)
+                if os.path.exists(object_path):
+                    tmp_path = path + '.dedupe'
+                    os.link(object_path, tmp_path)
+                    os.rename(tmp_path, path)
+                else:
+                    os.link(path, object_path)
+                    objects[object_name] = st.st_size
+
+
+    def get_size(self):
+        """Return the size in bytes of the cache, from its index."""
+        index = self._load_index()
+        return (sum(entry['size'] for entry in index['entries'].itervalues()) +
+                sum(index['objects'].itervalues()))
+
+
+    def discard(self, entry_dir):
+        """Delete an entry, e.g. before downloading it again.
+
+        @param entry_dir: Path of the entry directory.
+        """
+        index = self._load_index()
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        if index['entries'].pop(os.path.basename(entry_dir), None):
+            self._collect_objects(index)
+            self._save_index(index)
+
+
+    def commit(self, entry_dir):
+        """Record that an entry is complete, or that it was used again.
+
+        A new entry is deduplicated and accounted. Every entry is marked as
+        the most recently used one.
+
+        @param entry_dir: Path of the entry directory.
+        """
+        name = os.path.basename(entry_dir)
+        index = self._load_index(new_entry=name)
+        entry = index['entries'].get(name)
+        if entry is None:
+            self._dedupe_entry(entry_dir, index['objects'])
+            entry = index['entries'][name] = {
+                    'size': self._entry_size(entry_dir)}
+        entry['atime'] = time.time()
+        self._save_index(index)
+
+
+    def remove_incomplete(self):
+        """Delete the entries which were never committed.
+
+        They were left by a job which died while downloading or unpacking
+        them. Without an index, complete entries can't be told apart, so the
+        whole cache is cleared.
+        """
+        if not os.path.exists(self._index_path):
+            self.clear()
+            return
+        index = self._load_index()
+        for name in self._list_entries():
+            if name not in index['entries']:
+                logging.info('Deleting incomplete cache entry %s', name)
+                shutil.rmtree(os.path.join(self.cache_dir, name),
+                              ignore_errors=True)
+
+
+    def clear(self):
+        """Delete all the entries and objects."""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.cache_dir)
+
+
+    def evict(self, max_size, low_water_size):
+        """Delete the least recently used entries if the cache is too large.
+
+        @param max_size: Size in bytes above which entries are evicted.
+        @param low_water_size: Size in bytes to evict entries down to.
+
+        @return: The size of the cache, after eviction.
+        """
+        index = self._load_index()
+        entries = index['entries']
+        size = (sum(entry['size'] for entry in entries.itervalues()) +
+                sum(index['objects'].itervalues()))
+        if size <= max_size:
+            return size
+
+        for name in sorted(entries, key=lambda name: entries[name]['atime']):
+            logging.info('Evicting cache entry %s, last used %s', name,
+                         time.ctime(entries[name]['atime']))
+            shutil.rmtree(os.path.join(self.cache_dir, name),
+                          ignore_errors=True)
+            size -= entries.pop(name)['size']
+            size -= self._collect_objects(index)
+            if size <= low_water_size:
+                break
+        self._save_index(index)
+        return size
+
+
+    def _collect_objects(self, index):
+        """Delete the objects which are not linked from any entry anymore.
+
+        @param index: The index dict, updated.
+
+        @return: The size in bytes of the deleted objects.
+        """
+        freed = 0
+        for name, size in index['objects'].items():
+            path = os.path.join(self._objects_dir, name)
+            try:
+                if os.stat(path).st_nlink > 1:
+                    continue
+                os.remove(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            del index['objects'][name]
+            freed += size
+        return freed
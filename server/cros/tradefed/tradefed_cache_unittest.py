@@ -0,0 +1,84 @@
+# Copyright 2019 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+import os
+import shutil
+import tempfile
+import unittest
+
+import tradefed_cache
+
+_BIG = 'x' * tradefed_cache._DEDUPE_MIN_SIZE
+
+
+class DownloadCacheTest(unittest.TestCase):
+    """Unittest for tradefed_cache."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = tradefed_cache.DownloadCache(self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _add_entry(self, name, files):
+        """Writes the files of an entry, and commits it."""
+        entry_dir = os.path.join(self.cache_dir, name)
+        os.mkdir(entry_dir)
+        for filename, content in files.iteritems():
+            with open(os.path.join(entry_dir, filename), 'w') as f:
+                f.write(content)
+        self.cache.commit(entry_dir)
+        return entry_dir
+
+    def test_size_is_accounted_on_commit(self):
+        self._add_entry('a', {'small': 'abc', 'big': _BIG})
+        self._add_entry('b', {'small': 'de'})
+        self.assertEqual(self.cache.get_size(), 3 + len(_BIG) + 2)
+
+    def test_identical_files_are_linked(self):
+        a = self._add_entry('a', {'big': _BIG})
+        b = self._add_entry('b', {'big': _BIG, 'other': _BIG + 'y'})
+        self.assertEqual(os.stat(os.path.join(a, 'big')).st_ino,
+                         os.stat(os.path.join(b, 'big')).st_ino)
+        self.assertEqual(self.cache.get_size(), 2 * len(_BIG) + 1)
+
+    def test_evict_least_recently_used(self):
+        a = self._add_entry('a', {'big': _BIG + 'a'})
+        b = self._add_entry('b', {'big': _BIG + 'b'})
+        c = self._add_entry('c', {'big': _BIG + 'c'})
+        # Using a makes b the least recently used entry.
+        self.cache.commit(a)
+        size = self.cache.evict(3 * len(_BIG), 2 * len(_BIG) + 2)
+        self.assertEqual(size, 2 * len(_BIG) + 2)
+        self.assertTrue(os.path.exists(a))
+        self.assertFalse(os.path.exists(b))
+        self.assertTrue(os.path.exists(c))
+        self.assertEqual(self.cache.get_size(), size)
+
+    def test_evict_keeps_shared_objects(self):
+        a = self._add_entry('a', {'big': _BIG})
+        b = self._add_entry('b', {'big': _BIG, 'other': _BIG + 'b'})
+        self.cache.commit(b)
+        self.cache.evict(0, 2 * len(_BIG) + 1)
+        self.assertFalse(os.path.exists(a))
+        self.assertEqual(self.cache.get_size(), 2 * len(_BIG) + 1)
+        with open(os.path.join(b, 'big')) as f:
+            self.assertEqual(f.read(), _BIG)
+
+    def test_remove_incomplete(self):
+        a = self._add_entry('a', {'small': 'abc'})
+        incomplete = os.path.join(self.cache_dir, 'b')
+        os.mkdir(incomplete)
+        self.cache.remove_incomplete()
+        self.assertTrue(os.path.exists(a))
+        self.assertFalse(os.path.exists(incomplete))
+
+    def test_index_is_rebuilt(self):
+        self._add_entry('a', {'small': 'abc', 'big': _BIG})
+        os.remove(os.path.join(self.cache_dir, tradefed_cache.INDEX_FILE))
+        self.assertEqual(self.cache.get_size(), 3 + len(_BIG))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -41,6 +41,9 @@ TRADEFED_CACHE_CONTAINER_LOCK = '/usr/local/autotest/results/shared/lock'
 # impact of running say 100 CTS tests in parallel is acceptable (quarter
 # servers have 500GB of disk, while full servers have 2TB).
 TRADEFED_CACHE_MAX_SIZE = (20 * 1024 * 1024 * 1024)
+# When the cache grows larger than TRADEFED_CACHE_MAX_SIZE, the least recently
+# used entries are evicted until it is smaller than this.
+TRADEFED_CACHE_LOW_WATER_SIZE = (15 * 1024 * 1024 * 1024)
 # The path that cts-tradefed uses to place media assets. By downloading and
 # expanding the archive here beforehand, tradefed can reuse the content.
 TRADEFED_MEDIA_PATH = '/tmp/android-cts-media'
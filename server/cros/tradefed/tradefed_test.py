@@ -12,7 +12,7 @@
 # Many short variable names don't follow the naming convention.
 # pylint: disable=invalid-name
 #
-# _parse_result() and _dir_size() don't access self and could be functions.
+# _parse_result() doesn't access self and could be a function.
 # pylint: disable=no-self-use
 
 from collections import namedtuple
@@ -34,6 +34,7 @@ from autotest_lib.client.common_lib.cros import dev_server
 from autotest_lib.server import test
 from autotest_lib.server import utils
 from autotest_lib.server.cros.tradefed import cts_expected_failure_parser
+from autotest_lib.server.cros.tradefed import tradefed_cache
 from autotest_lib.server.cros.tradefed import tradefed_chromelogin as login
 from autotest_lib.server.cros.tradefed import tradefed_constants as constants
 from autotest_lib.server.cros.tradefed import tradefed_utils
@@ -115,6 +116,8 @@ class TradefedTest(test.test):
         self._tradefed_cache = os.path.join(cache_root, 'cache')
         self._tradefed_cache_lock = os.path.join(cache_root, 'lock')
         self._tradefed_cache_dirty = os.path.join(cache_root, 'dirty')
+        self._download_cache = tradefed_cache.DownloadCache(
+            self._tradefed_cache)
         # The content of the install location does not survive across jobs and
         # is isolated (by using a unique path)_against other autotest instances.
         # This is not needed for the lab, but if somebody wants to run multiple
@@ -162,8 +165,10 @@ class TradefedTest(test.test):
             os.path.join(self.resultsdir,
                          self._get_tradefed_base_dir()))
         if path:
-            for metric in tradefed_utils.get_perf_metrics_from_test_result_xml(
-                path, self.resultsdir):
+            perf_metrics, counts = tradefed_utils.parse_test_result_xml(
+                path, self.resultsdir, self._waivers)
+            logging.info('Test results in %s: %s', path, counts)
+            for metric in perf_metrics:
                 self.output_perf_value(**metric)
 
     def cleanup(self):
@@ -462,18 +467,6 @@ class TradefedTest(test.test):
             raise
         return destination
 
-    def _dir_size(self, directory):
-        """Compute recursive size in bytes of directory."""
-        size = 0
-        for root, _, files in os.walk(directory):
-            for name in files:
-                try:
-                    size += os.path.getsize(os.path.join(root, name))
-                except OSError:
-                    logging.error('Inaccessible path (crbug/793696): %s/%s',
-                                  root, name)
-        return size
-
     def _invalidate_download_cache(self):
         """Marks the download cache for deferred deletion.
 
@@ -492,29 +485,24 @@ class TradefedTest(test.test):
         shutil.rmtree(self._tradefed_cache_dirty, ignore_errors=True)
 
     def _clean_download_cache_if_needed(self, force=False):
-        """Invalidates cache to prevent it from growing too large."""
-        # If the cache is large enough to hold a working set, we can simply
-        # delete everything without thrashing.
-        # TODO(ihf): Investigate strategies like LRU.
-        clean = force
+        """Evicts least recently used cache entries to prevent the cache from
+        growing too large, and deletes the entries left incomplete.
+
+        @param force: If True, delete the whole cache.
+        """
         with tradefed_utils.lock(self._tradefed_cache_lock):
-            size = self._dir_size(self._tradefed_cache)
-            if size > constants.TRADEFED_CACHE_MAX_SIZE:
-                logging.info(
-                    'Current cache size=%d got too large. Clearing %s.', size,
-                    self._tradefed_cache)
-                clean = True
-            else:
-                logging.info('Current cache size=%d of %s.', size,
-                             self._tradefed_cache)
-            if os.path.exists(self._tradefed_cache_dirty):
-                logging.info('Found dirty cache.')
-                clean = True
-            if clean:
+            if force:
                 logging.warning('Cleaning download cache.')
-                shutil.rmtree(self._tradefed_cache, ignore_errors=True)
-                self._safe_makedirs(self._tradefed_cache)
-                shutil.rmtree(self._tradefed_cache_dirty, ignore_errors=True)
+                self._download_cache.clear()
+            elif os.path.exists(self._tradefed_cache_dirty):
+                logging.info('Found dirty cache.')
+                self._download_cache.remove_incomplete()
+            shutil.rmtree(self._tradefed_cache_dirty, ignore_errors=True)
+            size = self._download_cache.evict(
+                constants.TRADEFED_CACHE_MAX_SIZE,
+                constants.TRADEFED_CACHE_LOW_WATER_SIZE)
+            logging.info('Current cache size=%d of %s.', size,
+                         self._tradefed_cache)
 
     def _download_to_cache(self, uri):
         """Downloads the uri from the storage server.
@@ -546,6 +534,8 @@ class TradefedTest(test.test):
                 return os.path.join(output_dir,
                     os.path.basename(urlparse.urlparse(uri).path))
             logging.error('Empty cache entry detected %s', output_dir)
+        # Drop anything left from an earlier attempt.
+        self._download_cache.discard(output_dir)
         return self._download_to_dir(uri, output_dir)
 
     def _download_to_dir(self, uri, output_dir):
@@ -664,6 +654,8 @@ class TradefedTest(test.test):
             if os.path.exists(cache_path):
                 logging.info('Deleting original %s', cache_path)
                 os.remove(cache_path)
+            # Account the entry, and share its files with other bundles.
+            self._download_cache.commit(os.path.dirname(cache_path))
             # Erase dirty marker from disk.
             self._validate_download_cache()
             # We always copy files to give tradefed a clean copy of the
@@ -680,6 +672,7 @@ class TradefedTest(test.test):
                 # We don't want to leave a corrupt cache for other jobs.
                 self._invalidate_download_cache()
                 cache_path = self._download_to_cache(gs_uri)
+                self._download_cache.commit(os.path.dirname(cache_path))
                 # Mark cache as clean again.
                 self._validate_download_cache()
                 # This only affects the current job, so not part of cache
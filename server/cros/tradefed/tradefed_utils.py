@@ -2,6 +2,7 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import collections
 import contextlib
 import logging
 import os
@@ -219,36 +220,118 @@ def get_test_result_xml_path(results_destination):
     return last_result_path
 
 
+# A <Test /> of test_result.xml, with the names of its <Module /> and
+# <TestCase />. metrics is a list of (score_type, score_unit, value) tuples, one
+# per <Metric /> of the test.
+TestResult = collections.namedtuple(
+        'TestResult', ['module', 'abi', 'testcase', 'name', 'result',
+                       'metrics'])
+
+
+def iter_test_result_xml(result_path):
+    """Parse test_result.xml, and yield a TestResult for each <Test />.
+
+    test_result.xml can be hundreds of MB for a full CTS run, so it is parsed
+    incrementally, and the elements are dropped once they were yielded: the
+    memory used does not depend on the size of the file.
+
+    @param result_path: Path of test_result.xml.
+
+    @raises SyntaxError: (ElementTree.ParseError) if the file is not valid
+            xml. The tests before the error have been yielded.
+    """
+    root = None
+    module = abi = testcase = None
+    for event, element in ElementTree.iterparse(result_path,
+                                                events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = element
+            elif element.tag == 'Module':
+                module = element.get('name')
+                abi = element.get('abi')
+            elif element.tag == 'TestCase':
+                testcase = element.get('name')
+            continue
+
+        if element.tag == 'Test':
+            metrics = [(metric.get('score_type'), metric.get('score_unit'),
+                        metric[0].text)
+                       for metric in element.iter('Metric')]
+            yield TestResult(module, abi, testcase, element.get('name'),
+                             element.get('result'), metrics)
+            element.clear()
+        elif element.tag == 'TestCase':
+            element.clear()
+        elif element.tag == 'Module':
+            # Also drop the cleared elements from the root.
+            root.clear()
+
+
+def _get_perf_metrics(test_result, resultsdir):
+    """Map each <Metric /> of a test to the kwargs of output_perf_value.
+
+    @param test_result: A TestResult.
+    @param resultsdir: The results directory of the test.
+
+    @return: A list of dicts.
+    """
+    perf_metrics = []
+    for score_type, units, value in test_result.metrics:
+        if score_type not in ['higher_better', 'lower_better']:
+            logging.warning(
+                'Unsupported score_type in %s/%s/%s', test_result.module,
+                test_result.testcase, test_result.name)
+            continue
+        perf_metrics.append(dict(
+            description=test_result.testcase + '#' + test_result.name,
+            value=value,
+            units=units,
+            higher_is_better=(score_type == 'higher_better'),
+            resultsdir=os.path.join(resultsdir, 'tests',
+                PERF_MODULE_NAME_PREFIX + test_result.module)
+        ))
+    return perf_metrics
+
+
 def get_perf_metrics_from_test_result_xml(result_path, resultsdir):
     """Parse test_result.xml and each <Metric /> is mapped to a dict that
     can be used as kwargs of |TradefedTest.output_perf_value|."""
     try:
-        root = ElementTree.parse(result_path)
-        for module in root.iter('Module'):
-            module_name = module.get('name')
-            for testcase in module.iter('TestCase'):
-                testcase_name = testcase.get('name')
-                for test in testcase.iter('Test'):
-                    test_name = test.get('name')
-                    for metric in test.iter('Metric'):
-                        score_type = metric.get('score_type')
-                        if score_type not in ['higher_better', 'lower_better']:
-                            logging.warning(
-                                'Unsupported score_type in %s/%s/%s',
-                                module_name, testcase_name, test_name)
-                            continue
-                        higher_is_better = (score_type == 'higher_better')
-                        units = metric.get('score_unit')
-                        yield dict(
-                            description=testcase_name + '#' + test_name,
-                            value=metric[0].text,
-                            units=units,
-                            higher_is_better=higher_is_better,
-                            resultsdir=os.path.join(resultsdir, 'tests',
-                                PERF_MODULE_NAME_PREFIX + module_name)
-                        )
+        for test_result in iter_test_result_xml(result_path):
+            for perf_metric in _get_perf_metrics(test_result, resultsdir):
+                yield perf_metric
     except Exception as e:
         logging.warning(
             'Exception raised in '
             '|tradefed_utils.get_perf_metrics_from_test_result_xml|: {'
             '0}'.format(e))
+
+
+def parse_test_result_xml(result_path, resultsdir, waivers=None):
+    """Parse test_result.xml for its perf metrics and test counts at once.
+
+    @param result_path: Path of test_result.xml.
+    @param resultsdir: The results directory of the test.
+    @param waivers: a set() of tests which are permitted to fail.
+
+    @return: A (perf_metrics, counts) tuple. perf_metrics is a list of the
+            dicts returned by get_perf_metrics_from_test_result_xml. counts
+            is a dict with the number of tests by result, e.g. 'pass' and
+            'fail', and the number of failures which are waived as 'waived'.
+            Like in parse_tradefed_result, waived failures are also counted
+            as failures. If the file is malformed, what was parsed before
+            the error is returned.
+    """
+    perf_metrics = []
+    counts = collections.defaultdict(int)
+    try:
+        for test_result in iter_test_result_xml(result_path):
+            counts[test_result.result] += 1
+            if (test_result.result == 'fail' and waivers and
+                    test_result.testcase + '#' + test_result.name in waivers):
+                counts['waived'] += 1
+            perf_metrics.extend(_get_perf_metrics(test_result, resultsdir))
+    except Exception as e:
+        logging.warning('Failed to parse %s: %s', result_path, e)
+    return perf_metrics, dict(counts)
@@ -2,6 +2,8 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 import os
+import shutil
+import tempfile
 import unittest
 
 import tradefed_utils
@@ -357,6 +359,54 @@ class TradefedTestTest(unittest.TestCase):
             os.path.join('/', 'resultsdir'))
         self.assertListEqual(list(perf_result), [])
 
+    def test_parse_test_result_xml(self):
+        result_path = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                   'tradefed_utils_unittest_data',
+                                   'test_result.xml')
+        perf_metrics, counts = tradefed_utils.parse_test_result_xml(
+            result_path, os.path.join('/', 'resultsdir'),
+            waivers=set(['android.media.cts.AdaptivePlaybackTest'
+                         '#testH263_adaptiveDrc']))
+        self.assertListEqual(
+            perf_metrics,
+            list(tradefed_utils.get_perf_metrics_from_test_result_xml(
+                result_path, os.path.join('/', 'resultsdir'))))
+        # Waivers only apply to failed tests.
+        self.assertEqual(counts, {'pass': 2153})
+
+        perf_metrics, counts = tradefed_utils.parse_test_result_xml(
+            os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                         'tradefed_utils_unittest_data',
+                         'malformed_test_result.xml'),
+            os.path.join('/', 'resultsdir'))
+        self.assertListEqual(perf_metrics, [])
+        self.assertEqual(counts, {'pass': 1})
+
+    def test_iter_test_result_xml_counts_failures(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        result_path = os.path.join(tempdir, 'test_result.xml')
+        with open(result_path, 'w') as f:
+            f.write('<Result><Module name="CtsFooTestCases" abi="x86">'
+                    '<TestCase name="android.foo.FooTest">'
+                    '<Test result="pass" name="testA" />'
+                    '<Test result="fail" name="testB"><Failure /></Test>'
+                    '<Test result="fail" name="testC"><Failure /></Test>'
+                    '</TestCase></Module></Result>')
+        tests = list(tradefed_utils.iter_test_result_xml(result_path))
+        self.assertEqual([(t.module, t.abi, t.testcase, t.name, t.result)
+                          for t in tests],
+                         [('CtsFooTestCases', 'x86', 'android.foo.FooTest',
+                           'testA', 'pass'),
+                          ('CtsFooTestCases', 'x86', 'android.foo.FooTest',
+                           'testB', 'fail'),
+                          ('CtsFooTestCases', 'x86', 'android.foo.FooTest',
+                           'testC', 'fail')])
+        _, counts = tradefed_utils.parse_test_result_xml(
+            result_path, tempdir,
+            waivers=set(['android.foo.FooTest#testB']))
+        self.assertEqual(counts, {'pass': 1, 'fail': 2, 'waived': 1})
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -43,6 +43,9 @@ form_ntuples_from_machines = server_utils.form_ntuples_from_machines
 GLOBAL_CONFIG = global_config.global_config
 DEFAULT_SERVER = 'autotest'
 
+# Number of hosts fetched by each RPC of AFE.iter_hosts().
+HOSTS_PAGE_SIZE = 1000
+
 
 def dump_object(header, obj):
     """
@@ -489,6 +492,26 @@ class AFE(RpcClient):
         return [Host(self, h) for h in hosts]
 
 
+    def iter_hosts(self, page_size=HOSTS_PAGE_SIZE, **dargs):
+        """Like get_hosts(), but fetches the hosts in pages.
+
+        Every page is a separate RPC, so that neither the server nor this
+        client have to hold all the hosts of a large fleet at once.
+
+        @param page_size: Number of hosts fetched by each RPC.
+        @param **dargs: Arguments to pass to get_hosts().
+        """
+        query_start = 0
+        while True:
+            hosts = self.get_hosts(sort_by=['id'], query_start=query_start,
+                                   query_limit=page_size, **dargs)
+            for host in hosts:
+                yield host
+            if len(hosts) < page_size:
+                return
+            query_start += page_size
+
+
     def get_hostnames(self, status=None, label=None, **dargs):
         """Like get_hosts() but returns hostnames instead of Host objects."""
         # This implementation can be replaced with a more efficient one
@@ -633,6 +656,21 @@ class AFE(RpcClient):
         return SpecialTask(self, task) if task else None
 
 
+    def get_host_status_tasks(self, host_ids, end_time):
+        """Get the status tasks of several hosts.
+
+        @param host_ids: Ids in the database of the hosts.
+        @param end_time: Time reference for the hosts' status.
+
+        @return A dict of SpecialTask objects, or None if no task was
+                found, by host id.  Invalid hosts are left out.
+        """
+        tasks = self.run('get_host_status_tasks',
+                         host_ids=host_ids, end_time=end_time)
+        return {t['host_id']: SpecialTask(self, t['task']) if t['task']
+                else None for t in tasks}
+
+
     def get_host_diagnosis_interval(self, host_id, end_time, success):
         return self.run('get_host_diagnosis_interval',
                         host_id=host_id, end_time=end_time,
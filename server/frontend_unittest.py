@@ -57,5 +57,24 @@ class CrosVersionFormatTestCase(unittest.TestCase):
         self.assertIn(test_version, image_name)
 
 
+class IterHostsTest(unittest.TestCase):
+    def test_hosts_are_fetched_in_pages(self):
+        calls = []
+        def run(call, **dargs):
+            calls.append(dargs)
+            start = dargs['query_start']
+            return [{'id': i, 'hostname': 'host%d' % i}
+                    for i in range(5)[start:start + dargs['query_limit']]]
+
+        # Skip the constructor, which connects to the server.
+        afe = frontend.AFE.__new__(frontend.AFE)
+        afe.run = run
+        hosts = list(afe.iter_hosts(page_size=2, status='Ready'))
+        self.assertEqual([host.id for host in hosts], range(5))
+        self.assertEqual([c['query_start'] for c in calls], [0, 2, 4])
+        self.assertEqual(calls[0]['status'], 'Ready')
+        self.assertEqual(calls[0]['sort_by'], ['id'])
+
+
 if __name__ == '__main__':
     unittest.main()
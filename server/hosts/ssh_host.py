@@ -17,9 +17,11 @@ import time
 
 import common
 from autotest_lib.client.common_lib import error
+from autotest_lib.client.common_lib import global_config
 from autotest_lib.client.common_lib import pxssh
 from autotest_lib.server import utils
 from autotest_lib.server.hosts import abstract_ssh
+from autotest_lib.server.hosts import ssh_shell
 
 # In case cros_host is being ran via SSP on an older Moblab version with an
 # older chromite version.
@@ -28,6 +30,11 @@ try:
 except ImportError:
     metrics = utils.metrics_mock
 
+# Run commands in a long-lived remote shell, rather than with a new ssh
+# client each time, when possible.
+enable_persistent_shell = global_config.global_config.get_config_value(
+        'AUTOSERV', 'enable_persistent_ssh_shell', type=bool, default=False)
+
 
 class SSHHost(abstract_ssh.AbstractSSHHost):
     """
@@ -59,6 +66,7 @@ class SSHHost(abstract_ssh.AbstractSSHHost):
                 hostname: network hostname or address of remote machine
         """
         super(SSHHost, self)._initialize(hostname=hostname, *args, **dargs)
+        self._shell = None
         self.setup_ssh()
 
 
@@ -266,18 +274,69 @@ class SSHHost(abstract_ssh.AbstractSSHHost):
 
         if not ignore_status and result.exit_status > 0:
             counters_inc('run', 'final_run_error')
-            msg = result.stderr.strip()
-            if not msg:
-                msg = result.stdout.strip()
-                if msg:
-                    msg = msg.splitlines()[-1]
-            raise error.AutoservRunError("command execution error (%d): %s" %
-                                         (result.exit_status, msg), result)
+            raise _run_error(result)
 
         counters_inc('run', failure_name)
         return result
 
 
+    def _run_in_shell(self, command, timeout, ignore_status, stdout, stderr,
+                      env, args, ignore_timeout, ssh_failure_retry_ok):
+        """Run a command in the persistent shell of the host.
+
+        Same arguments and results as _run().
+
+        @raises ssh_shell.ShellError: if the command should be run with
+                _run() instead. The command was not run, or it may be run
+                again.
+        """
+        if self._shell is None:
+            # The ssh command is built again whenever the shell is started,
+            # as it depends on the master ssh connection.
+            self._shell = ssh_shell.PersistentShell(
+                    lambda: '%s "%s"' % (self.ssh_command(), utils.sh_escape(
+                            ssh_shell.LOGIN_SHELL_COMMAND)))
+        if env.strip():
+            command = "export %s; %s" % (env, command)
+        for arg in args:
+            command += ' "%s"' % utils.sh_escape(arg)
+
+        start_time = time.time()
+        result = utils.CmdResult(command)
+        try:
+            result.exit_status, result.stdout, result.stderr = (
+                    self._shell.run(command, timeout))
+        except ssh_shell.ShellTimeoutError as e:
+            # The command used up its time, so it isn't retried.
+            if ignore_timeout:
+                return None
+            raise error.CmdTimeoutError(command, result, str(e))
+        except ssh_shell.ShellClosedError as e:
+            if ssh_failure_retry_ok:
+                # The command may be run again, _run() will retry it.
+                raise ssh_shell.ShellError(str(e))
+            # Like a plain ssh client losing its connection.
+            result.exit_status = 255
+            result.stderr = str(e)
+        result.duration = time.time() - start_time
+        metrics.Counter('chromeos/autotest/ssh/shell_runs').increment(
+                fields={'exit_status': result.exit_status})
+
+        stdout_tee = utils.get_stream_tee_file(stdout,
+                                               utils.DEFAULT_STDOUT_LEVEL)
+        stderr_tee = utils.get_stream_tee_file(
+                stderr, utils.get_stderr_level(ignore_status))
+        for tee, data in ((stdout_tee, result.stdout),
+                          (stderr_tee, result.stderr)):
+            if tee:
+                tee.write(data)
+                tee.flush()
+
+        if not ignore_status and result.exit_status > 0:
+            raise _run_error(result)
+        return result
+
+
     def run_very_slowly(self, command, timeout=None, ignore_status=False,
             stdout_tee=utils.TEE_TO_LOGS, stderr_tee=utils.TEE_TO_LOGS,
             connect_timeout=30, options='', stdin=None, verbose=True, args=(),
@@ -325,6 +384,17 @@ class SSHHost(abstract_ssh.AbstractSSHHost):
             env = " ".join("=".join(pair) for pair in self.env.iteritems())
             elapsed = time.time() - start_time
             try:
+                # The shell doesn't take ssh options, nor stdin.
+                if enable_persistent_shell and not options and stdin is None:
+                    try:
+                        return self._run_in_shell(
+                                command, timeout - elapsed, ignore_status,
+                                stdout_tee, stderr_tee, env, args,
+                                ignore_timeout, ssh_failure_retry_ok)
+                    except ssh_shell.ShellError as e:
+                        logging.debug('Not using the persistent shell: %s',
+                                      e)
+                        elapsed = time.time() - start_time
                 return self._run(command, timeout - elapsed, ignore_status,
                                  stdout_tee, stderr_tee, connect_timeout, env,
                                  options, stdin, args, ignore_timeout,
@@ -341,6 +411,13 @@ class SSHHost(abstract_ssh.AbstractSSHHost):
     run = run_very_slowly
 
 
+    def close(self):
+        """Close the persistent shell, and the connections to the host."""
+        if self._shell:
+            self._shell.close()
+        super(SSHHost, self).close()
+
+
     def run_background(self, command, verbose=True):
         """Start a command on the host in the background.
 
@@ -495,3 +572,19 @@ class SSHHost(abstract_ssh.AbstractSSHHost):
                 self.ssh_ping()
             except error.AutoservSshPingHostError:
                 self.setup_ssh_key()
+
+
+def _run_error(result):
+    """Build the error for a command which failed on the host.
+
+    @param result: The CmdResult of the command.
+
+    @returns An AutoservRunError.
+    """
+    msg = result.stderr.strip()
+    if not msg:
+        msg = result.stdout.strip()
+        if msg:
+            msg = msg.splitlines()[-1]
+    return error.AutoservRunError("command execution error (%d): %s" %
+                                  (result.exit_status, msg), result)
@@ -0,0 +1,225 @@
+# Copyright 2019 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""A long-lived remote shell, to run many commands over one ssh session.
+
+Every command run through a plain ssh client costs a fork/exec and a new
+session, even over a master connection. PersistentShell starts a single
+shell on the remote host, and runs the commands through its stdin. The
+shell is the login shell of the user, which ssh runs commands with, so that
+commands behave the same as through a plain ssh client.
+
+Each command runs in a subshell, so that `cd`, `exit` or variables don't
+leak into the next one, with its stdin from /dev/null. After it, the shell
+prints a marker unique to the command, followed by the exit status, on
+stdout, and the same marker on stderr. The output of the command is what
+comes before the markers.
+"""
+
+import errno
+import os
+import select
+import subprocess
+import threading
+import time
+import uuid
+
+import common
+from autotest_lib.client.common_lib import utils
+
+# Remote command replacing the shell ssh runs it with by a new instance of the
+# same shell, reading commands from stdin. sshd sets SHELL to the login shell.
+LOGIN_SHELL_COMMAND = 'exec "${SHELL:-/bin/sh}"'
+
+# Timeout in seconds to wait for a new shell to answer its first command.
+_START_TIMEOUT_S = 30
+
+_READ_SIZE = 64 * 1024
+
+# Runs a command, then prints the markers. The command is quoted, so that
+# it can span several lines.
+_REQUEST_TEMPLATE = ("( eval %(command)s ) </dev/null; "
+                     "printf '%%s %%d\\n' %(marker)s $?; "
+                     "printf '%%s\\n' %(marker)s >&2\n")
+
+
+class ShellError(Exception):
+    """The shell can't be used; the command was not run."""
+
+
+class ShellClosedError(Exception):
+    """The shell went away while running a command."""
+
+
+class ShellTimeoutError(Exception):
+    """A command did not complete in time. The shell was closed."""
+
+
+class PersistentShell(object):
+    """A shell kept running to run several commands.
+
+    The shell is started on first use, and started again after it was
+    closed. It can only be used by one thread at a time, and only by the
+    process which started it.
+    """
+
+    def __init__(self, get_shell_command):
+        """
+        @param get_shell_command: Function returning the local command which
+                starts the shell, e.g. an ssh command running
+                LOGIN_SHELL_COMMAND on the remote host. It is called
+                whenever the shell is started.
+        """
+        self._get_shell_command = get_shell_command
+        self._proc = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+
+    def __del__(self):
+        self.close()
+
+
+    def _start(self):
+        """Start the shell, and check that it runs commands.
+
+        @raises ShellError: if the shell could not be started.
+        """
+        self._proc = subprocess.Popen(
+                self._get_shell_command(), shell=True, executable='/bin/bash',
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, close_fds=True)
+        self._pid = os.getpid()
+        try:
+            exit_status, _, _ = self._run_locked('true', _START_TIMEOUT_S)
+        except (ShellClosedError, ShellTimeoutError) as e:
+            self.close()
+            raise ShellError('Failed to start shell: %s' % e)
+        if exit_status != 0:
+            self.close()
+            raise ShellError('Shell failed to run true: %d' % exit_status)
+
+
+    def close(self):
+        """Terminate the shell, if it is running."""
+        proc, self._proc = self._proc, None
+        if not proc or self._pid != os.getpid():
+            return
+        for pipe in (proc.stdin, proc.stdout, proc.stderr):
+            pipe.close()
+        utils.nuke_subprocess(proc)
+
+
+    def run(self, command, timeout):
+        """Run a command in the shell.
+
+        @param command: The shell command line.
+        @param timeout: Time limit in seconds. On timeout, the shell is
+                closed, which makes the remote host hang up the command.
+
+        @returns A (exit_status, stdout, stderr) tuple.
+
+        @raises ShellError: if the shell can't be used, in which case the
+                command was not run. This happens when the shell could not
+                be started or be sent the command, or when it is in use by
+                another thread.
+        @raises ShellClosedError: if the shell exited while running the
+                command, e.g. because the connection was lost.
+        @raises ShellTimeoutError: if the command did not complete in time.
+        """
+        if not self._lock.acquire(False):
+            raise ShellError('Shell is in use by another thread')
+        try:
+            if self._proc and self._pid != os.getpid():
+                # The pipes belong to the parent process.
+                self._proc = None
+            if self._proc and self._proc.poll() is not None:
+                self.close()
+            if not self._proc:
+                self._start()
+            try:
+                return self._run_locked(command, timeout)
+            except (ShellClosedError, ShellTimeoutError):
+                self.close()
+                raise
+        finally:
+            self._lock.release()
+
+
+    def _run_locked(self, command, timeout):
+        """Send a command to the shell, and wait for its markers.
+
+        @param command: The shell command line.
+        @param timeout: Time limit in seconds.
+
+        @returns A (exit_status, stdout, stderr) tuple.
+        """
+        marker = '__AUTOTEST_SHELL_%s__' % uuid.uuid4().hex
+        request = _REQUEST_TEMPLATE % {
+                'command': utils.sh_quote_word(command),
+                'marker': marker,
+        }
+        try:
+            self._proc.stdin.write(request)
+            self._proc.stdin.flush()
+        except IOError as e:
+            # The command was not sent, so it did not run.
+            self.close()
+            raise ShellError('Failed to send command: %s' % e)
+
+        stdout_end = '%s ' % marker
+        stderr_end = '%s\n' % marker
+        outputs = {self._proc.stdout.fileno(): [],
+                   self._proc.stderr.fileno(): []}
+        tails = {self._proc.stdout.fileno(): '',
+                 self._proc.stderr.fileno(): ''}
+        poller = select.poll()
+        for fd in outputs:
+            poller.register(fd, select.POLLIN | select.POLLPRI)
+        pending = set(outputs)
+        deadline = time.time() + timeout
+
+        while pending:
+            time_left = deadline - time.time()
+            if time_left <= 0:
+                raise ShellTimeoutError(
+                        'Command did not complete within %d seconds' %
+                        timeout)
+            try:
+                events = poller.poll(time_left * 1000)
+            except select.error as e:
+                if e[0] == errno.EINTR:
+                    continue
+                raise
+            for fd, _ in events:
+                data = os.read(fd, _READ_SIZE)
+                if not data:
+                    raise ShellClosedError(
+                            'Shell exited: %s' % self._error_output(outputs))
+                outputs[fd].append(data)
+                # Only look for the marker in the tail of the output, so
+                # that chatty commands don't make this quadratic.
+                tail = tails[fd] + data
+                tails[fd] = tail[-2 * len(stdout_end) - 16:]
+                if fd == self._proc.stdout.fileno():
+                    done = stdout_end in tail and tail.endswith('\n')
+                else:
+                    done = tail.endswith(stderr_end)
+                if done:
+                    pending.discard(fd)
+                    poller.unregister(fd)
+
+        stdout = ''.join(outputs[self._proc.stdout.fileno()])
+        stderr = ''.join(outputs[self._proc.stderr.fileno()])
+        stdout, status = stdout.rsplit(stdout_end, 1)
+        stderr = stderr[:-len(stderr_end)]
+        return int(status), stdout, stderr
+
+
+    def _error_output(self, outputs):
+        """Return what the shell wrote to stderr, to explain its failure.
+
+        @param outputs: Dict of the output read so far, by file descriptor.
+        """
+        return ''.join(outputs[self._proc.stderr.fileno()]).strip()
@@ -0,0 +1,110 @@
+#!/usr/bin/python2
+# Copyright 2019 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import unittest
+
+import common
+
+from autotest_lib.client.common_lib import utils
+from autotest_lib.server.hosts import ssh_shell
+
+
+class PersistentShellTest(unittest.TestCase):
+    """Tests for PersistentShell, with a local shell."""
+
+    def setUp(self):
+        self.shell = ssh_shell.PersistentShell(lambda: '/bin/sh')
+
+
+    def tearDown(self):
+        self.shell.close()
+
+
+    def test_output_and_status(self):
+        """Test that stdout, stderr and the exit status are separated."""
+        self.assertEqual(
+                self.shell.run('echo out; echo err >&2; exit 3', 10),
+                (3, 'out\n', 'err\n'))
+
+
+    def test_output_without_newline(self):
+        """Test output which doesn't end with a newline."""
+        self.assertEqual(self.shell.run('printf out', 10), (0, 'out', ''))
+
+
+    def test_large_output(self):
+        """Test output larger than a pipe buffer."""
+        status, stdout, _ = self.shell.run('yes | head -c 1000000', 10)
+        self.assertEqual((status, stdout), (0, 'y\n' * 500000))
+
+
+    def test_multiline_command(self):
+        """Test a command spanning several lines, with quotes."""
+        self.assertEqual(self.shell.run("echo 'a'\necho \"b\"", 10),
+                         (0, 'a\nb\n', ''))
+
+
+    def test_commands_are_isolated(self):
+        """Test that a command doesn't change the shell for the next one."""
+        self.shell.run('cd /; FOO=bar; exit 1', 10)
+        self.assertEqual(self.shell.run('echo "$FOO"', 10), (0, '\n', ''))
+
+
+    def test_timeout(self):
+        """Test that a timeout closes the shell, which is then restarted."""
+        self.assertRaises(ssh_shell.ShellTimeoutError,
+                          self.shell.run, 'sleep 10', 0.5)
+        self.assertEqual(self.shell.run('echo ok', 10), (0, 'ok\n', ''))
+
+
+    def test_shell_exits(self):
+        """Test a command making the shell exit."""
+        self.assertRaises(ssh_shell.ShellClosedError,
+                          self.shell.run, 'kill -9 $$', 10)
+        self.assertEqual(self.shell.run('echo ok', 10), (0, 'ok\n', ''))
+
+
+    def test_start_failure(self):
+        """Test a shell which fails to start."""
+        shell = ssh_shell.PersistentShell(lambda: 'exit 255')
+        self.assertRaises(ssh_shell.ShellError, shell.run, 'true', 10)
+
+
+class LoginShellTest(unittest.TestCase):
+    """Tests for LOGIN_SHELL_COMMAND, run like sshd runs it."""
+
+    _BASH_COMMAND = 'a=(x y); [[ ${a[1]} == y ]] && echo ok'
+
+    def _run(self, login_shell, command):
+        """Run a command in the persistent shell of a login shell.
+
+        @param login_shell: Path of the login shell.
+        @param command: The command to run in the persistent shell.
+        """
+        # sshd runs remote commands with the login shell, set in SHELL.
+        shell = ssh_shell.PersistentShell(
+                lambda: 'SHELL=%s %s -c "%s"' % (
+                        login_shell, login_shell,
+                        utils.sh_escape(ssh_shell.LOGIN_SHELL_COMMAND)))
+        try:
+            return shell.run(command, 10)
+        finally:
+            shell.close()
+
+
+    def test_bash_login_shell(self):
+        """Test that bash constructs run when the login shell is bash."""
+        self.assertEqual(self._run('/bin/bash', self._BASH_COMMAND),
+                         (0, 'ok\n', ''))
+
+
+    def test_sh_login_shell(self):
+        """Test that the shell is the login shell, rather than bash."""
+        self.assertEqual(self._run('/bin/sh', 'echo ${BASH_VERSION:-sh}'),
+                         (0, 'sh\n', ''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -35,6 +35,10 @@ the logs explaining a failure or repair event.
 """
 
 import common
+import collections
+import json
+import logging
+import operator
 import os
 from autotest_lib.frontend import setup_django_environment
 from django.db import models as django_models
@@ -44,6 +48,7 @@ from autotest_lib.client.common_lib import utils
 from autotest_lib.client.common_lib import time_utils
 from autotest_lib.frontend.afe import models as afe_models
 from autotest_lib.server import constants
+from autotest_lib.server import frontend
 
 
 # Values used to describe the diagnosis of a DUT.  These values are
@@ -76,6 +81,11 @@ status_names = {
 }
 
 
+# Number of hosts whose history is fetched by a single query of a
+# `HistoryLoader`.
+_HOSTS_PER_QUERY = 100
+
+
 def parse_time(time_string):
     """Parse time according to a canonical form.
 
@@ -87,6 +97,15 @@ def parse_time(time_string):
     return int(time_utils.to_epoch_time(time_string))
 
 
+def _chunks(host_ids):
+    """Split a list of host ids in lists of `_HOSTS_PER_QUERY` ids.
+
+    @param host_ids List of database host ids.
+    """
+    for i in xrange(0, len(host_ids), _HOSTS_PER_QUERY):
+        yield host_ids[i:i + _HOSTS_PER_QUERY]
+
+
 class _JobEvent(object):
     """Information about an event in host history.
 
@@ -406,6 +425,262 @@ class _TestJobEvent(_JobEvent):
         return False
 
 
+class HistoryLoader(object):
+    """Class to query the histories of many DUTs together.
+
+    A `HostJobHistory` queries the AFE for its own DUT only.  The
+    `HostJobHistory` objects created with the same `HistoryLoader`
+    share its queries instead:  the first time one of them needs its
+    events or its status task, the loader fetches them for all the
+    DUTs registered with it, `_HOSTS_PER_QUERY` DUTs per query.
+
+    The events loaded for a DUT are remembered with the time window
+    they cover.  Loading a later window overlapping it only queries
+    the events that finished since the end of the loaded window.  The
+    loaded events can be saved to a cache file, so that the next run
+    of a command is incremental, too.
+
+    @property _afe          Autotest frontend for queries.
+    @property _cache_file   Path of the file to save loaded events to,
+                            or `None`.
+    @property _host_ids     Database host ids of the registered DUTs.
+    @property _windows      Loaded events by host id.  Each value is a
+                            dict with the `start_time` and `end_time`
+                            of the window, and the raw RPC results for
+                            the special `tasks` and the `hqes` that ran
+                            in it, by id.
+    @property _status_tasks Loaded status tasks by host id, as
+                            `(end_time, task)` tuples.
+
+    """
+
+    def __init__(self, afe, cache_file=None):
+        self._afe = afe
+        self._cache_file = cache_file
+        self._host_ids = []
+        self._windows = {}
+        self._status_tasks = {}
+        if cache_file is not None:
+            self._read_cache_file()
+
+
+    def _read_cache_file(self):
+        """Fill in `self._windows` from the cache file."""
+        try:
+            with open(self._cache_file) as f:
+                cache = json.load(f)
+        except (IOError, ValueError) as e:
+            logging.info('Ignoring history cache %s: %s',
+                         self._cache_file, e)
+            return
+        if cache.get('server') != self._afe.server:
+            return
+        for host_id, window in cache['windows'].iteritems():
+            self._windows[int(host_id)] = {
+                'start_time': window['start_time'],
+                'end_time': window['end_time'],
+                'tasks': {t['id']: t for t in window['tasks']},
+                'hqes': {e['id']: e for e in window['hqes']},
+            }
+
+
+    def save(self):
+        """Write the loaded events to the cache file, if there is one."""
+        if self._cache_file is None:
+            return
+        windows = {}
+        for host_id, window in self._windows.iteritems():
+            windows[host_id] = {
+                'start_time': window['start_time'],
+                'end_time': window['end_time'],
+                'tasks': window['tasks'].values(),
+                'hqes': window['hqes'].values(),
+            }
+        tmp_path = self._cache_file + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'server': self._afe.server, 'windows': windows}, f)
+        os.rename(tmp_path, self._cache_file)
+
+
+    def add_host(self, host_id):
+        """Register a DUT, to be loaded along with the others.
+
+        @param host_id     Database host id of the DUT.
+
+        """
+        self._host_ids.append(host_id)
+
+
+    def _covers(self, host_id, start_time, end_time):
+        """Return whether the loaded events of a DUT cover a window.
+
+        @param host_id     Database host id of the DUT.
+        @param start_time  Start time of the window.
+        @param end_time    End time of the window.
+
+        """
+        window = self._windows.get(host_id)
+        return (window is not None and
+                window['start_time'] <= start_time and
+                end_time <= window['end_time'])
+
+
+    def load_histories(self, host_ids, start_time, end_time):
+        """Load the special tasks and HQEs of DUTs in a time range.
+
+        DUTs whose loaded events already cover the range are skipped.
+        DUTs whose loaded events end inside the range only get the
+        events finished since.
+
+        @param host_ids    Database host ids of the DUTs.
+        @param start_time  Start time of the range of interest.
+        @param end_time    End time of the range of interest.
+
+        """
+        # DUTs are grouped by the end of their loaded window, where
+        # their new events start.  DUTs loaded from scratch are grouped
+        # under `None`.
+        groups = collections.defaultdict(list)
+        for host_id in host_ids:
+            window = self._windows.get(host_id)
+            if (window is None or window['start_time'] > start_time or
+                    window['end_time'] < start_time):
+                groups[None].append(host_id)
+            elif window['end_time'] < end_time:
+                groups[window['end_time']].append(host_id)
+        for loaded_end, group in groups.iteritems():
+            for chunk in _chunks(group):
+                self._load_chunk(chunk, start_time, end_time, loaded_end)
+
+
+    def _load_chunk(self, host_ids, start_time, end_time, loaded_end):
+        """Load the events of up to `_HOSTS_PER_QUERY` DUTs.
+
+        @param host_ids    Database host ids of the DUTs.
+        @param start_time  Start time of the range of interest.
+        @param end_time    End time of the range of interest.
+        @param loaded_end  End time of the events already loaded for
+                           all the DUTs, or `None` to load them from
+                           scratch.
+
+        """
+        query_start = time_utils.epoch_time_to_date_string(start_time)
+        query_end = time_utils.epoch_time_to_date_string(end_time)
+        task_filter = {'time_started__gte': query_start,
+                       'time_finished__lte': query_end,
+                       'is_complete': 1}
+        hqe_filter = {'insert_time_after': query_start,
+                      'insert_time_before': query_end,
+                      'started_on__gte': query_start,
+                      'started_on__lte': query_end,
+                      'complete': 1}
+        if loaded_end is not None:
+            query_loaded_end = time_utils.epoch_time_to_date_string(
+                    loaded_end)
+            task_filter['time_finished__gt'] = query_loaded_end
+            hqe_filter['finished_on__gt'] = query_loaded_end
+        # The raw RPC results are kept, so that they can be saved.
+        tasks = self._afe.run('get_special_tasks_for_hosts',
+                              host_ids=host_ids, **task_filter)
+        hqes = self._afe.run('get_host_queue_entries_by_insert_time',
+                             host_id__in=host_ids, **hqe_filter)
+
+        for host_id in host_ids:
+            window = self._windows.get(host_id)
+            if loaded_end is None or window is None:
+                window = self._windows[host_id] = {'tasks': {}, 'hqes': {}}
+            else:
+                # Forget the events which started before the new range.
+                for task_id, task in window['tasks'].items():
+                    if parse_time(task['time_started']) < start_time:
+                        del window['tasks'][task_id]
+                for hqe_id, hqe in window['hqes'].items():
+                    if parse_time(hqe['started_on']) < start_time:
+                        del window['hqes'][hqe_id]
+            window['start_time'] = start_time
+            window['end_time'] = end_time
+        # An HQE can be returned again, if it finished after the end
+        # of the loaded window, but was already complete when loaded.
+        for task in tasks:
+            self._windows[task['host']['id']]['tasks'][task['id']] = task
+        for hqe in hqes:
+            self._windows[hqe['host']['id']]['hqes'][hqe['id']] = hqe
+
+
+    def get_history(self, host_id, start_time, end_time):
+        """Return the events of a DUT in a time range.
+
+        If the events of the DUT in the range aren't loaded, they are
+        loaded along with those of all the registered DUTs.
+
+        @param host_id     Database host id of the DUT.
+        @param start_time  Start time of the range of interest.
+        @param end_time    End time of the range of interest.
+
+        @return A list of `_JobEvent` objects, ordered from latest to
+                earliest.
+
+        """
+        if not self._covers(host_id, start_time, end_time):
+            host_ids = [h for h in self._host_ids
+                        if not self._covers(h, start_time, end_time)]
+            if host_id not in host_ids:
+                host_ids.append(host_id)
+            self.load_histories(host_ids, start_time, end_time)
+        window = self._windows[host_id]
+        history = ([_SpecialTaskEvent(frontend.SpecialTask(self._afe, t))
+                    for t in window['tasks'].itervalues()] +
+                   [_TestJobEvent(frontend.JobStatus(self._afe, e))
+                    for e in window['hqes'].itervalues()])
+        # The loaded window may be larger than the range of interest.
+        history = [event for event in history
+                   if start_time <= event.start_time <= end_time and
+                   (not event.is_special or event.end_time <= end_time)]
+        history.sort(reverse=True)
+        return history
+
+
+    def load_status_tasks(self, host_ids, end_time):
+        """Load the status tasks of DUTs at a given time.
+
+        @param host_ids    Database host ids of the DUTs.
+        @param end_time    Find status as of this time.
+
+        """
+        query_end = time_utils.epoch_time_to_date_string(end_time)
+        for chunk in _chunks(host_ids):
+            tasks = self._afe.get_host_status_tasks(chunk, query_end)
+            for host_id, task in tasks.iteritems():
+                task = _SpecialTaskEvent(task) if task else None
+                self._status_tasks[host_id] = (end_time, task)
+
+
+    def get_status_task(self, host_id, end_time):
+        """Return the task indicating a DUT's status at a given time.
+
+        If the status task of the DUT isn't loaded, it is loaded along
+        with those of all the registered DUTs.  A DUT that the bulk
+        query doesn't know about (e.g. an invalid host) is queried on
+        its own, so that the caller gets the same error as without a
+        loader.
+
+        @param host_id     Database host id of the DUT.
+        @param end_time    Find status as of this time.
+
+        @return A `_SpecialTaskEvent` object for the requested task,
+                or `None` if no task was found.
+
+        """
+        loaded = lambda h: self._status_tasks.get(h, (None,))[0] == end_time
+        if not loaded(host_id):
+            self.load_status_tasks(
+                    [h for h in self._host_ids if not loaded(h)], end_time)
+        if not loaded(host_id):
+            return _SpecialTaskEvent.get_status_task(
+                    self._afe, host_id, end_time)
+        return self._status_tasks[host_id][1]
+
+
 class HostJobHistory(object):
     """Class to query and remember DUT execution and status history.
 
@@ -420,6 +695,8 @@ class HostJobHistory(object):
     @property end_time    End of the requested time interval, as a unix
                           timestamp (epoch time).
     @property _afe        Autotest frontend for queries.
+    @property _loader     `HistoryLoader` sharing the queries of this
+                          history with others, or `None`.
     @property _host       Database host object for the DUT.
     @property _history    A list of jobs and special tasks that
                           ran on the DUT in the requested time
@@ -438,7 +715,8 @@ class HostJobHistory(object):
     """
 
     @classmethod
-    def get_host_history(cls, afe, hostname, start_time, end_time):
+    def get_host_history(cls, afe, hostname, start_time, end_time,
+                         loader=None):
         """Create a `HostJobHistory` instance for a single host.
 
         Simple factory method to construct host history from a
@@ -450,18 +728,23 @@ class HostJobHistory(object):
         @param start_time  Start time for the history's time
                            interval.
         @param end_time    End time for the history's time interval.
+        @param loader      `HistoryLoader` to share queries with, or
+                           `None`.
 
         @return A new `HostJobHistory` instance.
 
         """
         afehost = afe.get_hosts(hostname=hostname)[0]
-        return cls(afe, afehost, start_time, end_time)
+        return cls(afe, afehost, start_time, end_time, loader)
 
 
     @classmethod
-    def get_multiple_histories(cls, afe, start_time, end_time, labels=()):
+    def get_multiple_histories(cls, afe, start_time, end_time, labels=(),
+                               loader=None):
         """Create `HostJobHistory` instances for a set of hosts.
 
+        The histories share their queries through a `HistoryLoader`.
+
         @param afe         Autotest frontend
         @param start_time  Start time for the history's time
                            interval.
@@ -469,6 +752,8 @@ class HostJobHistory(object):
         @param labels      type: [str]. AFE labels to constrain the host query.
                            This option must be non-empty. An unconstrained
                            search of the DB is too costly.
+        @param loader      `HistoryLoader` to share queries with.  By
+                           default, a new one is used.
 
         @return A list of new `HostJobHistory` instances.
 
@@ -477,17 +762,22 @@ class HostJobHistory(object):
             'Must specify labels for get_multiple_histories. '
             'Unconstrainted search of the database is prohibitively costly.')
 
+        if loader is None:
+            loader = HistoryLoader(afe)
         kwargs = {'multiple_labels': labels}
         hosts = afe.get_hosts(**kwargs)
-        return [cls(afe, h, start_time, end_time) for h in hosts]
+        return [cls(afe, h, start_time, end_time, loader) for h in hosts]
 
 
-    def __init__(self, afe, afehost, start_time, end_time):
+    def __init__(self, afe, afehost, start_time, end_time, loader=None):
         self._afe = afe
+        self._loader = loader
         self.hostname = afehost.hostname
         self.end_time = end_time
         self.start_time = start_time
         self._host = afehost
+        if loader is not None:
+            loader.add_host(afehost.id)
         # Don't spend time on queries until they're needed.
         self._history = None
         self._status_interval = None
@@ -508,8 +798,12 @@ class HostJobHistory(object):
 
     def __iter__(self):
         if self._history is None:
-            self._history = self._get_history(self.start_time,
-                                              self.end_time)
+            if self._loader is not None:
+                self._history = self._loader.get_history(
+                        self._host.id, self.start_time, self.end_time)
+            else:
+                self._history = self._get_history(self.start_time,
+                                                  self.end_time)
         return self._history.__iter__()
 
 
@@ -550,8 +844,12 @@ class HostJobHistory(object):
         """Fill in `self._status_diagnosis` and `_status_task`."""
         if self._status_diagnosis is not None:
             return
-        self._status_task = _SpecialTaskEvent.get_status_task(
-                self._afe, self._host.id, self.end_time)
+        if self._loader is not None:
+            self._status_task = self._loader.get_status_task(
+                    self._host.id, self.end_time)
+        else:
+            self._status_task = _SpecialTaskEvent.get_status_task(
+                    self._afe, self._host.id, self.end_time)
         if self._status_task is not None:
             self._status_diagnosis = self._status_task.diagnosis
         else:
@@ -710,6 +1008,43 @@ def get_status_task(host_id, end_time):
             is_complete=True).order_by('time_started').reverse()[0:1]
 
 
+def get_status_tasks(host_ids, end_time):
+    """Get the last status tasks of several hosts before a given time.
+
+    This is the bulk version of `get_status_task()`:  one query finds
+    the start time of the last status task of every host, and the
+    returned Django query selects the tasks that started then.  A
+    host may have more than one such task, if they started at the
+    same time.
+
+    This is the RPC endpoint for `HistoryLoader.load_status_tasks()`.
+
+    @param host_ids    Database host ids of the desired hosts.
+    @param end_time    End time of the range of interest.
+
+    @return A Django query-set selecting the special tasks of
+            interest.
+
+    """
+    status_tasks = (django_models.Q(task='Repair') |
+                    django_models.Q(success=True))
+    query = afe_models.SpecialTask.objects.filter(
+            status_tasks,
+            host_id__in=host_ids,
+            time_finished__lte=end_time,
+            is_complete=True)
+    # Clear the default ordering, so that it isn't added to the
+    # GROUP BY clause.
+    latest = query.order_by().values('host').annotate(
+            latest_start=django_models.Max('time_started'))
+    selected = [django_models.Q(host=row['host'],
+                                time_started=row['latest_start'])
+                for row in latest]
+    if not selected:
+        return query.none()
+    return query.filter(reduce(operator.or_, selected))
+
+
 def _get_job_logdir(job):
     """Gets the logdir for an AFE job.
 
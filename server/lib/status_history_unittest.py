@@ -0,0 +1,227 @@
+#!/usr/bin/python2
+# Copyright 2019 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import common
+from autotest_lib.frontend import setup_django_environment
+from autotest_lib.frontend import setup_test_environment
+from autotest_lib.client.common_lib import time_utils
+from autotest_lib.server.lib import status_history
+
+
+# An arbitrary time, so that events have plausible times.
+_BASE_TIME = 1500000000
+
+
+def _time_string(offset):
+    """Return the AFE time string of a time after `_BASE_TIME`.
+
+    @param offset  Seconds after `_BASE_TIME`.
+    """
+    return time_utils.epoch_time_to_date_string(_BASE_TIME + offset)
+
+
+def _host(host_id):
+    """Return the RPC result for a host."""
+    return {'id': host_id, 'hostname': 'host%d' % host_id}
+
+
+def _task(task_id, host_id, started, finished):
+    """Return the RPC result for a successful special task.
+
+    @param task_id   Id of the task.
+    @param host_id   Id of the host of the task.
+    @param started   Start time of the task, after `_BASE_TIME`.
+    @param finished  End time of the task, after `_BASE_TIME`.
+    """
+    return {'id': task_id, 'host': _host(host_id), 'task': 'Verify',
+            'time_started': _time_string(started),
+            'time_finished': _time_string(finished),
+            'success': True, 'is_aborted': False}
+
+
+def _hqe(hqe_id, host_id, started, finished):
+    """Return the RPC result for a completed HQE.
+
+    @param hqe_id    Id of the HQE, and of its job.
+    @param host_id   Id of the host of the HQE.
+    @param started   Start time of the HQE, after `_BASE_TIME`.
+    @param finished  End time of the HQE, after `_BASE_TIME`.
+    """
+    return {'id': hqe_id, 'host': _host(host_id),
+            'job': {'id': hqe_id, 'name': 'job%d' % hqe_id},
+            'started_on': _time_string(started),
+            'finished_on': _time_string(finished),
+            'status': 'Completed'}
+
+
+class _FakeAFE(object):
+    """AFE answering the queries of `HistoryLoader` from lists of events.
+
+    @property server  Name of the AFE server.
+    @property tasks   Special tasks, as RPC results.
+    @property hqes    HQEs, as RPC results.
+    @property calls   `(rpc name, arguments)` tuples of the RPCs run.
+    """
+
+    def __init__(self, server='afe'):
+        self.server = server
+        self.tasks = []
+        self.hqes = []
+        self.calls = []
+
+
+    def run(self, call, **dargs):
+        """Answer an RPC, applying the filters used by `HistoryLoader`."""
+        self.calls.append((call, dargs))
+        if call == 'get_special_tasks_for_hosts':
+            return [t for t in self.tasks
+                    if t['host']['id'] in dargs['host_ids'] and
+                    t['time_started'] >= dargs['time_started__gte'] and
+                    t['time_finished'] <= dargs['time_finished__lte'] and
+                    t['time_finished'] > dargs.get('time_finished__gt', '')]
+        if call == 'get_host_queue_entries_by_insert_time':
+            return [e for e in self.hqes
+                    if e['host']['id'] in dargs['host_id__in'] and
+                    dargs['started_on__gte'] <= e['started_on'] and
+                    e['started_on'] <= dargs['started_on__lte'] and
+                    e['finished_on'] > dargs.get('finished_on__gt', '')]
+        raise ValueError('Unexpected RPC %s' % call)
+
+
+class HistoryLoaderTests(unittest.TestCase):
+    """Tests for `HistoryLoader`."""
+
+    def setUp(self):
+        self._afe = _FakeAFE()
+        self._loader = status_history.HistoryLoader(self._afe)
+        self._saved_hosts_per_query = status_history._HOSTS_PER_QUERY
+
+
+    def tearDown(self):
+        status_history._HOSTS_PER_QUERY = self._saved_hosts_per_query
+
+
+    def _load(self, host_ids, start, end):
+        """Load histories from `_BASE_TIME` offsets."""
+        self._loader.load_histories(host_ids, _BASE_TIME + start,
+                                    _BASE_TIME + end)
+
+
+    def _get_event_ids(self, loader, host_id, start, end):
+        """Return the ids of the history of a DUT, from `_BASE_TIME` offsets.
+
+        @return A list of `(is_special, id)` tuples, from latest to
+                earliest.
+        """
+        history = loader.get_history(host_id, _BASE_TIME + start,
+                                     _BASE_TIME + end)
+        return [(event.is_special, event.id) for event in history]
+
+
+    def _get_task_queries(self):
+        """Return the arguments of the special task queries."""
+        return [dargs for call, dargs in self._afe.calls
+                if call == 'get_special_tasks_for_hosts']
+
+
+    def test_load_histories_groups_hosts(self):
+        """Test that DUTs are queried together, in chunks."""
+        status_history._HOSTS_PER_QUERY = 2
+        self._load([1, 2, 3], 100, 200)
+        self.assertEqual([q['host_ids'] for q in self._get_task_queries()],
+                         [[1, 2], [3]])
+        self.assertEqual(len(self._afe.calls), 4)
+
+
+    def test_load_histories_skips_loaded_hosts(self):
+        """Test that DUTs whose events cover the range aren't queried."""
+        self._load([1, 2], 100, 300)
+        self._afe.calls = []
+        self._load([1, 2], 150, 250)
+        self.assertEqual(self._afe.calls, [])
+
+
+    def test_load_histories_delta_query(self):
+        """Test that a later window only queries the newer events."""
+        self._afe.tasks = [_task(1, 1, 110, 120)]
+        self._afe.hqes = [_hqe(1, 1, 130, 140)]
+        self._load([1, 2], 100, 200)
+        self._afe.tasks.append(_task(2, 1, 190, 210))
+        self._afe.hqes.append(_hqe(2, 1, 220, 230))
+        self._afe.calls = []
+
+        self._load([1, 2, 3], 100, 300)
+        task_queries = {tuple(dargs['host_ids']): dargs
+                        for call, dargs in self._afe.calls
+                        if call == 'get_special_tasks_for_hosts'}
+        hqe_queries = {tuple(dargs['host_id__in']): dargs
+                       for call, dargs in self._afe.calls
+                       if call == 'get_host_queue_entries_by_insert_time'}
+        self.assertEqual(sorted(task_queries), [(1, 2), (3,)])
+        self.assertEqual(sorted(hqe_queries), [(1, 2), (3,)])
+        self.assertNotIn('time_finished__gt', task_queries[(3,)])
+        self.assertNotIn('finished_on__gt', hqe_queries[(3,)])
+        self.assertEqual(task_queries[(1, 2)]['time_finished__gt'],
+                         _time_string(200))
+        self.assertEqual(hqe_queries[(1, 2)]['finished_on__gt'],
+                         _time_string(200))
+        self.assertEqual(self._get_event_ids(self._loader, 1, 100, 300),
+                         [(False, 2), (True, 2), (False, 1), (True, 1)])
+
+
+    def test_load_histories_drops_old_events(self):
+        """Test that events started before a new window are dropped."""
+        self._afe.tasks = [_task(1, 1, 110, 120), _task(2, 1, 160, 170)]
+        self._afe.hqes = [_hqe(1, 1, 130, 140), _hqe(2, 1, 180, 190)]
+        self._load([1], 100, 200)
+        self._load([1], 150, 300)
+        window = self._loader._windows[1]
+        self.assertEqual(sorted(window['tasks']), [2])
+        self.assertEqual(sorted(window['hqes']), [2])
+        self.assertEqual(
+                (window['start_time'], window['end_time']),
+                (_BASE_TIME + 150, _BASE_TIME + 300))
+
+
+    def test_load_histories_reloads_disjoint_window(self):
+        """Test that a window after the loaded one is loaded from scratch."""
+        self._afe.tasks = [_task(1, 1, 110, 120)]
+        self._load([1], 100, 200)
+        self._afe.calls = []
+        self._load([1], 250, 300)
+        self.assertNotIn('time_finished__gt', self._get_task_queries()[0])
+        self.assertEqual(self._loader._windows[1]['tasks'], {})
+
+
+    def test_cache_file_round_trip(self):
+        """Test that saved events are read back, and not queried again."""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        cache_file = os.path.join(cache_dir, 'cache.json')
+        self._afe.tasks = [_task(1, 1, 110, 120)]
+        self._afe.hqes = [_hqe(1, 1, 130, 140)]
+        saved_loader = status_history.HistoryLoader(self._afe, cache_file)
+        expected_ids = self._get_event_ids(saved_loader, 1, 100, 200)
+        saved_loader.save()
+
+        self._afe.calls = []
+        loader = status_history.HistoryLoader(self._afe, cache_file)
+        self.assertEqual(loader._windows, saved_loader._windows)
+        self.assertEqual(self._get_event_ids(loader, 1, 100, 200),
+                         expected_ids)
+        self.assertEqual(self._afe.calls, [])
+
+        # The cache of another AFE is ignored.
+        loader = status_history.HistoryLoader(_FakeAFE('other'), cache_file)
+        self.assertEqual(loader._windows, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
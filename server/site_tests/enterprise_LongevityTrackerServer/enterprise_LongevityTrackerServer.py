@@ -369,6 +369,7 @@ class enterprise_LongevityTrackerServer(test.test):
             # uploaded data at https://chromeperf.appspot.com/new_points,
             # with test path pattern=ChromeOS_Enterprise/cros-*/longevity*/*
             if perf_params['test_type'] == 'multiple_samples':
+                self.flush_perf_values()
                 chart_data = enterprise_longevity_helper.read_perf_results(
                         self.resultsdir, 'results-chart.json')
                 data_obj = self._format_data_for_upload(chart_data)
@@ -0,0 +1,230 @@
+# Copyright 2019 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Drone-wide cache of the package tarballs that autoserv builds for clients.
+
+When a client asks for a test, profiler or dep package which is not prebuilt,
+autoserv tars its source directory. The cache keeps these tarballs under a
+name derived from the hash of their source tree, so that each package is
+built once per source version, and reused by all the autoserv processes of
+the drone.
+
+The processes coordinate with a lock file in the cache directory. Tarballs
+are built outside of the lock and renamed into the cache, so that a slow
+build doesn't block the other processes. The least recently used tarballs
+are evicted when the cache grows over its maximum size. Processes get a hard
+link to a cached tarball, which stays valid if the tarball is evicted while
+they send it.
+
+The tarballs are installed on the DUTs, so the cache directory must only be
+writable by the user running autoserv.
+"""
+
+import contextlib
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import time
+
+import common
+from autotest_lib.client.common_lib import global_config
+from autotest_lib.client.common_lib import utils
+
+try:
+    from chromite.lib import metrics
+except ImportError:
+    metrics = utils.metrics_mock
+
+
+_CONFIG = global_config.global_config
+
+# Name of the lock file, in the cache directory.
+_LOCK_FILE = '.lock'
+
+# Prefix of the temporary directories tarballs are built in, in the cache
+# directory.
+_BUILD_DIR_PREFIX = '.build-'
+
+# Build directories older than this were left by killed processes.
+_STALE_BUILD_DIR_AGE_SECS = 24 * 60 * 60
+
+_METRICS_PREFIX = 'chromeos/autotest/autoserv/tarball_cache/'
+
+
+def hash_source_tree(src_dir, exclude_dirs=()):
+    """Compute the version of a source tree.
+
+    The version hashes the path, size and modification time of each file,
+    which is much cheaper than hashing their content.
+
+    @param src_dir: The root directory of the tree.
+    @param exclude_dirs: Top level directories to leave out.
+
+    @returns the sha1 hex digest.
+    """
+    sha1 = hashlib.sha1()
+    for root, dirs, files in os.walk(src_dir):
+        if root == src_dir:
+            dirs[:] = [d for d in dirs if d not in exclude_dirs]
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            st = os.lstat(path)
+            sha1.update('%s %d %d\n' % (os.path.relpath(path, src_dir),
+                                        st.st_size, st.st_mtime))
+    return sha1.hexdigest()
+
+
+class TarballCache(object):
+    """A directory of package tarballs, shared by autoserv processes."""
+
+    def __init__(self, cache_dir, max_size):
+        """
+        @param cache_dir: The cache directory, created if needed.
+        @param max_size: Size in bytes above which tarballs are evicted.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._lock_path = os.path.join(cache_dir, _LOCK_FILE)
+
+
+    @contextlib.contextmanager
+    def _lock(self):
+        """Hold the lock of the cache directory."""
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+    def get(self, pkg_name, src_dir, build_function, dest_dir):
+        """Get the cached tarball of a source directory, building it once.
+
+        @param pkg_name: The tarball name, e.g. test-dummy_Pass.tar.bz2.
+        @param src_dir: The source directory of the package.
+        @param build_function: Function taking a directory to build the
+                tarball in, and returning the path of the tarball.
+        @param dest_dir: Directory of the caller to link the tarball into.
+
+        @returns the path of the tarball in dest_dir.
+        """
+        if not os.path.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir, 0755)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        path = os.path.join(self.cache_dir, '%s-%s' % (
+                hash_source_tree(src_dir), pkg_name))
+        dest_path = os.path.join(dest_dir, pkg_name)
+        with self._lock():
+            if os.path.exists(path):
+                # The modification time orders the tarballs for eviction.
+                os.utime(path, None)
+                _link(path, dest_path)
+                metrics.Counter(_METRICS_PREFIX + 'hits').increment()
+                return dest_path
+
+        metrics.Counter(_METRICS_PREFIX + 'misses').increment()
+        build_dir = tempfile.mkdtemp(prefix=_BUILD_DIR_PREFIX,
+                                     dir=self.cache_dir)
+        try:
+            tarball_path = build_function(build_dir)
+            with self._lock():
+                # Another process may have built the same tarball meanwhile,
+                # renaming over it is harmless.
+                os.rename(tarball_path, path)
+                _link(path, dest_path)
+                self._evict(keep=path)
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+        return dest_path
+
+
+    def _evict(self, keep):
+        """Delete the least recently used tarballs if the cache is too large.
+
+        The caller must hold the lock.
+
+        @param keep: Path of a tarball which must not be deleted.
+        """
+        tarballs = []
+        size = 0
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                # A build directory removed by another process.
+                continue
+            if name.startswith(_BUILD_DIR_PREFIX):
+                if time.time() - st.st_mtime > _STALE_BUILD_DIR_AGE_SECS:
+                    shutil.rmtree(path, ignore_errors=True)
+                continue
+            if name.startswith('.'):
+                continue
+            tarballs.append((st.st_mtime, st.st_size, path))
+            size += st.st_size
+
+        for _, tarball_size, path in sorted(tarballs):
+            if size <= self.max_size:
+                break
+            if path == keep:
+                continue
+            logging.info('Evicting %s from the tarball cache', path)
+            os.remove(path)
+            size -= tarball_size
+            metrics.Counter(_METRICS_PREFIX + 'evictions').increment()
+
+
+def _link(path, dest_path):
+    """Hard link a tarball, or copy it across file systems.
+
+    @param path: The tarball.
+    @param dest_path: Path of the link.
+    """
+    try:
+        os.link(path, dest_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.copy(path, dest_path)
+
+
+def _is_private(cache_dir):
+    """Whether only the current user can write to the cache directory.
+
+    @param cache_dir: The cache directory, which is checked through its
+            closest existing ancestor if it doesn't exist yet.
+    """
+    try:
+        st = os.stat(cache_dir)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return _is_private(os.path.dirname(os.path.abspath(cache_dir)))
+    return (st.st_uid == os.getuid() and
+            not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+
+def get_tarball_cache():
+    """Return the TarballCache of the drone, or None if it is disabled."""
+    cache_dir = _CONFIG.get_config_value('PACKAGES', 'tarball_cache_dir',
+                                         default='')
+    if not cache_dir:
+        return None
+    if not _is_private(cache_dir):
+        logging.warning('Not using the tarball cache %s, which other users '
+                        'can write to.', cache_dir)
+        return None
+    max_size_mb = _CONFIG.get_config_value(
+            'PACKAGES', 'tarball_cache_max_size_mb', type=int, default=4096)
+    return TarballCache(cache_dir, max_size_mb * 1024 * 1024)
@@ -0,0 +1,108 @@
+#!/usr/bin/python2
+# Copyright 2019 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import common
+from autotest_lib.server import tarball_cache
+
+
+class TarballCacheTest(unittest.TestCase):
+    """Unittest for tarball_cache."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.src_dir = os.path.join(self.tmpdir, 'src')
+        os.mkdir(self.src_dir)
+        self._write(os.path.join(self.src_dir, 'control'), 'control')
+        self.builds = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, path, content):
+        """Write content to a file."""
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def _build(self, pkg_name, size):
+        """Return a build function writing a tarball of size bytes."""
+        def build(build_dir):
+            self.builds.append(pkg_name)
+            tarball_path = os.path.join(build_dir, pkg_name)
+            self._write(tarball_path, 'x' * size)
+            return tarball_path
+        return build
+
+    def _get(self, cache, pkg_name, size=10):
+        """Get a tarball from the cache into a new directory."""
+        return cache.get(pkg_name, self.src_dir, self._build(pkg_name, size),
+                         tempfile.mkdtemp(dir=self.tmpdir))
+
+    def _cached_path(self, path):
+        """Return the path of the cached tarball a path links to."""
+        for name in os.listdir(self.cache_dir):
+            cached_path = os.path.join(self.cache_dir, name)
+            if (not name.startswith('.') and
+                    os.path.samefile(cached_path, path)):
+                return cached_path
+        return None
+
+    def test_tarball_is_built_once(self):
+        cache = tarball_cache.TarballCache(self.cache_dir, 1000)
+        path = self._get(cache, 'test-a.tar.bz2')
+        path2 = self._get(cache, 'test-a.tar.bz2')
+        self.assertEqual(self.builds, ['test-a.tar.bz2'])
+        self.assertEqual(os.path.basename(path2), 'test-a.tar.bz2')
+        self.assertEqual(self._cached_path(path2), self._cached_path(path))
+        self.assertEqual(os.path.getsize(path2), 10)
+
+    def test_source_change_rebuilds(self):
+        cache = tarball_cache.TarballCache(self.cache_dir, 1000)
+        path = self._get(cache, 'test-a.tar.bz2')
+        self._write(os.path.join(self.src_dir, 'control'), 'new control')
+        path2 = self._get(cache, 'test-a.tar.bz2')
+        self.assertNotEqual(self._cached_path(path2), self._cached_path(path))
+        self.assertEqual(len(self.builds), 2)
+
+    def test_evict_least_recently_used(self):
+        cache = tarball_cache.TarballCache(self.cache_dir, 25)
+        a = self._cached_path(self._get(cache, 'test-a.tar.bz2'))
+        b_link = self._get(cache, 'test-b.tar.bz2')
+        b = self._cached_path(b_link)
+        os.utime(a, (0, 0))
+        os.utime(b, (1, 1))
+        # Using a makes b the least recently used tarball.
+        self._get(cache, 'test-a.tar.bz2')
+        c = self._cached_path(self._get(cache, 'test-c.tar.bz2'))
+        self.assertTrue(os.path.exists(a))
+        self.assertFalse(os.path.exists(b))
+        self.assertTrue(os.path.exists(c))
+        # The link of a caller outlives the eviction.
+        self.assertEqual(os.path.getsize(b_link), 10)
+
+    def test_build_dirs_are_removed(self):
+        cache = tarball_cache.TarballCache(self.cache_dir, 1000)
+        self._get(cache, 'test-a.tar.bz2')
+        self.assertEqual(
+                [name for name in os.listdir(self.cache_dir)
+                 if name.startswith('.build-')], [])
+
+    def test_is_private(self):
+        self.assertTrue(tarball_cache._is_private(self.cache_dir))
+        os.chmod(self.tmpdir, 0777)
+        self.assertFalse(tarball_cache._is_private(self.cache_dir))
+        os.mkdir(self.cache_dir, 0755)
+        self.assertTrue(tarball_cache._is_private(self.cache_dir))
+        os.chmod(self.cache_dir, 0775)
+        self.assertFalse(tarball_cache._is_private(self.cache_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
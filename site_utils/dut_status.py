@@ -256,7 +256,7 @@ def _validate_time_range(arguments):
                            arguments.duration * 60 * 60)
 
 
-def _get_host_histories(afe, arguments):
+def _get_host_histories(afe, arguments, loader):
     """Return HostJobHistory objects for the requested hosts.
 
     Checks that individual hosts specified on the command line are
@@ -270,6 +270,7 @@ def _get_host_histories(afe, arguments):
     @param afe       Autotest frontend
     @param arguments Parsed arguments object as returned by
                      ArgumentParser.parse_args().
+    @param loader    HistoryLoader shared by the histories.
     @return List of HostJobHistory objects for the hosts requested
             on the command line.
 
@@ -279,7 +280,8 @@ def _get_host_histories(afe, arguments):
     for hostname in arguments.hostnames:
         try:
             h = HostJobHistory.get_host_history(
-                    afe, hostname, arguments.since, arguments.until)
+                    afe, hostname, arguments.since, arguments.until,
+                    loader)
             histories.append(h)
         except:
             print >>sys.stderr, ('WARNING: Ignoring unknown host %s' %
@@ -291,7 +293,7 @@ def _get_host_histories(afe, arguments):
     return histories
 
 
-def _validate_host_list(afe, arguments):
+def _validate_host_list(afe, arguments, loader):
     """Validate the user-specified list of hosts.
 
     Hosts may be specified implicitly with --board or --pool, or
@@ -308,6 +310,7 @@ def _validate_host_list(afe, arguments):
     @param afe       Autotest frontend
     @param arguments Parsed arguments object as returned by
                      ArgumentParser.parse_args().
+    @param loader    HistoryLoader shared by the histories.
     @return List of HostJobHistory objects for the hosts requested
             on the command line.
 
@@ -323,9 +326,10 @@ def _validate_host_list(afe, arguments):
         labels['pool'] = arguments.pool
         labels['model'] = arguments.model
         histories = HostJobHistory.get_multiple_histories(
-            afe, arguments.since, arguments.until, labels.getlabels())
+            afe, arguments.since, arguments.until, labels.getlabels(),
+            loader)
     else:
-        histories = _get_host_histories(afe, arguments)
+        histories = _get_host_histories(afe, arguments, loader)
     if not histories:
         print >>sys.stderr, 'FATAL: no valid hosts found'
         sys.exit(1)
@@ -354,7 +358,7 @@ def _validate_format_options(arguments):
         arguments.broken = True
 
 
-def _validate_command(afe, arguments):
+def _validate_command(afe, arguments, loader):
     """Check that the command's arguments are valid.
 
     This performs command line checking to enforce command line
@@ -370,13 +374,14 @@ def _validate_command(afe, arguments):
     @param afe       Autotest frontend
     @param arguments Parsed arguments object as returned by
                      ArgumentParser.parse_args().
+    @param loader    HistoryLoader shared by the histories.
     @return List of HostJobHistory objects for the hosts requested
             on the command line.
 
     """
     _validate_time_range(arguments)
     _validate_format_options(arguments)
-    return _validate_host_list(afe, arguments)
+    return _validate_host_list(afe, arguments, loader)
 
 
 def _parse_command(argv):
@@ -443,6 +448,9 @@ def _parse_command(argv):
                         help='Master autotest frontend hostname. If no value '
                              'is given, the one in global config will be used.',
                         default=None)
+    parser.add_argument('--history-cache', metavar='FILE',
+                        help='File to keep DUT histories in, so that '
+                             'the next run only queries newer events.')
     arguments = parser.parse_args(argv[1:])
     return arguments
 
@@ -455,11 +463,14 @@ def main(argv):
     """
     arguments = _parse_command(argv)
     afe = frontend.AFE(server=arguments.web)
-    history_list = _validate_command(afe, arguments)
+    loader = status_history.HistoryLoader(
+            afe, cache_file=arguments.history_cache)
+    history_list = _validate_command(afe, arguments, loader)
     if arguments.oneline:
         _print_host_summaries(history_list, arguments)
     else:
         _print_hosts(history_list, arguments)
+    loader.save()
 
 
 if __name__ == '__main__':
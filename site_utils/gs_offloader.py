@@ -1109,6 +1109,8 @@ class Offloader(object):
         offloaded.
       * _open_jobs: a dictionary mapping directory paths to Job
         objects.
+      * _listing_cache: DirectoryListingCache used to find new job
+        directories without rescanning the whole results directory.
     """
 
     def __init__(self, options):
@@ -1144,6 +1146,8 @@ class Offloader(object):
         assert self._jobdir_classes
         self._processes = options.parallelism
         self._open_jobs = {}
+        self._listing_cache = job_directories.DirectoryListingCache(
+                use_inotify=not options.no_inotify)
         self._pusub_topic = None
         self._offload_count_limit = 3
 
@@ -1153,11 +1157,12 @@ class Offloader(object):
 
         Go through the file system looking for valid job directories
         that are currently not in `self._open_jobs`, and add them in.
+        Only the directories that changed since the last call are listed.
 
         """
         new_job_count = 0
         for cls in self._jobdir_classes:
-            for resultsdir in cls.get_job_directories():
+            for resultsdir in cls.get_job_directories(self._listing_cache):
                 if resultsdir in self._open_jobs:
                     continue
                 self._open_jobs[resultsdir] = cls(resultsdir)
@@ -1356,6 +1361,10 @@ def parse_options():
                       dest='enable_timestamp_cache',
                       action='store_true',
                       help='Cache the finished timestamps from AFE.')
+    parser.add_option('--no_inotify', dest='no_inotify',
+                      action='store_true',
+                      help='Detect new job directories by polling directory '
+                      'modification times, even if inotify is available.')
 
     options = parser.parse_args()[0]
     if options.process_all and options.process_hosts_only:
@@ -1419,7 +1428,9 @@ def main():
             if not options.delete_only:
                 wait_for_gs_write_access(offloader.gs_uri)
             while True:
-                offloader.offload_once()
+                with metrics.SecondsTimer(
+                        'chromeos/autotest/gs_offloader/offload_loop_duration'):
+                    offloader.offload_once()
                 if options.offload_once:
                     break
                 time.sleep(SLEEP_TIME_SECS)
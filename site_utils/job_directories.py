@@ -1,11 +1,13 @@
 import abc
 import datetime
+import fnmatch
 import glob
 import json
 import logging
 import os
 import re
 import shutil
+import time
 
 import common
 from autotest_lib.client.common_lib import time_utils
@@ -18,6 +20,11 @@ try:
 except ImportError:
     metrics = utils.metrics_mock
 
+try:
+  import pyinotify
+except ImportError:
+  pyinotify = None
+
 
 SPECIAL_TASK_PATTERN = '.*/hosts/[^/]+/(\d+)-[^/]+'
 
@@ -89,6 +96,162 @@ def _get_swarming_run_id(path):
     return None
 
 
+# Directory mtimes this close to the time a directory was listed can't be
+# trusted to reflect later changes, because of the mtime granularity.
+_MTIME_GRANULARITY_SECS = 1
+
+
+class DirectoryListingCache(object):
+  """Cache of the subdirectories of the directories holding job results.
+
+  A directory is only listed again once it changed, so discovering new job
+  directories costs one stat() per parent directory, rather than a stat()
+  per job directory. Changes are detected with inotify when pyinotify is
+  available, and by comparing directory mtimes otherwise.
+  """
+
+  _INOTIFY_MASK = (pyinotify.IN_CREATE | pyinotify.IN_DELETE |
+                   pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO |
+                   pyinotify.IN_DELETE_SELF | pyinotify.IN_MOVE_SELF
+                   if pyinotify else 0)
+  _WATCH_GONE_MASK = (pyinotify.IN_DELETE_SELF | pyinotify.IN_MOVE_SELF |
+                      pyinotify.IN_IGNORED if pyinotify else 0)
+
+  def __init__(self, use_inotify=True):
+    """
+    @param use_inotify: True to watch directories with inotify, if
+                        pyinotify is available.
+    """
+    # Maps the absolute path of a directory to a (mtime, subdirs) tuple.
+    # mtime is None if the listing must not be trusted by mtime.
+    self._listings = {}
+    self._dirty = set()
+    self._watches = {}
+    self._watch_manager = None
+    self._notifier = None
+    if use_inotify and pyinotify:
+      self._watch_manager = pyinotify.WatchManager()
+      self._notifier = pyinotify.Notifier(self._watch_manager, timeout=0)
+
+  def _read_events(self):
+    """Mark the directories changed since the last call as dirty."""
+    if self._notifier and self._notifier.check_events():
+      self._notifier.read_events()
+      self._notifier.process_events()
+
+  def _on_event(self, path, event):
+    """Mark a directory as dirty after an inotify event.
+
+    @param path: Absolute path of the watched directory.
+    @param event: The pyinotify event.
+    """
+    if event.mask & self._WATCH_GONE_MASK:
+      # The directory is gone, so is the watch. Its listing has no mtime, so
+      # it's listed again if it comes back.
+      self._watches.pop(path, None)
+      self._dirty.discard(path)
+    else:
+      self._dirty.add(path)
+
+  def _watch(self, path):
+    """Start watching a directory with inotify.
+
+    @param path: Absolute path of the directory.
+    @returns True if the directory is watched.
+    """
+    if path in self._watches:
+      return True
+    if not self._watch_manager:
+      return False
+    wdd = self._watch_manager.add_watch(
+        path, self._INOTIFY_MASK,
+        proc_fun=lambda event: self._on_event(path, event))
+    if wdd.get(path, -1) < 0:
+      logging.warning('Failed to watch %s, falling back to polling.', path)
+      return False
+    self._watches[path] = wdd[path]
+    return True
+
+  def _forget(self, path):
+    """Drop the cached listings and the watches of a directory tree.
+
+    @param path: Absolute path of the directory.
+    """
+    prefix = os.path.join(path, '')
+    for p in self._listings.keys():
+      if p == path or p.startswith(prefix):
+        del self._listings[p]
+    for p in list(self._dirty):
+      if p == path or p.startswith(prefix):
+        self._dirty.discard(p)
+    for p in self._watches.keys():
+      if p == path or p.startswith(prefix):
+        self._watch_manager.rm_watch(self._watches.pop(p), quiet=True)
+
+  def _get_subdirs(self, dirname):
+    """Return the names of the subdirectories of a directory.
+
+    @param dirname: Path of the directory, '' for the current directory.
+    """
+    path = os.path.abspath(dirname)
+    try:
+      mtime = os.stat(path).st_mtime
+    except OSError:
+      self._forget(path)
+      return frozenset()
+    cached = self._listings.get(path)
+    if cached:
+      if path in self._watches:
+        if path not in self._dirty:
+          return cached[1]
+      elif cached[0] == mtime:
+        return cached[1]
+      old_subdirs = cached[1]
+    else:
+      old_subdirs = frozenset()
+
+    self._dirty.discard(path)
+    watched = self._watch(path)
+    try:
+      names = os.listdir(path)
+    except OSError:
+      self._forget(path)
+      return frozenset()
+    # Job directories don't turn into files, so only new names need a stat().
+    subdirs = frozenset(
+        name for name in names
+        if name in old_subdirs or os.path.isdir(os.path.join(path, name)))
+    # Offloaded job directories are never listed again.
+    for name in old_subdirs - subdirs:
+      self._forget(os.path.join(path, name))
+    if watched or mtime >= time.time() - _MTIME_GRANULARITY_SECS:
+      mtime = None
+    self._listings[path] = (mtime, subdirs)
+    return subdirs
+
+  def glob(self, pattern):
+    """Return the directories matching a relative glob pattern.
+
+    Like glob.glob, names starting with a dot are only matched by pattern
+    components starting with a dot.
+
+    @param pattern: Glob pattern, relative to the current directory.
+    @returns A list of paths of directories, relative to the current
+             directory.
+    """
+    self._read_events()
+    dirs = ['']
+    for part in pattern.split('/'):
+      matches = []
+      for parent in dirs:
+        names = fnmatch.filter(self._get_subdirs(parent), part)
+        if not part.startswith('.'):
+          names = [name for name in names if not name.startswith('.')]
+        matches.extend(os.path.join(parent, name) for name in names)
+      dirs = matches
+    return dirs
+
+
 class _JobDirectory(object):
   """State associated with a job to be offloaded.
 
@@ -125,8 +288,14 @@ class _JobDirectory(object):
     self.first_offload_start = 0
 
   @classmethod
-  def get_job_directories(cls):
-    """Return a list of directories of jobs that need offloading."""
+  def get_job_directories(cls, listing_cache=None):
+    """Return a list of directories of jobs that need offloading.
+
+    @param listing_cache: A DirectoryListingCache to find the directories
+                          with. If None, the results directory is scanned.
+    """
+    if listing_cache:
+      return listing_cache.glob(cls.GLOB_PATTERN)
     return [d for d in glob.glob(cls.GLOB_PATTERN) if os.path.isdir(d)]
 
   @abc.abstractmethod
@@ -235,13 +404,23 @@ _marker_parse_error_metric = metrics.Counter(
 class SwarmingJobDirectory(_JobDirectory):
   """Subclass of _JobDirectory for Skylab swarming jobs."""
 
+  _LEGACY_GLOB_PATTERN = 'swarming-[0-9a-f]*[1-9a-f]'
+  _GLOB_PATTERN = 'swarming-[0-9a-f]*0/[1-9a-f]*'
+
   @classmethod
-  def get_job_directories(cls):
-    """Return a list of directories of jobs that need offloading."""
+  def get_job_directories(cls, listing_cache=None):
+    """Return a list of directories of jobs that need offloading.
+
+    @param listing_cache: A DirectoryListingCache to find the directories
+                          with. If None, the results directory is scanned.
+    """
+    if listing_cache:
+      return (listing_cache.glob(cls._LEGACY_GLOB_PATTERN) +
+              listing_cache.glob(cls._GLOB_PATTERN))
     # Legacy swarming results are in directories like
     #   .../results/swarming-3e4391423c3a4311
     # In particular, the ending digit is never 0
-    jobdirs = [d for d in glob.glob('swarming-[0-9a-f]*[1-9a-f]')
+    jobdirs = [d for d in glob.glob(cls._LEGACY_GLOB_PATTERN)
                  if os.path.isdir(d)]
     # New style swarming results are in directories like
     #   .../results/swarming-3e4391423c3a4310/1
@@ -255,8 +434,6 @@ class SwarmingJobDirectory(_JobDirectory):
       jobdirs += subdirs
     return jobdirs
 
-
-
   def get_timestamp_if_finished(self):
     """Get the timestamp to use for finished jobs.
 
@@ -6,6 +6,7 @@ from __future__ import print_function
 
 import contextlib
 import datetime
+import mock
 import mox
 import os
 import shutil
@@ -39,6 +40,72 @@ class SwarmingJobDirectoryTestCase(unittest.TestCase):
                               "swarming-3e4391423c3a4310/a"})
 
 
+class DirectoryListingCacheTestCase(unittest.TestCase):
+    """Tests DirectoryListingCache."""
+
+    def _make_old(self, path):
+        """Set the mtime of a directory far enough in the past to trust it."""
+        os.utime(path, (1000, 1000))
+
+    def test_glob_matches_glob_module(self):
+        with _change_to_tempdir():
+            for d in ('1-a', '.2-b', 'hosts/h1/3-c', 'hosts/h2/4-d',
+                      'swarming-3e4391423c3a4311',
+                      'swarming-3e4391423c3a4310/1',
+                      'swarming-3e4391423c3a4310/0'):
+                os.makedirs(d)
+            open('5-file', 'w').close()
+            cache = job_directories.DirectoryListingCache(use_inotify=False)
+            for cls in (job_directories.RegularJobDirectory,
+                        job_directories.SpecialJobDirectory,
+                        job_directories.SwarmingJobDirectory):
+                self.assertEqual(set(cls.get_job_directories(cache)),
+                                 set(cls.get_job_directories()))
+
+    def test_unchanged_directory_is_not_listed(self):
+        with _change_to_tempdir():
+            os.mkdir('1-a')
+            self._make_old('.')
+            cache = job_directories.DirectoryListingCache(use_inotify=False)
+            self.assertEqual(cache.glob('[0-9]*-*'), ['1-a'])
+            with mock.patch('os.listdir') as listdir:
+                self.assertEqual(cache.glob('[0-9]*-*'), ['1-a'])
+                self.assertFalse(listdir.called)
+
+    def test_changed_directory_is_listed(self):
+        with _change_to_tempdir():
+            os.mkdir('1-a')
+            cache = job_directories.DirectoryListingCache(use_inotify=False)
+            self.assertEqual(cache.glob('[0-9]*-*'), ['1-a'])
+            os.mkdir('2-b')
+            os.rmdir('1-a')
+            self.assertEqual(cache.glob('[0-9]*-*'), ['2-b'])
+
+    def test_removed_directory_tree_is_forgotten(self):
+        with _change_to_tempdir():
+            os.makedirs('hosts/h1/3-c')
+            os.makedirs('hosts/h2/4-d')
+            cache = job_directories.DirectoryListingCache(use_inotify=False)
+            self.assertEqual(sorted(cache.glob('hosts/*/[0-9]*-*')),
+                             ['hosts/h1/3-c', 'hosts/h2/4-d'])
+            shutil.rmtree('hosts/h1')
+            self.assertEqual(cache.glob('hosts/*/[0-9]*-*'), ['hosts/h2/4-d'])
+            h1 = os.path.abspath('hosts/h1')
+            self.assertEqual(
+                    [path for path in cache._listings
+                     if path == h1 or path.startswith(h1 + '/')], [])
+
+    def test_gone_watch_is_not_dirty(self):
+        cache = job_directories.DirectoryListingCache(use_inotify=False)
+        cache._watches['/results/1-a'] = 1
+        event = mock.Mock(mask=1)
+        with mock.patch.object(job_directories.DirectoryListingCache,
+                               '_WATCH_GONE_MASK', 1):
+            cache._on_event('/results/1-a', event)
+        self.assertEqual(cache._watches, {})
+        self.assertEqual(cache._dirty, set())
+
+
 class GetJobIDOrTaskID(unittest.TestCase):
     """Tests get_job_id_or_task_id."""
 
@@ -476,7 +476,8 @@ class _LabInventory(collections.Mapping):
     """
 
     @classmethod
-    def create_inventory(cls, afe, start_time, end_time, modellist=[]):
+    def create_inventory(cls, afe, start_time, end_time, modellist=[],
+                         loader=None):
         """Return a Lab inventory with specified parameters.
 
         By default, gathers inventory from `HostJobHistory` objects for
@@ -490,11 +491,14 @@ class _LabInventory(collections.Mapping):
         @param end_time     End time for the `HostJobHistory` objects.
         @param modellist    List of models to include.  If empty,
                             include all available models.
+        @param loader       `HistoryLoader` shared by the
+                            `HostJobHistory` objects.  By default, a
+                            new one is used.
         @return A `_LabInventory` object for the specified models.
         """
         target_pools = MANAGED_POOLS
         label_list = [constants.Labels.POOL_PREFIX + l for l in target_pools]
-        afehosts = afe.get_hosts(labels__name__in=label_list)
+        afehosts = list(afe.iter_hosts(labels__name__in=label_list))
         if modellist:
             # We're deliberately not checking host eligibility in this
             # code path.  This is a debug path, not used in production;
@@ -508,9 +512,12 @@ class _LabInventory(collections.Mapping):
             afehosts = modelhosts
         else:
             afehosts = [h for h in afehosts if _eligible_host(h)]
+        if loader is None:
+            loader = status_history.HistoryLoader(afe)
         create = lambda host: (
                 status_history.HostJobHistory(afe, host,
-                                              start_time, end_time))
+                                              start_time, end_time,
+                                              loader))
         return cls([create(host) for host in afehosts], target_pools)
 
     def __init__(self, histories, pools):
@@ -1142,16 +1149,17 @@ def _log_startup(arguments, startup_time):
     return timestamp
 
 
-def _create_inventory(arguments, end_time):
+def _create_inventory(arguments, end_time, afe, loader):
     """Create the `_LabInventory` instance to use for reporting.
 
     @param end_time   A UNIX timestamp for the end of the time range
                       to be searched in this inventory run.
+    @param afe        AFE object for the inventory's queries.
+    @param loader     `HistoryLoader` for the inventory's histories.
     """
     start_time = end_time - arguments.duration * 60 * 60
-    afe = frontend_wrappers.RetryingAFE(server=None)
     inventory = _LabInventory.create_inventory(
-            afe, start_time, end_time, arguments.modelnames)
+            afe, start_time, end_time, arguments.modelnames, loader)
     logging.info('Found %d hosts across %d models',
                      inventory.get_num_duts(),
                      inventory.get_num_models())
@@ -1169,7 +1177,10 @@ def _perform_inventory_reports(arguments):
     """
     startup_time = time.time()
     timestamp = _log_startup(arguments, startup_time)
-    inventory = _create_inventory(arguments, startup_time)
+    afe = frontend_wrappers.RetryingAFE(server=None)
+    loader = status_history.HistoryLoader(
+            afe, cache_file=arguments.history_cache)
+    inventory = _create_inventory(arguments, startup_time, afe, loader)
     if arguments.debug:
         _populate_model_counts(inventory)
     if arguments.model_notify:
@@ -1178,6 +1189,7 @@ def _perform_inventory_reports(arguments):
         _perform_pool_inventory(arguments, inventory, timestamp)
     if arguments.report_untestable:
         _report_untestable_dut_metrics(inventory)
+    loader.save()
 
 
 def _separate_email_addresses(address_list):
@@ -1285,6 +1297,9 @@ def _parse_command(argv):
                         help='Suppress generation of Monarch metrics.')
     parser.add_argument('--logdir', default=_get_default_logdir(argv[0]),
                         help='Directory where logs will be written.')
+    parser.add_argument('--history-cache', metavar='FILE',
+                        help='File to keep DUT histories in, so that '
+                             'the next run only queries newer events.')
     parser.add_argument('modelnames', nargs='*',
                         metavar='MODEL',
                         help='names of models to report on '
@@ -16,8 +16,10 @@ from container import Container
 from container import ContainerId
 from container_bucket import ContainerBucket
 from container_factory import ContainerFactory
+from container_pool import ContainerPool
 from lxc import install_package
 from lxc import install_packages
 from lxc import install_python_package
 from shared_host_dir import SharedHostDir
+from ssp_cache import ServerPackageCache
 from zygote import Zygote
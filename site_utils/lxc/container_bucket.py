@@ -12,7 +12,9 @@ from autotest_lib.client.bin import utils
 from autotest_lib.client.common_lib import error
 from autotest_lib.site_utils.lxc import config as lxc_config
 from autotest_lib.site_utils.lxc import constants
+from autotest_lib.site_utils.lxc import container_pool
 from autotest_lib.site_utils.lxc import lxc
+from autotest_lib.site_utils.lxc import ssp_cache
 from autotest_lib.site_utils.lxc import utils as lxc_utils
 from autotest_lib.site_utils.lxc.cleanup_if_fail import cleanup_if_fail
 from autotest_lib.site_utils.lxc.base_image import BaseImage
@@ -38,12 +40,18 @@ class ContainerBucket(object):
                  container_factory=None):
         """Initialize a ContainerBucket.
 
+        When a factory is not given, test containers are taken from the
+        container pool and server packages installed from the server package
+        cache, if they are enabled in the LXC_POOL section of global config.
+
         @param container_path: Path to the directory used to store containers.
                                Default is set to AUTOSERV/container_path in
                                global config.
         @param container_factory: A factory for creating Containers.
         """
         self.container_path = os.path.realpath(container_path)
+        self._pool = None
+        self._ssp_cache = None
         if container_factory is not None:
             self._factory = container_factory
         else:
@@ -64,6 +72,9 @@ class ContainerBucket(object):
             self._factory = ContainerFactory(
                 base_container=container,
                 lxc_path=self.container_path)
+            self._pool = container_pool.get_container_pool(
+                    self._factory, self.container_path)
+            self._ssp_cache = ssp_cache.get_ssp_cache(self.container_path)
         self.container_cache = {}
 
 
@@ -176,7 +187,8 @@ class ContainerBucket(object):
         """Setup test container for the test job to run.
 
         The setup includes:
-        1. Install autotest_server package from given url.
+        1. Install autotest_server package from given url, or from the server
+           package cache.
         2. Copy over local shadow_config.ini.
         3. Mount local site-packages.
         4. Mount test result directory.
@@ -222,11 +234,19 @@ class ContainerBucket(object):
             safe_control = os.path.join(result_path, control_file_name)
             utils.run('cp %s %s' % (control, safe_control))
 
-        # Create test container from the base container.
-        container = self._factory.create_container(container_id)
+        # Take a test container from the pool, or create it from the base
+        # container.
+        container = None
+        if self._pool is not None:
+            container = self._pool.get(container_id)
+        if container is None:
+            container = self._factory.create_container(container_id)
 
         # Deploy server side package
-        if isolate_hash:
+        if self._ssp_cache is not None:
+            self._ssp_cache.install(container, server_package_url,
+                                    isolate_hash)
+        elif isolate_hash:
           container.install_ssp_isolate(isolate_hash)
         else:
           container.install_ssp(server_package_url)
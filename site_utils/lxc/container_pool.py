@@ -0,0 +1,202 @@
+# Copyright 2019 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""A pool of pre-cloned test containers, shared by the autoserv processes of a
+drone.
+
+Cloning a test container from the base container is a large part of the SSP
+setup time. The pool manager (site_utils/lxc_pool_manager.py) clones
+containers ahead of time, and registers each of them by creating a file named
+after the container in the pool directory. Autoserv claims a container by
+deleting its file, which only one process can do, so handing out a container
+takes neither a lock nor a clone.
+
+Pooled containers have no ID until they are claimed, so ContainerBucket and
+lxc_cleanup leave them alone.
+"""
+
+import errno
+import logging
+import os
+import time
+
+import common
+from autotest_lib.client.bin import utils
+from autotest_lib.client.common_lib import error
+from autotest_lib.client.common_lib import global_config
+from autotest_lib.site_utils.lxc import constants
+from autotest_lib.site_utils.lxc import utils as lxc_utils
+from autotest_lib.site_utils.lxc.constants import \
+    CONTAINER_POOL_METRICS_PREFIX as METRICS_PREFIX
+from autotest_lib.site_utils.lxc.container import Container
+
+try:
+    from chromite.lib import metrics
+except ImportError:
+    metrics = utils.metrics_mock
+
+
+_CONFIG = global_config.global_config
+
+# Directory registering the ready containers, in the container path.  LXC
+# ignores it, as it has no container config.
+_POOL_DIR = '.pool'
+
+
+class ContainerPool(object):
+    """Test containers cloned ahead of time."""
+
+    def __init__(self, factory, container_path, size, max_age,
+                 container_class=Container):
+        """Initialize a ContainerPool.
+
+        @param factory: A ContainerFactory to clone the pooled containers.
+        @param container_path: The LXC path of the pooled containers.
+        @param size: Number of containers to keep ready.
+        @param max_age: Seconds after which a pooled container is replaced, so
+                        that the pool picks up base container updates.
+        @param container_class: The Container class to load the pooled
+                                containers with.
+        """
+        self._factory = factory
+        self._container_class = container_class
+        self.container_path = os.path.realpath(container_path)
+        self.size = size
+        self.max_age = max_age
+        self._pool_dir = os.path.join(self.container_path, _POOL_DIR)
+
+
+    def _list(self):
+        """List the names of the ready containers, oldest first."""
+        try:
+            names = os.listdir(self._pool_dir)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return []
+        ages = []
+        for name in names:
+            try:
+                ages.append((os.stat(os.path.join(self._pool_dir,
+                                                  name)).st_mtime, name))
+            except OSError:
+                # Claimed by another process.
+                continue
+        return [name for _, name in sorted(ages)]
+
+
+    def _claim(self, name):
+        """Take a ready container out of the pool.
+
+        @param name: Name of the container.
+
+        @return: The age of the container in seconds, or None if another
+                 process claimed it first.
+        """
+        path = os.path.join(self._pool_dir, name)
+        try:
+            age = time.time() - os.stat(path).st_mtime
+            os.remove(path)
+        except OSError:
+            return None
+        return age
+
+
+    def _destroy(self, name):
+        """Destroy a container which was taken out of the pool.
+
+        @param name: Name of the container.
+        """
+        logging.debug('Destroying pooled container %s', name)
+        lxc_utils.destroy(self.container_path, name, force=True,
+                          ignore_status=True)
+
+
+    def get(self, container_id):
+        """Claim a ready container, and assign it an ID.
+
+        @param container_id: ID to assign to the container.
+
+        @return: A Container object, or None if the pool is empty.
+        """
+        for name in self._list():
+            age = self._claim(name)
+            if age is None:
+                continue
+            try:
+                container = self._container_class.create_from_existing_dir(
+                        self.container_path, name)
+                container.id = container_id
+            except (error.ContainerError, error.CmdError) as e:
+                logging.warning('Discarding broken pooled container %s: %s',
+                                name, e)
+                self._destroy(name)
+                continue
+            logging.debug('Claimed pooled container %s for %s, %.0f seconds '
+                          'after it was created.', name, container_id, age)
+            metrics.Counter(METRICS_PREFIX + '/hits').increment()
+            metrics.SecondsDistribution(
+                    METRICS_PREFIX + '/container_age').add(age)
+            return container
+        logging.debug('The container pool is empty.')
+        metrics.Counter(METRICS_PREFIX + '/misses').increment()
+        return None
+
+
+    def refill(self):
+        """Replace the expired containers, and clone containers up to the pool
+        size.
+
+        Only the pool manager refills the pool.
+        """
+        if not os.path.isdir(self._pool_dir):
+            os.makedirs(self._pool_dir)
+
+        ready = 0
+        for name in self._list():
+            path = os.path.join(self._pool_dir, name)
+            try:
+                age = time.time() - os.stat(path).st_mtime
+            except OSError:
+                continue
+            if age <= self.max_age:
+                ready += 1
+            elif self._claim(name) is not None:
+                logging.info('Replacing expired pooled container %s', name)
+                self._destroy(name)
+                metrics.Counter(METRICS_PREFIX + '/expirations').increment()
+
+        while ready < self.size:
+            container = self._factory.create_container()
+            # The container is ready once its file exists.
+            open(os.path.join(self._pool_dir, container.name), 'w').close()
+            ready += 1
+            metrics.Gauge(METRICS_PREFIX + '/size').set(ready)
+        metrics.Gauge(METRICS_PREFIX + '/size').set(ready)
+
+
+    def drain(self):
+        """Destroy all the ready containers."""
+        for name in self._list():
+            if self._claim(name) is not None:
+                self._destroy(name)
+        metrics.Gauge(METRICS_PREFIX + '/size').set(0)
+
+
+def get_container_pool(factory, container_path):
+    """Return the ContainerPool of the drone, or None if it is disabled.
+
+    @param factory: A ContainerFactory to clone the pooled containers.
+    @param container_path: The LXC path of the pooled containers.
+    """
+    if not _CONFIG.get_config_value('LXC_POOL', 'use_lxc_pool', type=bool,
+                                    default=False):
+        return None
+    size = _CONFIG.get_config_value(
+            'LXC_POOL', 'pool_size', type=int,
+            default=constants.DEFAULT_CONTAINER_POOL_SIZE)
+    max_age = _CONFIG.get_config_value(
+            'LXC_POOL', 'container_max_age_secs', type=int,
+            default=24 * 60 * 60)
+    return ContainerPool(factory, container_path, size, max_age)
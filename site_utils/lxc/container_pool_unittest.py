@@ -0,0 +1,109 @@
+#!/usr/bin/python2
+# Copyright 2019 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import common
+from autotest_lib.site_utils.lxc import container_pool
+from autotest_lib.site_utils.lxc import utils as lxc_utils
+
+
+class FakeContainer(object):
+    """A container which only has a name and an ID."""
+
+    def __init__(self, name):
+        self.name = name
+        self.id = None
+
+
+    @classmethod
+    def create_from_existing_dir(cls, lxc_path, name):
+        return cls(name)
+
+
+class FakeFactory(object):
+    """A factory which names its containers in sequence."""
+
+    def __init__(self):
+        self.created = []
+
+
+    def create_container(self):
+        container = FakeContainer('container.%d' % len(self.created))
+        self.created.append(container.name)
+        return container
+
+
+class ContainerPoolTests(unittest.TestCase):
+    """Unit tests for the ContainerPool class."""
+
+    def setUp(self):
+        self.container_path = tempfile.mkdtemp()
+        self.factory = FakeFactory()
+        self.destroyed = []
+        self._destroy = lxc_utils.destroy
+        lxc_utils.destroy = (lambda path, name, **kwargs:
+                             self.destroyed.append(name))
+
+
+    def tearDown(self):
+        lxc_utils.destroy = self._destroy
+        shutil.rmtree(self.container_path)
+
+
+    def _pool(self, size=2, max_age=60):
+        return container_pool.ContainerPool(self.factory, self.container_path,
+                                            size, max_age,
+                                            container_class=FakeContainer)
+
+
+    def testGetFromEmptyPool(self):
+        """Verifies that an empty pool doesn't hand out containers."""
+        self.assertIsNone(self._pool().get('id'))
+
+
+    def testRefillAndGet(self):
+        """Verifies that claimed containers get their ID and are replaced."""
+        pool = self._pool()
+        pool.refill()
+        self.assertEqual(self.factory.created, ['container.0', 'container.1'])
+
+        container = pool.get('id')
+        self.assertEqual(container.id, 'id')
+        self.assertIn(container.name, ['container.0', 'container.1'])
+
+        pool.refill()
+        self.assertEqual(len(self.factory.created), 3)
+        self.assertNotEqual(pool.get('id2').name, container.name)
+
+
+    def testExpiredContainersAreReplaced(self):
+        """Verifies that refill destroys the containers older than max_age."""
+        pool = self._pool()
+        pool.refill()
+        old = time.time() - 120
+        os.utime(os.path.join(self.container_path, '.pool', 'container.0'),
+                 (old, old))
+
+        pool.refill()
+        self.assertEqual(self.destroyed, ['container.0'])
+        self.assertEqual(len(self.factory.created), 3)
+
+
+    def testDrain(self):
+        """Verifies that drain destroys all the pooled containers."""
+        pool = self._pool()
+        pool.refill()
+        pool.drain()
+        self.assertEqual(sorted(self.destroyed), ['container.0', 'container.1'])
+        self.assertIsNone(pool.get('id'))
+
+
+if __name__ == '__main__':
+    unittest.main()
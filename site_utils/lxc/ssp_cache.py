@@ -0,0 +1,196 @@
+# Copyright 2019 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Drone-wide cache of the extracted server packages of test containers.
+
+The tests of a build share one server package, which every test container used
+to download and extract again. The cache keeps each package extracted, keyed
+by its URL or isolate hash, and installs it into a container with a copy which
+is a copy-on-write clone where the file system supports it (btrfs, xfs).
+
+The processes coordinate with a lock file in the cache directory: installs
+hold it shared, and adding or evicting a package holds it exclusively.
+Packages are downloaded outside of the lock.
+"""
+
+import contextlib
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+import common
+from autotest_lib.client.bin import utils
+from autotest_lib.client.common_lib import global_config
+from autotest_lib.site_utils.lxc import lxc
+from autotest_lib.site_utils.lxc.constants import \
+    CONTAINER_POOL_METRICS_PREFIX as METRICS_PREFIX
+
+try:
+    from chromite.lib import metrics
+except ImportError:
+    metrics = utils.metrics_mock
+
+
+_CONFIG = global_config.global_config
+
+# Directory of the cache, in the container path.  LXC ignores it, as it has no
+# container config.
+_CACHE_DIR = '.ssp_cache'
+
+# Name of the lock file, in the cache directory.
+_LOCK_FILE = '.lock'
+
+# Prefix of the temporary directories packages are extracted in, in the cache
+# directory.
+_BUILD_DIR_PREFIX = '.build-'
+
+# Build directories older than this were left by killed processes.
+_STALE_BUILD_DIR_AGE_SECS = 24 * 60 * 60
+
+_SSP_TARBALL = 'autotest_server_package.tar.bz2'
+
+
+class ServerPackageCache(object):
+    """A directory of extracted server packages, shared by autoserv processes.
+    """
+
+    def __init__(self, cache_dir, max_entries):
+        """Initialize a ServerPackageCache.
+
+        @param cache_dir: The cache directory, created if needed.
+        @param max_entries: Number of packages above which the least recently
+                            used ones are evicted.
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._lock_path = os.path.join(cache_dir, _LOCK_FILE)
+
+
+    @contextlib.contextmanager
+    def _lock(self, operation):
+        """Hold the lock of the cache directory.
+
+        @param operation: fcntl.LOCK_SH or fcntl.LOCK_EX.
+        """
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+    def install(self, container, ssp_url=None, isolate_hash=None):
+        """Install a server package into a container.
+
+        The package is downloaded and extracted into the cache the first time.
+
+        @param container: The Container, which must not be running.
+        @param ssp_url: The URL of the server package.
+        @param isolate_hash: The isolate hash of the package, which supersedes
+                             ssp_url if present.
+        """
+        if not os.path.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        key = ('isolate:%s' % isolate_hash) if isolate_hash else ssp_url
+        path = os.path.join(self.cache_dir, hashlib.sha1(key).hexdigest())
+        with self._lock(fcntl.LOCK_SH):
+            if os.path.isdir(path):
+                # The modification time orders the packages for eviction.
+                os.utime(path, None)
+                self._copy(path, container)
+                metrics.Counter(METRICS_PREFIX + '/ssp_cache/hits').increment()
+                return
+
+        metrics.Counter(METRICS_PREFIX + '/ssp_cache/misses').increment()
+        build_dir = tempfile.mkdtemp(prefix=_BUILD_DIR_PREFIX,
+                                     dir=self.cache_dir)
+        try:
+            if isolate_hash:
+                container.install_ssp_isolate(isolate_hash,
+                                              dest_path=build_dir)
+            else:
+                tarball = os.path.join(build_dir, _SSP_TARBALL)
+                lxc.download_extract(ssp_url, tarball, build_dir)
+                utils.run('sudo rm "%s"' % tarball)
+            with self._lock(fcntl.LOCK_EX):
+                # Another process may have extracted the same package
+                # meanwhile, in which case the build directory is dropped.
+                if not os.path.isdir(path):
+                    os.rename(build_dir, path)
+                self._copy(path, container)
+                self._evict(keep=path)
+        finally:
+            if os.path.isdir(build_dir):
+                utils.run('sudo rm -rf "%s"' % build_dir)
+
+
+    def _copy(self, path, container):
+        """Copy an extracted package into the /usr/local of a container.
+
+        The caller must hold the lock.
+
+        @param path: The package directory in the cache.
+        @param container: The Container.
+        """
+        usr_local_path = os.path.join(container.rootfs, 'usr', 'local')
+        logging.debug('Installing cached server package %s into %s', path,
+                      container.name)
+        # Changes within the container rootfs require sudo.
+        utils.run("sudo sh -c 'mkdir -p \"%s\" && "
+                  "cp -a --reflink=auto \"%s\"/* \"%s\"'" %
+                  (usr_local_path, path, usr_local_path))
+
+
+    def _evict(self, keep):
+        """Delete the least recently used packages if there are too many.
+
+        The caller must hold the lock exclusively.
+
+        @param keep: Path of a package which must not be deleted.
+        """
+        packages = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                # A build directory removed by another process.
+                continue
+            if name.startswith(_BUILD_DIR_PREFIX):
+                if time.time() - mtime > _STALE_BUILD_DIR_AGE_SECS:
+                    utils.run('sudo rm -rf "%s"' % path)
+                continue
+            if name.startswith('.'):
+                continue
+            packages.append((mtime, path))
+
+        for _, path in sorted(packages)[:-self.max_entries or None]:
+            if path == keep:
+                continue
+            logging.info('Evicting %s from the server package cache', path)
+            utils.run('sudo rm -rf "%s"' % path)
+            metrics.Counter(
+                    METRICS_PREFIX + '/ssp_cache/evictions').increment()
+
+
+def get_ssp_cache(container_path):
+    """Return the ServerPackageCache of the drone, or None if it is disabled.
+
+    @param container_path: The LXC path of the test containers.
+    """
+    max_entries = _CONFIG.get_config_value('LXC_POOL', 'ssp_cache_size',
+                                           type=int, default=0)
+    if max_entries <= 0:
+        return None
+    return ServerPackageCache(os.path.join(container_path, _CACHE_DIR),
+                              max_entries)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python2
+# Copyright 2019 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Keep the LXC container pool of the drone filled.
+
+Autoserv takes the test containers of SSP jobs from the container pool when
+LXC_POOL/use_lxc_pool is set in global config, see site_utils/lxc/
+container_pool.py. This script runs on the drone, clones containers into the
+pool as autoserv takes them, and replaces the containers which are older than
+LXC_POOL/container_max_age_secs.
+"""
+
+import argparse
+import logging
+import os
+import time
+
+import common
+from autotest_lib.client.common_lib import logging_config
+from autotest_lib.site_utils import lxc
+from autotest_lib.site_utils.lxc import container_pool
+
+
+def parse_options():
+    """Parse command line inputs.
+
+    @return: Options to run the script.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        default=False,
+                        help='Print out debug logs.')
+    parser.add_argument('-i', '--interval', type=int, default=10,
+                        help='Seconds to wait between checks of the pool.')
+    parser.add_argument('-d', '--drain', action='store_true',
+                        default=False,
+                        help='Destroy the pooled containers and exit.')
+    parser.add_argument('-l', '--logfile', type=str,
+                        default=None,
+                        help='Path to the log file to save logs.')
+    return parser.parse_args()
+
+
+def main(options):
+    """Main script.
+
+    @param options: Options to run the script.
+    """
+    config = logging_config.LoggingConfig()
+    if options.logfile:
+        config.add_file_handler(
+                file_path=os.path.abspath(options.logfile),
+                level=logging.DEBUG if options.verbose else logging.INFO)
+
+    container_path = os.path.realpath(lxc.DEFAULT_CONTAINER_PATH)
+    factory = lxc.ContainerFactory(
+            base_container=lxc.BaseImage(container_path).get(),
+            lxc_path=container_path)
+    pool = container_pool.get_container_pool(factory, container_path)
+    if pool is None:
+        logging.info('The container pool is disabled, draining it.')
+        pool = container_pool.ContainerPool(factory, container_path, 0, 0)
+        options.drain = True
+    if options.drain:
+        pool.drain()
+        return
+
+    logging.info('Keeping %d containers in the pool of %s', pool.size,
+                 container_path)
+    while True:
+        try:
+            pool.refill()
+        except Exception as e:
+            logging.exception('Failed to refill the container pool: %s', e)
+        time.sleep(options.interval)
+
+
+if __name__ == '__main__':
+    options = parse_options()
+    main(options)
@@ -16,6 +16,7 @@ except ImportError:
 
     driver = UtterlyFakeDb
 
+import collections
 import math
 import os
 import random
@@ -53,11 +54,115 @@ def _format_operational_error(e):
             "operation: %s" % (time.strftime("%X %x"), str(e)))
 
 
+# Default number of rows per batched insert / delete statement.
+DEFAULT_BATCH_SIZE = 1000
+
+# Default number of entries kept by each of the lookup caches of db_sql.
+DEFAULT_LOOKUP_CACHE_SIZE = 1000
+
+
 class MySQLTooManyRows(Exception):
     """Too many records."""
     pass
 
 
+class _LookupCache(object):
+    """LRU-bounded cache of lookups of database indices.
+
+    Only rows that are known to exist are cached. Since a db_sql object
+    lives for the whole parse process, the cache is shared across all jobs
+    it parses.
+    """
+
+    def __init__(self, name, max_size):
+        """
+        @param name: Name of the cache, used in stats.
+        @param max_size: Maximum number of cached entries.
+        """
+        self.name = name
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+
+    def get(self, key):
+        """Return the cached value of key, or None.
+
+        @param key: The lookup key.
+        """
+        value = self._entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Re-insert to mark the entry as most recently used.
+        self._entries[key] = value
+        return value
+
+
+    def put(self, key, value):
+        """Cache value for key, evicting the least recently used entry.
+
+        @param key: The lookup key.
+        @param value: The looked up value, None is not cached.
+        """
+        if value is None or self.max_size <= 0:
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+    def invalidate(self, key):
+        """Drop the cached value of key, if any.
+
+        @param key: The lookup key.
+        """
+        self._entries.pop(key, None)
+
+
+    def clear(self):
+        """Drop all cached values."""
+        self._entries.clear()
+
+
+    def __str__(self):
+        return '%s: %d hits, %d misses, %d entries' % (
+                self.name, self.hits, self.misses, len(self._entries))
+
+
+# Tests joined to the columns of their tko_test_status_rollups key.
+_ROLLUP_KEY_TABLES = (
+        'tko_tests '
+        'INNER JOIN tko_jobs ON tko_jobs.job_idx = tko_tests.job_idx '
+        'INNER JOIN tko_status ON tko_status.status_idx = tko_tests.status')
+_ROLLUP_KEY_FIELDS = ('tko_jobs.label', 'tko_jobs.build', 'tko_jobs.board',
+                      'tko_tests.test', 'tko_status.word')
+# Must match the key_hash computed by the migration which created the table.
+_ROLLUP_HASH_SQL = 'SHA1(CONCAT_WS(CHAR(10), %s, %s, %s, %s, %s))'
+
+
+def _rollup_key(values):
+    """Return a tko_test_status_rollups key, with NULL stored as ''.
+
+    @param values: The job label, build, board, test name and status word.
+    """
+    return tuple('' if value is None else value for value in values)
+
+
+def _group_by_rollup_key(tests):
+    """Group (key, test_idx) tuples by key.
+
+    @return: A dict of test_idx lists by key.
+    """
+    test_idxs_by_key = collections.defaultdict(list)
+    for key, test_idx in tests:
+        test_idxs_by_key[key].append(test_idx)
+    return test_idxs_by_key
+
+
 def _connection_retry_callback():
     """Callback method used to increment a retry metric."""
     metrics.Counter('chromeos/autotest/tko/connection_retries').increment()
@@ -73,6 +178,13 @@ class db_sql(object):
         self._load_config(host, database, user, password)
 
         self.con = None
+        cache_size = global_config.global_config.get_config_value(
+                "AUTOTEST_WEB", "tko_lookup_cache_size", type=int,
+                default=DEFAULT_LOOKUP_CACHE_SIZE)
+        self._kernel_cache = _LookupCache('kernel_idx', cache_size)
+        self._machine_cache = _LookupCache('machine_idx', cache_size)
+        self._task_reference_cache = _LookupCache('task_reference_id',
+                                                  cache_size)
         self._init_db()
 
         # if not present, insert statuses
@@ -151,12 +263,40 @@ class db_sql(object):
         self.port = global_config.global_config.get_config_value(
                 "AUTOTEST_WEB", "global_db_port", type=str, default='')
 
+        # Number of rows sent per multi-row INSERT/DELETE statement. A value
+        # of 1 falls back to issuing one statement per row.
+        self.batch_size = global_config.global_config.get_config_value(
+                "AUTOTEST_WEB", "tko_insert_batch_size", type=int,
+                default=DEFAULT_BATCH_SIZE)
+
+
+    def _lookup_caches(self):
+        return (self._kernel_cache, self._machine_cache,
+                self._task_reference_cache)
+
+
+    def clear_caches(self):
+        """Drop all cached lookups.
+
+        Must be called whenever uncommitted rows may have been lost, since
+        the caches may refer to them.
+        """
+        for cache in self._lookup_caches():
+            cache.clear()
+
+
+    def cache_stats(self):
+        """Return a string with the hit/miss counters of the lookup caches."""
+        return '; '.join(str(cache) for cache in self._lookup_caches())
+
 
     def _init_db(self):
         # make sure we clean up any existing connection
         if self.con:
             self.con.close()
             self.con = None
+        # Uncommitted rows die with the old connection.
+        self.clear_caches()
 
         # create the db connection and cursor
         self.con = self.connect(self.host, self.database,
@@ -252,6 +392,7 @@ class db_sql(object):
     def rollback(self):
         """Rollback the sql transaction."""
         self.con.rollback()
+        self.clear_caches()
 
 
     def get_last_autonumber_value(self):
@@ -412,6 +553,35 @@ class db_sql(object):
         self._exec_sql_with_commit(cmd, values, commit)
 
 
+    def insert_many(self, table, fields, rows, commit=None):
+        """\
+                'insert into table (fields) values (%s ... %s), ...', values
+
+                Rows are sent in chunks of at most self.batch_size rows per
+                statement, so inserting N rows costs ceil(N / batch_size)
+                round-trips instead of N.
+
+        @param table: The name of the table.
+        @param fields: A sequence of field names.
+        @param rows: A sequence of value sequences, in the order of fields.
+        @param commit: If commit the transaction .
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        batch_size = max(1, self.batch_size)
+        row_refs = '(%s)' % ','.join('%s' for field in fields)
+        for start in xrange(0, len(rows), batch_size):
+            chunk = rows[start:start + batch_size]
+            cmd = ('insert into %s (%s) values %s' %
+                   (table, ','.join(self._quote(field) for field in fields),
+                    ','.join([row_refs] * len(chunk))))
+            values = [value for row in chunk for value in row]
+            self.dprint('%s (%d rows)' % (cmd[:200], len(chunk)))
+
+            self._exec_sql_with_commit(cmd, values, commit)
+
+
     def delete(self, table, where, commit = None):
         """Delete entries.
 
@@ -430,6 +600,136 @@ class db_sql(object):
         self._exec_sql_with_commit(sql, values, commit)
 
 
+    def delete_many(self, table, field, keys, commit=None):
+        """Delete all entries whose field is in keys.
+
+        Keys are sent in chunks of at most self.batch_size per statement.
+
+        @param table: The name of the table.
+        @param field: The name of the field to match.
+        @param keys: A sequence of values of field to delete.
+        @param commit: If commit the transaction .
+        """
+        keys = list(keys)
+        if not keys:
+            return
+        if commit is None:
+            commit = self.autocommit
+        batch_size = max(1, self.batch_size)
+        for start in xrange(0, len(keys), batch_size):
+            chunk = keys[start:start + batch_size]
+            where = ('%s in (%s)' % (self._quote(field),
+                                     ','.join('%s' for key in chunk)),
+                     chunk)
+            self.delete(table, where, commit=commit)
+
+
+    def delete_test_data(self, test_idxs, commit=None):
+        """Delete all per-test data, but not the tko_tests rows themselves.
+
+        @param test_idxs: A sequence of test indices.
+        @param commit: If commit the transaction .
+        """
+        test_idxs = list(test_idxs)
+        for table in ('tko_iteration_result', 'tko_iteration_perf_value',
+                      'tko_iteration_attributes', 'tko_test_attributes'):
+            self.delete_many(table, 'test_idx', test_idxs, commit=commit)
+        self.delete_many('tko_test_labels_tests', 'test_id', test_idxs,
+                         commit=commit)
+
+
+    def delete_tests(self, test_idxs, commit=None):
+        """Delete tests and all of their data.
+
+        @param test_idxs: A sequence of test indices.
+        @param commit: If commit the transaction .
+        """
+        test_idxs = list(test_idxs)
+        tests = []
+        batch_size = max(1, self.batch_size)
+        for start in xrange(0, len(test_idxs), batch_size):
+            chunk = test_idxs[start:start + batch_size]
+            tests += self._select_rollup_keys(
+                    ('tko_tests.test_idx in (%s)' %
+                     ','.join('%s' for test_idx in chunk), chunk))
+        self.delete_test_data(test_idxs, commit=commit)
+        self.delete_many('tko_tests', 'test_idx', test_idxs, commit=commit)
+        self._remove_from_rollups(tests, commit=commit)
+
+
+    def _select_rollup_keys(self, where):
+        """Read the tko_test_status_rollups keys of existing tests.
+
+        @param where: The where clause, on the joined tko_tests, tko_jobs and
+                tko_status tables.
+
+        @return: A list of (key, test_idx) tuples.
+        """
+        fields = ','.join(_ROLLUP_KEY_FIELDS + ('tko_tests.test_idx',))
+        rows = self.select(fields, _ROLLUP_KEY_TABLES, where)
+        return [(_rollup_key(row[:-1]), row[-1]) for row in rows]
+
+
+    def _add_to_rollups(self, tests, commit=None):
+        """Count tests in tko_test_status_rollups.
+
+        @param tests: A sequence of (key, test_idx) tuples.
+        @param commit: If commit the transaction .
+        """
+        sql = ('insert into tko_test_status_rollups '
+               '(key_hash,job_name,build,board,test_name,status,test_count,'
+               'max_test_idx) values (' + _ROLLUP_HASH_SQL +
+               ',%s,%s,%s,%s,%s,%s,%s) on duplicate key update '
+               'test_count=test_count+values(test_count),'
+               'max_test_idx=greatest(max_test_idx,'
+               'values(max_test_idx))')
+        for key, test_idxs in _group_by_rollup_key(tests).iteritems():
+            values = key + key + (len(test_idxs), max(test_idxs))
+            self.dprint('%s %s' % (sql, values))
+            self._exec_sql_with_commit(sql, values, commit)
+
+
+    def _remove_from_rollups(self, tests, commit=None):
+        """Uncount tests from tko_test_status_rollups.
+
+        This must be called after the tests are deleted or changed in
+        tko_tests, since the latest test of a key is looked up again when it
+        was one of them.
+
+        @param tests: A sequence of (key, test_idx) tuples.
+        @param commit: If commit the transaction .
+        """
+        where_key = ' where key_hash=' + _ROLLUP_HASH_SQL
+        for key, test_idxs in _group_by_rollup_key(tests).iteritems():
+            # Compare with '=' where possible, so that indexes can be used.
+            conditions = []
+            for field, value in zip(_ROLLUP_KEY_FIELDS, key):
+                if value:
+                    conditions.append(field + '=%s')
+                else:
+                    conditions.append("(%s is null or %s='')" % (field, field))
+            latest_sql = ('select max(tko_tests.test_idx) from ' +
+                          _ROLLUP_KEY_TABLES + ' where ' +
+                          ' and '.join(conditions))
+            latest_values = tuple(value for value in key if value)
+            statements = [
+                    ('update tko_test_status_rollups '
+                     'set test_count=test_count-%s' + where_key,
+                     (len(test_idxs),) + key),
+                    ('delete from tko_test_status_rollups' + where_key +
+                     ' and test_count<=0', key),
+                    ('update tko_test_status_rollups '
+                     'set max_test_idx=ifnull((' + latest_sql + '),'
+                     'max_test_idx)' + where_key +
+                     ' and max_test_idx in (%s)' %
+                     ','.join('%s' for test_idx in test_idxs),
+                     latest_values + key + tuple(test_idxs)),
+            ]
+            for sql, values in statements:
+                self.dprint('%s %s' % (sql, values))
+                self._exec_sql_with_commit(sql, values, commit)
+
+
     def update(self, table, data, where, commit = None):
         """\
                 'update table set data values (%s ... %s) where ...'
@@ -466,15 +766,12 @@ class db_sql(object):
         @param commit: If commit the transaction .
         """
         job_idx = self.find_job(tag)
-        for test_idx in self.find_tests(job_idx):
-            where = {'test_idx' : test_idx}
-            self.delete('tko_iteration_result', where)
-            self.delete('tko_iteration_perf_value', where)
-            self.delete('tko_iteration_attributes', where)
-            self.delete('tko_test_attributes', where)
-            self.delete('tko_test_labels_tests', {'test_id': test_idx})
+        self._task_reference_cache.invalidate(job_idx)
+        tests = self._select_rollup_keys(('tko_tests.job_idx=%s', [job_idx]))
+        self.delete_test_data(test_idx for _, test_idx in tests)
         where = {'job_idx' : job_idx}
         self.delete('tko_tests', where)
+        self._remove_from_rollups(tests)
         self.delete('tko_jobs', where)
 
 
@@ -491,8 +788,18 @@ class db_sql(object):
                 'afe_parent_job_id': job.afe_parent_job_id,
         })
         if job.job_idx is not None:
+            tests = self._select_rollup_keys(
+                    ('tko_tests.job_idx=%s', [job.job_idx]))
             self.update(
                     'tko_jobs', data, {'job_idx': job.job_idx}, commit=commit)
+            # The tests of the job move to other rollups if its label, build
+            # or board changed.
+            job_key = _rollup_key((job.label, job.build, job.board))
+            moved = [(key, test_idx) for key, test_idx in tests
+                     if key[:3] != job_key]
+            self._remove_from_rollups(moved, commit=commit)
+            self._add_to_rollups([(job_key + key[3:], test_idx)
+                                  for key, test_idx in moved], commit=commit)
         else:
             self.insert('tko_jobs', data, commit=commit)
             job.job_idx = self.get_last_autonumber_value()
@@ -548,6 +855,8 @@ class db_sql(object):
         else:
             self.insert('tko_task_references', data, commit=commit)
             job.task_reference_id = self.get_last_autonumber_value()
+            self._task_reference_cache.put(job.job_idx,
+                                           job.task_reference_id)
 
 
     def update_job_keyvals(self, job, commit=None):
@@ -581,11 +890,18 @@ class db_sql(object):
                 'reason':test.reason, 'machine_idx':job.machine_idx,
                 'started_time': test.started_time,
                 'finished_time':test.finished_time}
+        key = _rollup_key((job.label, job.build, job.board, test.testname,
+                           test.status))
         is_update = hasattr(test, "test_idx")
         if is_update:
             test_idx = test.test_idx
+            old_tests = self._select_rollup_keys(
+                    ('tko_tests.test_idx=%s', [test_idx]))
             self.update('tko_tests', data,
                         {'test_idx': test_idx}, commit=commit)
+            if [old_key for old_key, _ in old_tests] != [key]:
+                self._remove_from_rollups(old_tests, commit=commit)
+                self._add_to_rollups([(key, test_idx)], commit=commit)
             where = {'test_idx': test_idx}
             self.delete('tko_iteration_result', where)
             self.delete('tko_iteration_perf_value', where)
@@ -595,39 +911,38 @@ class db_sql(object):
         else:
             self.insert('tko_tests', data, commit=commit)
             test_idx = test.test_idx = self.get_last_autonumber_value()
-        data = {'test_idx': test_idx}
-
+            self._add_to_rollups([(key, test_idx)], commit=commit)
+        attribute_rows = []
+        result_rows = []
         for i in test.iterations:
-            data['iteration'] = i.index
             for key, value in i.attr_keyval.iteritems():
-                data['attribute'] = key
-                data['value'] = value
-                self.insert('tko_iteration_attributes', data,
-                            commit=commit)
+                attribute_rows.append((test_idx, i.index, key, value))
             for key, value in i.perf_keyval.iteritems():
-                data['attribute'] = key
                 if math.isnan(value) or math.isinf(value):
-                    data['value'] = None
-                else:
-                    data['value'] = value
-                self.insert('tko_iteration_result', data,
-                            commit=commit)
-
-        data = {'test_idx': test_idx}
-
-        for key, value in test.attributes.iteritems():
-            data = {'test_idx': test_idx, 'attribute': key,
-                    'value': value}
-            try:
-                self.insert('tko_test_attributes', data, commit=commit)
-            except:
-                _log_error('Uploading attribute %r' % (data))
-                raise
+                    value = None
+                result_rows.append((test_idx, i.index, key, value))
+        iteration_fields = ('test_idx', 'iteration', 'attribute', 'value')
+        self.insert_many('tko_iteration_attributes', iteration_fields,
+                         attribute_rows, commit=commit)
+        self.insert_many('tko_iteration_result', iteration_fields,
+                         result_rows, commit=commit)
+
+        test_attribute_rows = [(test_idx, key, value)
+                               for key, value in test.attributes.iteritems()]
+        try:
+            self.insert_many('tko_test_attributes',
+                             ('test_idx', 'attribute', 'value'),
+                             test_attribute_rows, commit=commit)
+        except:
+            _log_error('Uploading attributes %r' % (test_attribute_rows))
+            raise
 
         if not is_update:
-            for label_index in test.labels:
-                data = {'test_id': test_idx, 'testlabel_id': label_index}
-                self.insert('tko_test_labels_tests', data, commit=commit)
+            self.insert_many('tko_test_labels_tests',
+                             ('test_id', 'testlabel_id'),
+                             [(test_idx, label_index)
+                              for label_index in test.labels],
+                             commit=commit)
 
 
     def read_machine_map(self):
@@ -683,6 +998,9 @@ class db_sql(object):
         """
         if job.job_idx is None:
             return None
+        task_reference_id = self._task_reference_cache.get(job.job_idx)
+        if task_reference_id is not None:
+            return task_reference_id
         rows = self.select(
                 'id', 'tko_task_references', {'tko_job_idx': job.job_idx})
         if not rows:
@@ -690,6 +1008,7 @@ class db_sql(object):
         if len(rows) > 1:
             raise MySQLTooManyRows('Got %d tko_task_references for tko_job %d'
                                    % (len(rows), job.job_idx))
+        self._task_reference_cache.put(job.job_idx, rows[0][0])
         return rows[0][0]
 
 
@@ -701,7 +1020,9 @@ class db_sql(object):
         """
         machine_info = self.machine_info_dict(job)
         self.insert('tko_machines', machine_info, commit=commit)
-        return self.get_last_autonumber_value()
+        machine_idx = self.get_last_autonumber_value()
+        self._machine_cache.put(machine_info['hostname'], machine_idx)
+        return machine_idx
 
 
     def _update_machine_information(self, job, commit = None):
@@ -721,9 +1042,13 @@ class db_sql(object):
 
         @param hostname: The hostname as string.
         """
+        machine_idx = self._machine_cache.get(hostname)
+        if machine_idx is not None:
+            return machine_idx
         where = { 'hostname' : hostname }
         rows = self.select('machine_idx', 'tko_machines', where)
         if rows:
+            self._machine_cache.put(hostname, rows[0][0])
             return rows[0][0]
         else:
             return None
@@ -734,9 +1059,13 @@ class db_sql(object):
 
         @param kernel: The kernel object.
         """
+        kernel_idx = self._kernel_cache.get(kernel.kernel_hash)
+        if kernel_idx is not None:
+            return kernel_idx
         rows = self.select('kernel_idx', 'tko_kernels',
                                 {'kernel_hash':kernel.kernel_hash})
         if rows:
+            self._kernel_cache.put(kernel.kernel_hash, rows[0][0])
             return rows[0][0]
         else:
             return None
@@ -777,6 +1106,7 @@ class db_sql(object):
 
         for patch in kernel.patches:
             self.insert_patch(kver, patch, commit=commit)
+        self._kernel_cache.put(kernel.kernel_hash, kver)
         return kver
 
 
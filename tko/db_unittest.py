@@ -7,6 +7,7 @@ from cStringIO import StringIO
 
 import common
 from autotest_lib.tko import db
+from autotest_lib.tko import unittest_lib
 
 
 class LogErrorTestCase(unittest.TestCase):
@@ -36,5 +37,208 @@ class FormatOperationalErrorTestCase(unittest.TestCase):
         self.assertIn('An operational error occurred', got)
 
 
+class _FakeCursor(object):
+    """Records executed statements instead of talking to MySQL."""
+
+    def __init__(self):
+        self.statements = []
+
+
+    def execute(self, sql, values):
+        """Record the statement and its values."""
+        self.statements.append((sql, list(values)))
+
+
+    def fetchall(self):
+        """Every auto number is 1."""
+        return [[1]]
+
+
+class _FakeConnection(object):
+    """Fake connection that ignores commits."""
+
+    def commit(self):
+        """Do nothing."""
+
+
+def _make_fake_db(batch_size):
+    """Build a db_sql object that writes to a _FakeCursor.
+
+    @param batch_size: Rows per batched statement.
+    """
+    fake_db = db.db_sql.__new__(db.db_sql)
+    fake_db.debug = False
+    fake_db.autocommit = False
+    fake_db.batch_size = batch_size
+    fake_db.con = _FakeConnection()
+    fake_db.cur = _FakeCursor()
+    fake_db.status_idx = {'GOOD': 6}
+    fake_db._kernel_cache = db._LookupCache('kernel_idx', 10)
+    fake_db._machine_cache = db._LookupCache('machine_idx', 10)
+    fake_db._task_reference_cache = db._LookupCache('task_reference_id', 10)
+    return fake_db
+
+
+def _make_job():
+    """Build an already inserted job."""
+    return unittest_lib.Record(job_idx=1, machine_idx=1, label='label',
+                               build='build', board=None)
+
+
+def _make_test(num_keyvals):
+    """Build a test with num_keyvals perf keyvals in a single iteration.
+
+    @param num_keyvals: Number of perf keyvals.
+    """
+    perf = dict(('perf_%d' % i, float(i)) for i in xrange(num_keyvals))
+    perf['nan_value'] = float('nan')
+    iteration = unittest_lib.Record(index=1, attr_keyval={'attr': 'value'},
+                                    perf_keyval=perf)
+    return unittest_lib.Record(subdir='subdir', testname='testname',
+                               status='GOOD', reason='',
+                               kernel=unittest_lib.Record(kernel_hash='hash'),
+                               started_time=None, finished_time=None,
+                               iterations=[iteration],
+                               attributes={'key': 'value'}, labels=[1, 2])
+
+
+class BatchedInsertTestCase(unittest.TestCase):
+    """Tests for insert_many(), delete_many() and insert_test()."""
+
+    def test_insert_many_chunks_rows(self):
+        """Test that insert_many splits rows into batch_size statements."""
+        fake_db = _make_fake_db(batch_size=2)
+        fake_db.insert_many('table', ('a', 'b'),
+                            [(1, 2), (3, 4), (5, 6)])
+        self.assertEqual(fake_db.cur.statements, [
+                ('insert into table (`a`,`b`) values (%s,%s),(%s,%s)',
+                 [1, 2, 3, 4]),
+                ('insert into table (`a`,`b`) values (%s,%s)', [5, 6]),
+        ])
+
+
+    def test_insert_many_no_rows(self):
+        """Test that insert_many issues nothing for an empty row list."""
+        fake_db = _make_fake_db(batch_size=2)
+        fake_db.insert_many('table', ('a', 'b'), [])
+        self.assertEqual(fake_db.cur.statements, [])
+
+
+    def test_delete_many_chunks_keys(self):
+        """Test that delete_many splits keys into batch_size statements."""
+        fake_db = _make_fake_db(batch_size=2)
+        fake_db.delete_many('table', 'idx', [1, 2, 3])
+        self.assertEqual(fake_db.cur.statements, [
+                ('delete from table  WHERE `idx` in (%s,%s)', [1, 2]),
+                ('delete from table  WHERE `idx` in (%s)', [3]),
+        ])
+
+
+    def test_insert_test_nan_is_null(self):
+        """Test that NaN perf values are stored as NULL."""
+        fake_db = _make_fake_db(batch_size=1)
+        fake_db.insert_test(_make_job(), _make_test(0))
+        results = [values for sql, values in fake_db.cur.statements
+                   if 'tko_iteration_result' in sql]
+        self.assertEqual(results, [[1, 1, 'nan_value', None]])
+
+
+    def test_insert_test_batched_round_trips(self):
+        """Compare per-row vs. batched insertion of a 50k keyval job."""
+        job = _make_job()
+        num_keyvals = 50000
+
+        per_row_db = _make_fake_db(batch_size=1)
+        per_row_db.insert_test(job, _make_test(num_keyvals))
+        batched_db = _make_fake_db(batch_size=1000)
+        batched_db.insert_test(job, _make_test(num_keyvals))
+
+        def _inserted_rows(fake_db):
+            return sum(len(values) for sql, values in fake_db.cur.statements
+                       if 'insert into tko_iteration_result' in sql) / 4
+
+        self.assertEqual(_inserted_rows(per_row_db), num_keyvals + 1)
+        self.assertEqual(_inserted_rows(batched_db), num_keyvals + 1)
+        self.assertGreater(len(per_row_db.cur.statements), num_keyvals)
+        self.assertLess(len(batched_db.cur.statements), 60)
+
+
+class RollupTestCase(unittest.TestCase):
+    """Tests for the maintenance of tko_test_status_rollups."""
+
+    def _rollup_statements(self, fake_db):
+        """Return the (verb, values) of the statements on the rollups."""
+        return [(sql.split()[0], values) for sql, values
+                in fake_db.cur.statements
+                if 'tko_test_status_rollups' in sql]
+
+
+    def test_insert_test_adds_to_rollup(self):
+        """Test that a new test is counted in its rollup."""
+        fake_db = _make_fake_db(batch_size=1)
+        fake_db.insert_test(_make_job(), _make_test(0))
+        key = ['label', 'build', '', 'testname', 'GOOD']
+        self.assertEqual(self._rollup_statements(fake_db),
+                         [('insert', key + key + [1, 1])])
+
+
+    def test_remove_from_rollups(self):
+        """Test that removed tests are uncounted and the latest recomputed."""
+        fake_db = _make_fake_db(batch_size=1)
+        key = ('label', 'build', '', 'testname', 'GOOD')
+        fake_db._remove_from_rollups([(key, 5), (key, 7)])
+        statements = self._rollup_statements(fake_db)
+        self.assertEqual(statements, [
+                ('update', [2] + list(key)),
+                ('delete', list(key)),
+                ('update', ['label', 'build', 'testname', 'GOOD'] +
+                           list(key) + [5, 7]),
+        ])
+        self.assertIn("(tko_jobs.board is null or tko_jobs.board='')",
+                      fake_db.cur.statements[2][0])
+
+
+class LookupCacheTestCase(unittest.TestCase):
+    """Tests for _LookupCache and its use by db_sql."""
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted."""
+        cache = db._LookupCache('test', 2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+
+    def test_none_is_not_cached(self):
+        """Test that missing rows are looked up again."""
+        cache = db._LookupCache('test', 2)
+        cache.put('a', None)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.misses, 1)
+
+
+    def test_machine_lookup_is_cached(self):
+        """Test that a machine is only looked up in the database once."""
+        fake_db = _make_fake_db(batch_size=1)
+        self.assertEqual(fake_db._lookup_machine('host1'), 1)
+        self.assertEqual(fake_db._lookup_machine('host1'), 1)
+        self.assertEqual(len(fake_db.cur.statements), 1)
+
+
+    def test_rollback_clears_caches(self):
+        """Test that rolled back rows are not served from the cache."""
+        fake_db = _make_fake_db(batch_size=1)
+        fake_db.con.rollback = lambda: None
+        fake_db._lookup_machine('host1')
+        fake_db.rollback()
+        fake_db._lookup_machine('host1')
+        self.assertEqual(len(fake_db.cur.statements), 2)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,7 +1,7 @@
-import json
 import os
 
 from autotest_lib.server.hosts import file_store
+from autotest_lib.client.common_lib import perf_chart
 from autotest_lib.client.common_lib import utils
 from autotest_lib.tko import tast
 from autotest_lib.tko import utils as tko_utils
@@ -182,14 +182,9 @@ class test(object):
             iterations = cls.load_iterations(iteration_keyval)
 
             # Grab perf values from the perf measurements file.
-            perf_values_file = os.path.join(job.dir, subdir,
-                                            'results', 'results-chart.json')
-            perf_values = {}
-            if os.path.exists(perf_values_file):
-                with open(perf_values_file, 'r') as fp:
-                    contents = fp.read()
-                if contents:
-                    perf_values = json.loads(contents)
+            # Values the test did not flush are still in the perf value log.
+            perf_values = perf_chart.load_charts(
+                    os.path.join(job.dir, subdir, 'results'))
 
             # Grab test attributes from the subdir keyval.
             test_keyval = os.path.join(job.dir, subdir, 'keyval')
@@ -4,6 +4,7 @@ import collections
 import errno
 import fcntl
 import json
+import multiprocessing
 import optparse
 import os
 import socket
@@ -21,12 +22,13 @@ from autotest_lib.client.common_lib import global_config
 from autotest_lib.client.common_lib import mail, pidfile
 from autotest_lib.client.common_lib import utils
 from autotest_lib.frontend import setup_django_environment
+from django import db as django_db
 from autotest_lib.frontend.tko import models as tko_models
 from autotest_lib.server import site_utils
 from autotest_lib.server.cros.dynamic_suite import constants
 from autotest_lib.site_utils.sponge_lib import sponge_utils
 from autotest_lib.tko import db as tko_db, utils as tko_utils
-from autotest_lib.tko import models, parser_lib
+from autotest_lib.tko import models, parse_manifest, parser_lib
 from autotest_lib.tko.perf_upload import perf_uploader
 from autotest_lib.utils.side_effects import config_loader
 
@@ -39,7 +41,7 @@ except ImportError:
 _ParseOptions = collections.namedtuple(
     'ParseOptions', ['reparse', 'mail_on_failure', 'dry_run', 'suite_report',
                      'datastore_creds', 'export_to_gcloud_path',
-                     'disable_perf_upload'])
+                     'disable_perf_upload', 'follow'])
 
 _HARDCODED_CONTROL_FILE_NAMES = (
         # client side test control, as saved in old Autotest paths.
@@ -111,6 +113,16 @@ def parse_args():
                       help=("Do not upload perf results to chrome perf."),
                       dest="disable_perf_upload", action="store_true",
                       default=False)
+    parser.add_option("--parse-workers",
+                      help=("Number of worker processes used to parse the "
+                            "machine subdirectories of a multi-machine job "
+                            "concurrently. 1 parses them serially."),
+                      dest="parse_workers", type="int", default=1)
+    parser.add_option("--follow",
+                      help=("Parse a running job, following its status log "
+                            "until autoserv exits, rather than waiting for "
+                            "the job to finish."),
+                      dest="follow", action="store_true", default=False)
     options, args = parser.parse_args()
 
     # we need a results directory
@@ -357,8 +369,12 @@ def parse_one(db, pid_file_manager, jobname, path, parse_options):
     if not status_log_path:
         tko_utils.dprint("! Unable to parse job, no status file")
         return
-    _parse_status_log(parser, job, status_log_path)
+    is_done = None
+    if parse_options.follow:
+        is_done = lambda: _autoserv_exited(path)
+    _parse_status_log(parser, job, status_log_path, is_done)
 
+    manifest = parse_manifest.ParseManifest(path)
     if old_job_idx is not None:
         job.job_idx = old_job_idx
         unmatched_tests = _match_existing_tests(db, job)
@@ -435,7 +451,7 @@ def parse_one(db, pid_file_manager, jobname, path, parse_options):
         if sponge_url:
             job.keyval_dict['sponge_url'] = sponge_url
 
-        _write_job_to_db(db, jobname, job)
+        _write_job_to_db(db, jobname, job, manifest)
 
         # Verify the job data is written to the database.
         if job.tests:
@@ -475,6 +491,7 @@ def parse_one(db, pid_file_manager, jobname, path, parse_options):
 
     if not dry_run:
         db.commit()
+        manifest.save()
 
     # Generate a suite report.
     # Check whether this is a suite job, a suite job will be a hostless job, its
@@ -531,7 +548,7 @@ def parse_one(db, pid_file_manager, jobname, path, parse_options):
                 json.dump(gs_offloader_instructions, f)
 
 
-def _write_job_to_db(db, jobname, job):
+def _write_job_to_db(db, jobname, job, manifest):
     """Write all TKO data associated with a job to DB.
 
     This updates the job object as a side effect.
@@ -539,6 +556,8 @@ def _write_job_to_db(db, jobname, job):
     @param db: tko.db.db_sql object.
     @param jobname: Name of the job to write.
     @param job: tko.models.job object.
+    @param manifest: parse_manifest.ParseManifest of the job. Tests already in
+                     the DB whose inputs did not change are not rewritten.
     """
     db.insert_or_update_machine(job)
     db.insert_job(jobname, job)
@@ -547,8 +566,16 @@ def _write_job_to_db(db, jobname, job):
             'skylab' if tko_utils.is_skylab_task(jobname) else 'afe',
     )
     db.update_job_keyvals(job)
+    skipped = 0
     for test in job.tests:
+        changed = manifest.test_changed(job, test)
+        if not changed and hasattr(test, 'test_idx'):
+            skipped += 1
+            continue
         db.insert_test(job, test)
+    if skipped:
+        tko_utils.dprint('Skipped %d unchanged tests of %s' %
+                         (skipped, jobname))
 
 
 def _find_status_log_path(path):
@@ -559,18 +586,45 @@ def _find_status_log_path(path):
     return ""
 
 
-def _parse_status_log(parser, job, status_log_path):
-    status_lines = open(status_log_path).readlines()
-    parser.start(job)
-    tests = parser.end(status_lines)
+def _autoserv_exited(path):
+    """Check whether the autoserv writing the results of a job exited.
+
+    @param path: The path to the results of the job.
+    @return: True if autoserv wrote its exit status to its pidfile, or if
+             there is no pidfile.
+    """
+    top_dir = tko_utils.find_toplevel_job_dir(path)
+    if not top_dir:
+        return True
+    with open(os.path.join(top_dir, '.autoserv_execute')) as f:
+        return len(f.readlines()) >= 2
+
+
+def _parse_status_log(parser, job, status_log_path, is_done=None):
+    """Parse a status log into job.tests.
 
-    # parser.end can return the same object multiple times, so filter out dups
+    The log is streamed through the parser rather than read in one go.
+
+    @param parser: A tko parser object.
+    @param job: tko.models.job object.
+    @param status_log_path: Path to the status log.
+    @param is_done: If set, the log is still being written and is followed
+                    until this callable returns True.
+    """
+    parser.start(job)
     job.tests = []
     already_added = set()
-    for test in tests:
-        if test not in already_added:
-            already_added.add(test)
-            job.tests.append(test)
+    with open(status_log_path) as status_log:
+        if is_done is not None:
+            status_lines = tko_utils.follow_file(status_log, is_done)
+        else:
+            status_lines = status_log
+        # The parser can return the same object multiple times, so filter
+        # out dups.
+        for test in parser.process_stream(status_lines):
+            if test not in already_added:
+                already_added.add(test)
+                job.tests.append(test)
 
 
 def _match_existing_tests(db, job):
@@ -599,14 +653,12 @@ def _match_existing_tests(db, job):
 
 
 def _delete_tests_from_db(db, tests):
-    for test_idx in tests.itervalues():
-        where = {'test_idx' : test_idx}
-        db.delete('tko_iteration_result', where)
-        db.delete('tko_iteration_perf_value', where)
-        db.delete('tko_iteration_attributes', where)
-        db.delete('tko_test_attributes', where)
-        db.delete('tko_test_labels_tests', {'test_id': test_idx})
-        db.delete('tko_tests', where)
+    """Delete the given tests and all of their data from the DB.
+
+    @param db: tko.db.db_sql object.
+    @param tests: A dict mapping (testname, subdir) to test_idx.
+    """
+    db.delete_tests(tests.values())
 
 
 def _get_job_subdirs(path):
@@ -648,12 +700,87 @@ def parse_leaf_path(db, pid_file_manager, path, level, parse_options):
     """
     job_elements = path.split("/")[-level:]
     jobname = "/".join(job_elements)
-    db.run_with_retry(parse_one, db, pid_file_manager, jobname, path,
-                      parse_options)
+    start_time = time.time()
+    with metrics.SecondsTimer(
+            'chromeos/autotest/tko_parse/leaf_path_duration'):
+        db.run_with_retry(parse_one, db, pid_file_manager, jobname, path,
+                          parse_options)
+    tko_utils.dprint('Finished parsing %s after %.2f seconds' %
+                     (path, time.time() - start_time))
+    tko_utils.dprint('DB lookup caches: %s' % db.cache_stats())
     return jobname
 
 
-def parse_path(db, pid_file_manager, path, level, parse_options):
+class _FailedTestCounter(object):
+    """Stands in for the PidFileManager inside parse worker processes.
+
+    parse_one only counts failed tests on the pid file manager; workers
+    report the count back to the parent, which owns the real pid file.
+    """
+
+    def __init__(self):
+        self.num_tests_failed = 0
+
+
+# Database handle of a parse worker process, see _init_parse_worker.
+_worker_db = None
+
+
+def _init_parse_worker(db_args):
+    """Initialize a parse worker process with its own DB connections.
+
+    @param db_args: Keyword arguments for tko_db.db.
+    """
+    global _worker_db
+    # Never share the parent's django connection with the forked child.
+    django_db.connection.close()
+    _worker_db = tko_db.db(**db_args)
+
+
+def _parse_leaf_path_in_worker(args):
+    """Parse a leaf path in a parse worker process.
+
+    @param args: A (path, level, parse_options tuple) tuple. The options are
+                 passed as a plain tuple since _ParseOptions can't be
+                 pickled.
+
+    @returns: A (jobname, number of failed tests) tuple.
+    """
+    path, level, parse_options = args
+    counter = _FailedTestCounter()
+    jobname = parse_leaf_path(_worker_db, counter, path, level,
+                              _ParseOptions(*parse_options))
+    return jobname, counter.num_tests_failed
+
+
+def _parse_leaf_paths(db, pid_file_manager, paths, level, parse_options,
+                      pool):
+    """Parse sibling leaf paths, concurrently if a worker pool is given.
+
+    @param db: database handle.
+    @param pid_file_manager: pidfile.PidFileManager object.
+    @param paths: A list of leaf paths to parse.
+    @param level: Integer, level of subdirectories to include in the job name.
+    @param parse_options: _ParseOptions instance.
+    @param pool: A multiprocessing.Pool of parse workers, or None.
+
+    @returns: A list of job names of the parsed jobs, in the order of paths.
+    """
+    if pool is None or len(paths) < 2:
+        return [parse_leaf_path(db, pid_file_manager, path, level,
+                                parse_options)
+                for path in paths]
+
+    work = [(path, level, tuple(parse_options)) for path in paths]
+    jobnames = []
+    for jobname, num_tests_failed in pool.map(_parse_leaf_path_in_worker,
+                                              work, chunksize=1):
+        pid_file_manager.num_tests_failed += num_tests_failed
+        jobnames.append(jobname)
+    return jobnames
+
+
+def parse_path(db, pid_file_manager, path, level, parse_options, pool=None):
     """Parse a path
 
     @param db: database handle.
@@ -661,6 +788,9 @@ def parse_path(db, pid_file_manager, path, level, parse_options):
     @param path: The path to the results to be parsed.
     @param level: Integer, level of subdirectories to include in the job name.
     @param parse_options: _ParseOptions instance.
+    @param pool: A multiprocessing.Pool used to parse the machine
+                 subdirectories of a multi-machine job concurrently. If None,
+                 everything is parsed serially.
 
     @returns: A set of job names of the parsed jobs.
               set(['123-chromeos-test/host1', '123-chromeos-test/host2'])
@@ -676,11 +806,18 @@ def parse_path(db, pid_file_manager, path, level, parse_options):
                                       parse_options)
             processed_jobs.add(new_job)
         # multi-machine job
-        for subdir in job_subdirs:
+        leaf_paths = []
+        for subdir in sorted(job_subdirs):
             jobpath = os.path.join(path, subdir)
-            new_jobs = parse_path(db, pid_file_manager, jobpath, level + 1,
-                                  parse_options)
-            processed_jobs.update(new_jobs)
+            if _get_job_subdirs(jobpath) is None:
+                leaf_paths.append(jobpath)
+            else:
+                new_jobs = parse_path(db, pid_file_manager, jobpath,
+                                      level + 1, parse_options, pool)
+                processed_jobs.update(new_jobs)
+        new_jobs = _parse_leaf_paths(db, pid_file_manager, leaf_paths,
+                                     level + 1, parse_options, pool)
+        processed_jobs.update(new_jobs)
     else:
         # single machine job
         new_job = parse_leaf_path(db, pid_file_manager, path, level,
@@ -735,9 +872,10 @@ def _main_with_options(options, args):
                                   options.dry_run, options.suite_report,
                                   options.datastore_creds,
                                   options.export_to_gcloud_path,
-                                  options.disable_perf_upload)
+                                  options.disable_perf_upload, options.follow)
 
     pid_file_manager = pidfile.PidFileManager("parser", results_dir)
+    pool = None
 
     if options.write_pidfile:
         pid_file_manager.open_file()
@@ -751,9 +889,16 @@ def _main_with_options(options, args):
                          for subdir in os.listdir(results_dir)]
 
         # build up the database
-        db = tko_db.db(autocommit=False, host=options.db_host,
+        db_args = dict(autocommit=False, host=options.db_host,
                        user=options.db_user, password=options.db_pass,
                        database=options.db_name)
+        db = tko_db.db(**db_args)
+
+        # Each worker opens its own database connection.
+        if options.parse_workers > 1:
+            pool = multiprocessing.Pool(processes=options.parse_workers,
+                                        initializer=_init_parse_worker,
+                                        initargs=(db_args,))
 
         # parse all the jobs
         for path in jobs_list:
@@ -772,7 +917,7 @@ def _main_with_options(options, args):
                     raise # something unexpected happened
             try:
                 new_jobs = parse_path(db, pid_file_manager, path, options.level,
-                                      parse_options)
+                                      parse_options, pool)
                 processed_jobs.update(new_jobs)
 
             finally:
@@ -784,6 +929,10 @@ def _main_with_options(options, args):
         raise
     else:
         pid_file_manager.close_file(0)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
 
 
 def _update_db_config_from_json(options, test_results_dir):
@@ -0,0 +1,167 @@
+# Copyright 2019 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Fingerprints of parsed test inputs, used to make reparses incremental.
+
+A manifest is kept next to the results of every parsed job. For each test it
+records a digest of everything insert_test writes to the database: the
+fields parsed from the status log, the job's machine and rollup fields, the
+test attributes and the size, mtime and hash of the test's keyval files. On reparse, tests whose digest did not
+change don't need to be deleted from and re-inserted into the database.
+"""
+
+import hashlib
+import json
+import os
+
+import common
+from autotest_lib.tko import utils as tko_utils
+
+# Name of the manifest file, written in the job results directory.
+MANIFEST_FILE = '.parse_manifest.json'
+
+# Bump this whenever the digest computation changes, so that old manifests
+# are ignored instead of being trusted.
+_MANIFEST_VERSION = 2
+
+# Files under a test's subdir whose contents are written to the database.
+_TEST_INPUT_FILES = (
+        # Iteration attributes and results.
+        os.path.join('results', 'keyval'),
+        # Test attributes.
+        'keyval',
+)
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _hash_file(path):
+    """Return the sha1 hex digest of a file, reading it in chunks.
+
+    @param path: Path to the file.
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), ''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _test_key(test):
+    """Return the manifest key of a test, unique within a job.
+
+    @param test: tko.models.test object.
+    """
+    return json.dumps([test.testname, test.subdir])
+
+
+class ParseManifest(object):
+    """Input fingerprints of the tests of one job directory."""
+
+    def __init__(self, job_dir):
+        """
+        @param job_dir: The job results directory.
+        """
+        self.job_dir = job_dir
+        self.path = os.path.join(job_dir, MANIFEST_FILE)
+        self._old_files, self._old_tests = self._load()
+        self._files = {}
+        self._tests = {}
+
+
+    def _load(self):
+        """Load the manifest of a previous parse.
+
+        @return: A (files, tests) tuple of dicts, empty if there is no usable
+                 manifest.
+        """
+        if not os.path.exists(self.path):
+            return {}, {}
+        try:
+            with open(self.path) as f:
+                manifest = json.load(f)
+        except (IOError, ValueError) as e:
+            tko_utils.dprint('Ignoring unreadable parse manifest %s: %s' %
+                             (self.path, e))
+            return {}, {}
+        if manifest.get('version') != _MANIFEST_VERSION:
+            return {}, {}
+        return manifest.get('files', {}), manifest.get('tests', {})
+
+
+    def _file_fingerprint(self, relpath):
+        """Return the (size, mtime, sha1) fingerprint of a file.
+
+        The file is only hashed if its size or mtime changed since the
+        previous parse.
+
+        @param relpath: Path of the file, relative to the job directory.
+
+        @return: A [size, mtime, sha1] list, or None if the file is missing.
+        """
+        if relpath in self._files:
+            return self._files[relpath]
+        try:
+            st = os.stat(os.path.join(self.job_dir, relpath))
+        except OSError:
+            fingerprint = None
+        else:
+            old = self._old_files.get(relpath)
+            if old and old[:2] == [st.st_size, st.st_mtime]:
+                fingerprint = old
+            else:
+                fingerprint = [st.st_size, st.st_mtime,
+                               _hash_file(os.path.join(self.job_dir, relpath))]
+        self._files[relpath] = fingerprint
+        return fingerprint
+
+
+    def _test_digest(self, job, test):
+        """Return a digest of all the database content of a test.
+
+        @param job: tko.models.job object the test belongs to.
+        @param test: tko.models.test object.
+        """
+        # insert_test also writes the job's machine and rollup fields.
+        inputs = [job.machine, job.machine_idx, job.label, job.build,
+                  job.board,
+                  test.testname, test.subdir, test.status, test.reason,
+                  str(test.started_time), str(test.finished_time),
+                  test.kernel.kernel_hash, sorted(test.labels),
+                  sorted(test.attributes.iteritems())]
+        if test.subdir:
+            for name in _TEST_INPUT_FILES:
+                fingerprint = self._file_fingerprint(
+                        os.path.join(test.subdir, name))
+                # Only the content matters, not when it was written. The
+                # hash may come back from JSON as unicode, so normalize it.
+                inputs.append(fingerprint and str(fingerprint[2]))
+        return hashlib.sha1(repr(inputs)).hexdigest()
+
+
+    def test_changed(self, job, test):
+        """Record the digest of a test, and check it against the last parse.
+
+        @param job: tko.models.job object the test belongs to, after
+                    insert_or_update_machine set its machine_idx.
+        @param test: tko.models.test object.
+
+        @return: True if the test is new or its database content changed
+                 since the previous parse.
+        """
+        key = _test_key(test)
+        digest = self._test_digest(job, test)
+        self._tests[key] = digest
+        return self._old_tests.get(key) != digest
+
+
+    def save(self):
+        """Write the digests recorded by test_changed to the manifest."""
+        manifest = {'version': _MANIFEST_VERSION,
+                    'files': self._files,
+                    'tests': self._tests}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.rename(tmp_path, self.path)
@@ -0,0 +1,118 @@
+#!/usr/bin/python2
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import common
+from autotest_lib.tko import parse_manifest
+from autotest_lib.tko import unittest_lib
+
+
+def _make_test(status='GOOD', subdir='test'):
+    """Build a minimal test record.
+
+    @param status: Status of the test.
+    @param subdir: Subdir of the test.
+    """
+    return unittest_lib.Record(testname='test', subdir=subdir, status=status,
+                               reason='', started_time=None,
+                               finished_time=None,
+                               kernel=unittest_lib.Record(kernel_hash='hash'),
+                               labels=[], attributes={'key': 'value'})
+
+
+def _make_job(machine='host1', machine_idx=1):
+    """Build a minimal job record.
+
+    @param machine: Hostname of the job.
+    @param machine_idx: Index of the job's machine in the database.
+    """
+    return unittest_lib.Record(machine=machine, machine_idx=machine_idx,
+                               label='label', build='build', board=None)
+
+
+class ParseManifestTest(unittest.TestCase):
+    """Tests for ParseManifest."""
+
+    def setUp(self):
+        self.job_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.job_dir, 'test', 'results'))
+        self._write_keyval('perf=1\n')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.job_dir)
+
+
+    def _write_keyval(self, contents, mtime=None):
+        """Write the iteration keyval of the test."""
+        path = os.path.join(self.job_dir, 'test', 'results', 'keyval')
+        with open(path, 'w') as f:
+            f.write(contents)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+
+    def _reparse(self, test, job=None):
+        """Check a test against the saved manifest, then save a new one."""
+        manifest = parse_manifest.ParseManifest(self.job_dir)
+        changed = manifest.test_changed(job or _make_job(), test)
+        manifest.save()
+        return changed
+
+
+    def test_new_test_is_changed(self):
+        """Test that a test missing from the manifest is reported changed."""
+        self.assertTrue(self._reparse(_make_test()))
+
+
+    def test_unchanged_test(self):
+        """Test that a test with the same inputs is reported unchanged."""
+        self._reparse(_make_test())
+        self.assertFalse(self._reparse(_make_test()))
+
+
+    def test_status_change(self):
+        """Test that a status change is detected."""
+        self._reparse(_make_test())
+        self.assertTrue(self._reparse(_make_test(status='FAIL')))
+
+
+    def test_machine_change(self):
+        """Test that a change of the job's machine is detected."""
+        self._reparse(_make_test())
+        self.assertTrue(self._reparse(
+                _make_test(), _make_job(machine='host2', machine_idx=2)))
+
+
+    def test_keyval_content_change(self):
+        """Test that a keyval content change is detected."""
+        self._write_keyval('perf=1\n', mtime=1000)
+        self._reparse(_make_test())
+        self._write_keyval('perf=2\n', mtime=1000)
+        os.utime(os.path.join(self.job_dir, 'test', 'results', 'keyval'),
+                 (2000, 2000))
+        self.assertTrue(self._reparse(_make_test()))
+
+
+    def test_touched_keyval_is_unchanged(self):
+        """Test that only keyval content matters, not its mtime."""
+        self._write_keyval('perf=1\n', mtime=1000)
+        self._reparse(_make_test())
+        self._write_keyval('perf=1\n', mtime=2000)
+        self.assertFalse(self._reparse(_make_test()))
+
+
+    def test_corrupt_manifest_is_ignored(self):
+        """Test that an unreadable manifest makes every test changed."""
+        self._reparse(_make_test())
+        with open(os.path.join(self.job_dir,
+                               parse_manifest.MANIFEST_FILE), 'w') as f:
+            f.write('{')
+        self.assertTrue(self._reparse(_make_test()))
+
+
+if __name__ == '__main__':
+    unittest.main()
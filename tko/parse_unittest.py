@@ -0,0 +1,190 @@
+#!/usr/bin/python2
+
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+import common
+from autotest_lib.frontend import setup_django_environment
+from autotest_lib.frontend import setup_test_environment
+from autotest_lib.tko import parse
+
+
+class _FakeDb(object):
+    """Stands in for tko_db.db, remembering the process which created it."""
+
+    def __init__(self, **dargs):
+        self.dargs = dargs
+        self.pid = os.getpid()
+
+
+    def run_with_retry(self, function, *args, **dargs):
+        """Call the function, without retries."""
+        return function(*args, **dargs)
+
+
+    def cache_stats(self):
+        """Return empty cache statistics."""
+        return {}
+
+
+def _fake_parse_one(db, pid_file_manager, jobname, path, parse_options):
+    """Record how a job was parsed in its results directory.
+
+    Each job has one failed test.
+    """
+    with open(os.path.join(path, 'parsed.json'), 'w') as f:
+        json.dump({'db_pid': db.pid, 'db_args': db.dargs, 'pid': os.getpid(),
+                   'jobname': jobname, 'reparse': parse_options.reparse}, f)
+    pid_file_manager.num_tests_failed += 1
+
+
+class ParseLeafPathsTest(unittest.TestCase):
+    """Tests for parsing the machines of a job in parse workers."""
+
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+        self.paths = []
+        for machine in ('host1', 'host2'):
+            path = os.path.join(self.results_dir, '123-chromeos-test', machine)
+            os.makedirs(path)
+            self.paths.append(path)
+        # The workers are forked, so they inherit the fakes.
+        self._saved_db, self._saved_parse_one = parse.tko_db.db, parse.parse_one
+        parse.tko_db.db = _FakeDb
+        parse.parse_one = _fake_parse_one
+
+
+    def tearDown(self):
+        parse.tko_db.db, parse.parse_one = self._saved_db, self._saved_parse_one
+        shutil.rmtree(self.results_dir)
+
+
+    def test_parse_in_pool(self):
+        db_args = {'autocommit': False, 'host': 'tko-db'}
+        pool = multiprocessing.Pool(processes=2,
+                                    initializer=parse._init_parse_worker,
+                                    initargs=(db_args,))
+        pid_file_manager = parse._FailedTestCounter()
+        parse_options = parse._ParseOptions(
+                reparse=True, mail_on_failure=False, dry_run=False,
+                suite_report=False, datastore_creds=None,
+                export_to_gcloud_path=None, disable_perf_upload=False,
+                follow=False)
+        try:
+            jobnames = parse._parse_leaf_paths(
+                    None, pid_file_manager, self.paths, 2, parse_options, pool)
+        finally:
+            pool.close()
+            pool.join()
+
+        self.assertEqual(jobnames, ['123-chromeos-test/host1',
+                                    '123-chromeos-test/host2'])
+        self.assertEqual(pid_file_manager.num_tests_failed, 2)
+        for path, jobname in zip(self.paths, jobnames):
+            with open(os.path.join(path, 'parsed.json')) as f:
+                parsed = json.load(f)
+            # Each job is parsed by a worker, with the db its initializer
+            # created.
+            self.assertNotEqual(parsed['pid'], os.getpid())
+            self.assertEqual(parsed['db_pid'], parsed['pid'])
+            self.assertEqual(parsed['db_args'], db_args)
+            self.assertEqual(parsed['jobname'], jobname)
+            self.assertTrue(parsed['reparse'])
+
+
+def _status_lines(num_tests):
+    """Return the lines of a status log of tests which passed."""
+    lines = []
+    for i in xrange(num_tests):
+        fields = ('test%d' % i, 'test%d' % i,
+                  'timestamp=%d' % (1500000000 + i),
+                  'localtime=Jul 14 02:40:%02d' % i)
+        lines.append('START\t%s\n' % '\t'.join(fields))
+        lines.append('\tGOOD\t%s\tcompleted\n' % '\t'.join(fields))
+        lines.append('END GOOD\t%s\n' % '\t'.join(fields))
+    return lines
+
+
+class ParseStatusLogTest(unittest.TestCase):
+    """Tests for streaming status logs through the parser."""
+
+    def setUp(self):
+        self.job_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.job_dir, 'keyval'), 'w') as f:
+            f.write('hostname=host1\n')
+        os.mkdir(os.path.join(self.job_dir, 'host_keyvals'))
+        with open(os.path.join(self.job_dir, 'host_keyvals', 'host1'),
+                  'w') as f:
+            f.write('labels=board%3Alink\n')
+        self.status_log_path = os.path.join(self.job_dir, 'status.log')
+        self.parser = parse.parser_lib.parser(1)
+        self.job = self.parser.make_job(self.job_dir)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.job_dir)
+
+
+    def _parse_at_once(self, lines):
+        """Return the (name, status) of the tests of a one-shot parse."""
+        self.parser.start(self.job)
+        tests = []
+        for test in self.parser.end(lines):
+            if test not in tests:
+                tests.append(test)
+        return [(test.testname, test.status) for test in tests]
+
+
+    def test_process_stream_across_chunks(self):
+        lines = _status_lines(5)
+        expected = self._parse_at_once(lines)
+        self.assertIn(('test4', 'GOOD'), expected)
+
+        self.parser.start(self.job)
+        tests = []
+        # The tests end in the middle of chunks.
+        for test in self.parser.process_stream(iter(lines), chunk_size=4):
+            if test not in tests:
+                tests.append(test)
+        self.assertEqual([(test.testname, test.status) for test in tests],
+                         expected)
+
+
+    def test_parse_status_log_following(self):
+        lines = _status_lines(4)
+        expected = self._parse_at_once(lines)
+        with open(self.status_log_path, 'w') as f:
+            # The log ends in the middle of a line.
+            f.write(''.join(lines[:5]) + lines[5][:10])
+        remaining = [''.join(lines[5:])[10:]]
+
+        def is_done():
+            """Write the rest of the log the first time."""
+            if not remaining:
+                return True
+            with open(self.status_log_path, 'a') as f:
+                f.write(remaining.pop())
+            return False
+
+        parse._parse_status_log(self.parser, self.job, self.status_log_path,
+                                is_done)
+        self.assertEqual([(test.testname, test.status)
+                          for test in self.job.tests], expected)
+
+
+    def test_autoserv_exited(self):
+        execute_path = os.path.join(self.job_dir, '.autoserv_execute')
+        with open(execute_path, 'w') as f:
+            f.write('1234\n')
+        self.assertFalse(parse._autoserv_exited(self.job_dir))
+        with open(execute_path, 'a') as f:
+            f.write('0\n0\n')
+        self.assertTrue(parse._autoserv_exited(self.job_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,11 @@ import traceback
 from autotest_lib.tko import status_lib, utils as tko_utils
 
 
+# Number of status lines buffered by process_stream before they are fed
+# into the parser state machine.
+STREAM_CHUNK_SIZE = 1000
+
+
 class parser(object):
     """
     Abstract parser base class. Provides a generic implementation of the
@@ -57,6 +62,24 @@ class parser(object):
             return []
 
 
+    def process_stream(self, lines, chunk_size=STREAM_CHUNK_SIZE):
+        """ Feed an iterable of status lines (e.g. an open file or a
+        tko.utils.follow_file generator) into the parser state machine in
+        chunks of at most 'chunk_size' lines, and end() it once the
+        iterable is exhausted. This is a generator yielding new test
+        results as soon as they are produced, so neither the status log
+        nor the line buffer is ever held in memory as a whole."""
+        chunk = []
+        for line in lines:
+            chunk.append(line)
+            if len(chunk) >= chunk_size:
+                for test in self.process_lines(chunk):
+                    yield test
+                chunk = []
+        for test in self.end(chunk):
+            yield test
+
+
     @staticmethod
     def make_job(dir):
         """ Create a new instance of the job model used by the
@@ -0,0 +1,12 @@
+# Copyright 2019 The Chromium OS Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Helpers shared by the tko unit tests."""
+
+
+class Record(object):
+    """Bag of attributes standing in for tko.models objects."""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
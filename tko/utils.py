@@ -2,6 +2,7 @@ import datetime
 import os
 import re
 import sys
+import time
 
 
 _debug_logger = sys.stderr
@@ -39,6 +40,36 @@ def find_toplevel_job_dir(start_dir):
     return job_dir
 
 
+def follow_file(f, is_done, poll_interval=1):
+    """ Generator yielding complete lines of a file that is still being
+    written, like 'tail -f'. Partial trailing lines are held back until
+    their newline shows up. Stops once is_done() returns True and all the
+    data in the file has been consumed.
+
+    @param f: a file object opened for reading.
+    @param is_done: callable returning True when no more data will be
+                    appended to the file.
+    @param poll_interval: seconds to sleep when no new data is available.
+    """
+    partial = ''
+    while True:
+        line = f.readline()
+        if line:
+            partial += line
+            if partial.endswith('\n'):
+                yield partial
+                partial = ''
+            continue
+        # Check is_done before the final read, so that data written just
+        # before the writer finished is not lost.
+        if is_done():
+            partial += f.read()
+            for line in partial.splitlines(True):
+                yield line
+            return
+        time.sleep(poll_interval)
+
+
 def drop_redundant_messages(messages):
     """ Given a set of message strings discard any 'redundant' messages which
     are simple a substring of the existing ones.
@@ -126,5 +126,36 @@ class drop_redundant_messages(unittest.TestCase):
                 set(["abcdef", "defghi"]))
 
 
+class _GrowingFile(object):
+    """File whose readline() replays a scripted sequence of reads."""
+    def __init__(self, reads, remainder=''):
+        self.reads = list(reads)
+        self.remainder = remainder
+
+
+    def readline(self):
+        return self.reads.pop(0) if self.reads else ''
+
+
+    def read(self):
+        remainder, self.remainder = self.remainder, ''
+        return remainder
+
+
+class follow_file(unittest.TestCase):
+    def test_yields_complete_lines_only(self):
+        f = _GrowingFile(['a\n', 'b', '', 'c\n'])
+        done = iter([False, True]).next
+        self.assertEqual(list(utils.follow_file(f, done, poll_interval=0)),
+                         ['a\n', 'bc\n'])
+
+
+    def test_reads_data_written_before_done(self):
+        f = _GrowingFile(['a\n'], remainder='b\nc')
+        done = lambda: True
+        self.assertEqual(list(utils.follow_file(f, done, poll_interval=0)),
+                         ['a\n', 'b\n', 'c'])
+
+
 if __name__ == "__main__":
     unittest.main()